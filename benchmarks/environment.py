@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import resource
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def configure(workdir: str, backend: str = 'sqlite', role: str = 'all', **task_overrides) -> None:
+    """Points the app at `workdir` and lifts the limits; call before importing `src`."""
+    if any(name == 'src' or name.startswith('src.') for name in sys.modules):
+        raise RuntimeError("configure() has to run before the app is imported")
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.environ['YTDLP_HOST_ROLE'] = role
+
+    import config
+    os.makedirs(os.path.join(workdir, 'jsons'), exist_ok=True)
+    config.node.ROLE = role
+    config.storage.DOWNLOAD_DIR = os.path.join(workdir, 'downloads')
+    config.storage.TASKS_FILE = os.path.join(workdir, 'jsons', 'tasks.json')
+    config.storage.KEYS_FILE = os.path.join(workdir, 'jsons', 'api_keys.json')
+    config.storage.USAGE_FILE = os.path.join(workdir, 'jsons', 'usage.json')
+    config.storage.DATABASE_FILE = os.path.join(workdir, 'jsons', 'storage.db')
+    config.storage.BACKEND = backend
+    config.metrics.METRICS_DIR = os.path.join(workdir, 'metrics')
+    config.task.REQUEST_LIMIT = 10 ** 9
+    config.memory.DEFAULT_QUOTA_BYTES = 1 << 50
+    config.memory.AVAILABLE_BYTES = 1 << 50
+    for name, value in task_overrides.items():
+        setattr(config.task, name, value)
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def storage_io() -> Dict[str, float]:
+    """Storage calls per operation and bytes moved, as recorded by src.metrics."""
+    from src import metrics
+    io = {}
+    for (operation,), value in metrics.STORAGE_SECONDS.samples():
+        io[operation] = sum(value[:-1])
+    for (direction,), value in metrics.STORAGE_BYTES.samples():
+        io[f'bytes_{direction}'] = value
+    return io
+
+def time_calls(fn: Callable[[], object], max_seconds: float, max_calls: int) -> List[float]:
+    """Calls `fn` until either limit is reached; returns each call's duration."""
+    durations = []
+    deadline = time.perf_counter() + max_seconds
+    while len(durations) < max_calls and time.perf_counter() < deadline:
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
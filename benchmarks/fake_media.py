@@ -0,0 +1,123 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+
+VIDEO_HEIGHTS = (360, 720, 1080)
+AUDIO_BITRATES = (64, 128)
+CHUNK = bytes(range(256)) * 256
+MEDIA_PATH_RE = re.compile(r'^/media/(\d+)/')
+
+class _MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _size(self) -> Optional[int]:
+        match = MEDIA_PATH_RE.match(self.path)
+        return int(match.group(1)) if match else None
+
+    def _send_headers(self) -> Optional[int]:
+        size = self._size()
+        if size is None:
+            self.send_error(404)
+            return None
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        return size
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        remaining = self._send_headers()
+        while remaining:
+            chunk = CHUNK[:remaining]
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, *args):
+        pass
+
+class MediaServer:
+    """Serves deterministic bytes at /media/<size>/<name>, so nothing is kept on disk."""
+
+    def __init__(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _MediaHandler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def start(self) -> None:
+        threading.Thread(target=self.httpd.serve_forever, name='media-server', daemon=True).start()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+
+def synthetic_formats(media_url: str, video_id: str, media_size: int, count: int = 0) -> List[dict]:
+    """Progressive video formats and audio-only formats shaped like YouTube's.
+
+    There are no video-only formats, so `bestvideo+bestaudio/best` falls back
+    to a single file and downloads never need ffmpeg. `count` adds extra
+    formats for benchmarks that only look at the list.
+    """
+    formats = []
+    for abr in AUDIO_BITRATES:
+        size = media_size // 4
+        formats.append({
+            'format_id': f'audio-{abr}', 'url': f'{media_url}/media/{size}/{video_id}.m4a', 'ext': 'm4a',
+            'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': abr, 'audio_channels': 2,
+            'language': 'en', 'filesize': size, 'protocol': 'http'
+        })
+    for i, height in enumerate(VIDEO_HEIGHTS):
+        size = media_size * (i + 1)
+        formats.append({
+            'format_id': f'{height}p', 'url': f'{media_url}/media/{size}/{video_id}.mp4', 'ext': 'mp4',
+            'vcodec': 'avc1.4d401f', 'acodec': 'mp4a.40.2', 'height': height, 'width': height * 16 // 9,
+            'fps': 30, 'format_note': f'{height}p', 'filesize': size, 'protocol': 'http'
+        })
+    for i in range(count):
+        height = 144 + i
+        formats.append({
+            'format_id': f'extra-{i}', 'url': f'{media_url}/media/{media_size}/{video_id}-{i}.mp4', 'ext': 'mp4',
+            'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': height, 'width': height * 16 // 9,
+            'fps': 30, 'format_note': f'{height}p', 'filesize_approx': media_size, 'protocol': 'http'
+        })
+    return formats
+
+class FakeIE(InfoExtractor):
+    IE_NAME = 'bench'
+    _VALID_URL = r'https?://bench\.invalid/watch/(?P<id>[\w-]+)'
+    media_url = ''
+    media_size = 256 * 1024
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return {
+            'id': video_id,
+            'title': f'Benchmark video {video_id}',
+            'duration': 60,
+            'formats': synthetic_formats(self.media_url, video_id, self.media_size),
+        }
+
+class BenchYoutubeDL(yt_dlp.YoutubeDL):
+    def __init__(self, params=None, auto_init=True):
+        # Keep the benchmark report readable
+        params = {**(params or {}), 'quiet': True, 'noprogress': True}
+        super().__init__(params, auto_init)
+        # The generic extractor accepts any URL, so the fake one has to come first
+        ie = FakeIE()
+        ie.set_downloader(self)
+        self._ies = {FakeIE.ie_key(): ie, **self._ies}
+        self._ies_instances[FakeIE.ie_key()] = ie
+
+def install(media_url: str, media_size: int) -> None:
+    """Makes every YoutubeDL the app creates resolve bench.invalid URLs offline."""
+    FakeIE.media_url = media_url
+    FakeIE.media_size = media_size
+    yt_dlp.YoutubeDL = BenchYoutubeDL
+
+def video_url(video_id: str) -> str:
+    return f'https://bench.invalid/watch/{video_id}'
@@ -0,0 +1,131 @@
+"""End-to-end load test against an in-process server and a fake video site.
+
+    python -m benchmarks.load --tasks 200 --concurrency 16 --mix video=3,info=1
+
+Each client submits a task, polls /status until it finishes and fetches
+its file, timing every request. Nothing leaves the machine.
+"""
+import json
+import time
+import logging
+import random
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from benchmarks.environment import configure, percentile, peak_rss_mb, storage_io
+
+class Client:
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def request(self, label: str, method: str, path: str, body: dict = None) -> Tuple[int, bytes]:
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers={
+            'X-API-Key': self.api_key, 'Content-Type': 'application/json'
+        })
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[label].append(elapsed)
+        return status, payload
+
+    def run_task(self, task_type: str, url: str, poll_seconds: float) -> str:
+        status, payload = self.request(f'POST /get_{task_type}', 'POST', f'/get_{task_type}', {'url': url})
+        if status != 200:
+            return f'rejected ({status})'
+        task_id = json.loads(payload)['task_id']
+
+        while True:
+            status, payload = self.request('GET /status', 'GET', f'/status/{task_id}')
+            task = json.loads(payload)
+            if task.get('status') in ('completed', 'error'):
+                break
+            time.sleep(poll_seconds)
+
+        if task['status'] == 'completed':
+            self.request('GET /files', 'GET', task['file'])
+        return task['status']
+
+def parse_mix(mix: str) -> List[str]:
+    weighted = []
+    for part in mix.split(','):
+        task_type, _, weight = part.partition('=')
+        weighted += [task_type.strip()] * int(weight or 1)
+    return weighted
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=100, help='tasks to run in total')
+    parser.add_argument('--concurrency', type=int, default=8, help='clients running at the same time')
+    parser.add_argument('--mix', default='video=3,info=1', help='task types and weights, e.g. video=3,audio=1,info=1')
+    parser.add_argument('--videos', type=int, default=0,
+                        help='distinct videos to draw from; fewer than --tasks exercises caching and deduplication')
+    parser.add_argument('--media-kb', type=int, default=256, help='size of the smallest synthetic format')
+    parser.add_argument('--download-workers', type=int, default=4)
+    parser.add_argument('--backend', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--poll-ms', type=int, default=50, help='interval between /status polls')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ytdlp-host-bench-')
+    configure(workdir, args.backend, DOWNLOAD_WORKERS=args.download_workers,
+              DOWNLOAD_QUEUE_SIZE=max(args.tasks, 500), METADATA_QUEUE_SIZE=max(args.tasks, 1000))
+
+    from benchmarks import fake_media
+    media = fake_media.MediaServer()
+    media.start()
+    fake_media.install(media.url, args.media_kb * 1024)
+
+    from werkzeug.serving import make_server
+    from src.server import app
+    from src.storage import Storage
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='api-server', daemon=True).start()
+
+    client = Client(f'http://127.0.0.1:{server.server_port}', Storage.get_key('admin')['key'])
+    rng = random.Random(args.seed)
+    task_types = parse_mix(args.mix)
+    videos = args.videos or args.tasks
+    jobs = [(rng.choice(task_types), fake_media.video_url(f'v{rng.randrange(videos)}')) for _ in range(args.tasks)]
+
+    print(f"Running {args.tasks} tasks with {args.concurrency} clients ({args.backend} storage, {workdir})")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        outcomes = list(executor.map(lambda job: client.run_task(*job, args.poll_ms / 1000), jobs))
+    elapsed = time.perf_counter() - start
+
+    completed = outcomes.count('completed')
+    print(f"\n{completed}/{args.tasks} completed in {elapsed:.2f}s, {completed / elapsed:.1f} tasks/s")
+    for outcome in sorted(set(outcomes) - {'completed'}):
+        print(f"  {outcomes.count(outcome)} {outcome}")
+
+    print(f"\n{'request':<18}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, values in sorted(client.latencies.items()):
+        print(f"{label:<18}{len(values):>8}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+
+    print("\nstorage I/O")
+    for name, value in sorted(storage_io().items()):
+        print(f"  {name:<24}{int(value):>12}")
+    print(f"\npeak RSS {peak_rss_mb():.1f} MiB (server, workers and clients share the process)")
+
+    server.shutdown()
+    media.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Microbenchmarks of the per-request hot paths as tasks and keys pile up.
+
+    python -m benchmarks.micro --sizes 1000,10000 --backend sqlite
+
+Storage is filled with the given numbers of tasks and API keys, then each
+operation is timed for up to --seconds or --calls, whichever ends first.
+"""
+import random
+import argparse
+import tempfile
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from benchmarks.environment import configure, percentile, time_calls
+
+def seed(size: int, start: int, rng: random.Random) -> Dict[str, str]:
+    """Adds tasks and keys up to `size` of each; returns the new secrets by key name."""
+    from src.storage import Storage
+    from src.models import Task, TaskStatus, TaskType, ApiKey
+
+    keys = Storage.load_keys()
+    secrets = {}
+    for i in range(start, size):
+        name = f'bench-key-{i}'
+        secrets[name] = f'bench-secret-{i}-{rng.getrandbits(64):016x}'
+        keys[name] = ApiKey(secrets[name], name, [t.value for t in TaskType],
+                            last_access=datetime.now().isoformat()).to_dict()
+    Storage.save_keys(keys)
+
+    statuses = [TaskStatus.COMPLETED, TaskStatus.ERROR, TaskStatus.WAITING]
+    tasks = {}
+    for i in range(start, size):
+        task = Task(f'bench-task-{i:08d}', f'bench-key-{rng.randrange(size)}', rng.choice(statuses),
+                    TaskType.GET_VIDEO, f'https://bench.invalid/watch/v{i}')
+        if task.status != TaskStatus.WAITING:
+            task.completed_time = datetime.now().isoformat()
+        tasks[task.task_id] = task.to_dict()
+    Storage.add_tasks(tasks)
+    return secrets
+
+def run(size: int, secrets: Dict[str, str], rng: random.Random, seconds: float, calls: int) -> None:
+    from src.storage import Storage
+    from src.auth import AuthManager, RateLimiter, key_registry
+    from src.info_index import extract_qualities
+    from benchmarks.fake_media import synthetic_formats
+
+    key_registry.reload()
+    names = list(secrets)
+    new_tasks = iter(range(10 ** 9))
+    info = {'formats': synthetic_formats('http://127.0.0.1', 'v', 1 << 20, count=200)}
+
+    def task_id() -> str:
+        return f'bench-task-{rng.randrange(size):08d}'
+
+    benchmarks: Dict[str, Callable[[], object]] = {
+        'Storage.get_task': lambda: Storage.get_task(task_id()),
+        'Storage.update_task': lambda: Storage.update_task(task_id(), progress={'percent': 50.0}),
+        'Storage.add_task': lambda: Storage.add_task(
+            f'bench-new-{size}-{next(new_tasks)}', {'key_name': names[0], 'status': 'waiting',
+                                                    'task_type': 'get_video', 'url': 'x'}),
+        'Storage.find_tasks(waiting)': lambda: Storage.find_tasks(status='waiting'),
+        'Storage.count_tasks(key)': lambda: Storage.count_tasks(rng.choice(names)),
+        'Storage.get_key': lambda: Storage.get_key(rng.choice(names)),
+        'AuthManager.get_key_name': lambda: AuthManager.get_key_name(secrets[rng.choice(names)]),
+        'RateLimiter.check_rate_limit': lambda: RateLimiter.check_rate_limit(secrets[rng.choice(names)]),
+        'RateLimiter.record': lambda: RateLimiter.record(rng.choice(names)),
+        'extract_qualities(205 formats)': lambda: extract_qualities(info),
+    }
+
+    print(f"\n{size} tasks and keys")
+    print(f"{'operation':<32}{'calls':>8}{'ops/s':>12}{'p50 us':>10}{'p99 us':>10}")
+    for name, fn in benchmarks.items():
+        durations = time_calls(fn, seconds, calls)
+        total = sum(durations)
+        print(f"{name:<32}{len(durations):>8}{len(durations) / total:>12.0f}"
+              f"{percentile(durations, 0.5) * 1e6:>10.1f}{percentile(durations, 0.99) * 1e6:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated numbers of tasks and keys')
+    parser.add_argument('--backend', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time budget per operation and size')
+    parser.add_argument('--calls', type=int, default=10000, help='call budget per operation and size')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ytdlp-host-micro-')
+    # No workers, so the seeded waiting tasks stay in storage
+    configure(workdir, args.backend, role='api')
+    print(f"{args.backend} storage in {workdir}")
+
+    rng = random.Random(args.seed)
+    secrets: Dict[str, str] = {}
+    seeded = 0
+    sizes: List[int] = sorted(int(size) for size in args.sizes.split(','))
+    for size in sizes:
+        secrets.update(seed(size, seeded, rng))
+        seeded = size
+        run(size, secrets, rng, args.seconds, args.calls)
+
+if __name__ == '__main__':
+    main()
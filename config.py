@@ -1,17 +1,134 @@
-from dataclasses import dataclass
-from typing import Final
+import os
+import socket
+from dataclasses import dataclass, field
+from typing import Final, Optional
 
 @dataclass
 class StorageConfig:
     DOWNLOAD_DIR: Final[str] = '/app/downloads'
     TASKS_FILE: Final[str] = 'jsons/tasks.json'
     KEYS_FILE: Final[str] = 'jsons/api_keys.json'
+    USAGE_FILE: Final[str] = 'jsons/usage.json'
+    BLOB_DIR: Final[str] = '.blobs'
+    FILE_CHUNK_SIZE: Final[int] = 256 * 1024
+    BACKEND: Final[str] = 'sqlite'
+    DATABASE_FILE: Final[str] = 'jsons/storage.db'
+    SQLITE_BUSY_TIMEOUT: Final[float] = 30.0
 
 @dataclass
 class TaskConfig:
     CLEANUP_TIME_MINUTES: Final[int] = 10
     REQUEST_LIMIT: Final[int] = 60
-    MAX_WORKERS: Final[int] = 4
+    BATCH_MAX_TASKS: Final[int] = 1000
+    METADATA_WORKERS: Final[int] = 4
+    METADATA_QUEUE_SIZE: Final[int] = 1000
+    DOWNLOAD_WORKERS: Final[int] = 4
+    DOWNLOAD_QUEUE_SIZE: Final[int] = 500
+    LIVE_WORKERS: Final[int] = 2
+    LIVE_QUEUE_SIZE: Final[int] = 50
+    MAX_LIVE_RECORDINGS: Final[int] = 20
+    LIVE_SEGMENT_SECONDS: Final[int] = 6
+    LIVE_WINDOW_SECONDS: Final[int] = 3600
+    LIVE_POLL_SECONDS: Final[float] = 2.0
+    POSTPROCESS_WORKERS: Final[int] = os.cpu_count() or 1
+    POSTPROCESS_QUEUE_SIZE: Final[int] = 100
+    FFMPEG_TIMEOUT_SECONDS: Final[int] = 1800
+    PROGRESS_UPDATE_SECONDS: Final[float] = 1.0
+    STATUS_STREAM_HEARTBEAT_SECONDS: Final[int] = 15
+    ORPHAN_CLEANUP_MINUTES: Final[int] = 5
+    DEDUPLICATE_DOWNLOADS: Final[bool] = True
+    YDL_MAX_USES: Final[int] = 200
+    STREAM_START_TIMEOUT_SECONDS: Final[int] = 60
+    STREAM_IDLE_TIMEOUT_SECONDS: Final[int] = 120
+    STREAM_POLL_SECONDS: Final[float] = 0.25
+    RESUMABLE_DOWNLOADS: Final[bool] = True
+    CHECKPOINT_SECONDS: Final[float] = 5.0
+    RESUME_KEEP_MINUTES: Final[int] = 60
+
+@dataclass
+class TieringConfig:
+    EVICTION: Final[bool] = True
+    HIGH_WATER_MARK: Final[float] = 0.90
+    LOW_WATER_MARK: Final[float] = 0.75
+    MAX_RETENTION_MINUTES: Final[Optional[int]] = 24 * 60
+    EVICTION_CHECK_SECONDS: Final[int] = 60
+    ACCESS_FLUSH_SECONDS: Final[int] = 10
+    # Slower disk completed files are moved to before they are deleted
+    COLD_DIR: Final[Optional[str]] = None
+    COLD_AVAILABLE_BYTES: Final[int] = 100 * 1024 * 1024 * 1024
+
+@dataclass
+class AccelerationConfig:
+    DEFAULT_PROFILE: Final[str] = 'balanced'
+    # fragments: parallel fragment downloads for DASH/HLS, up to max_fragments when tuned;
+    # external_downloader_args may use {connections}
+    PROFILES: Final[dict] = field(default_factory=lambda: {
+        'off': {'fragments': 1},
+        'balanced': {'fragments': 4, 'max_fragments': 8, 'http_chunk_size': 10 * 1024 * 1024, 'buffersize': 64 * 1024},
+        'fast': {'fragments': 8, 'max_fragments': 16, 'http_chunk_size': 10 * 1024 * 1024, 'buffersize': 256 * 1024},
+        'aria2c': {'fragments': 8, 'max_fragments': 16, 'external_downloader': 'aria2c',
+                   'external_downloader_args': ['-x', '{connections}', '-s', '{connections}', '-k', '1M']}
+    })
+    # Shared by the running downloads of every worker using the same storage
+    MAX_DOWNLOAD_CONNECTIONS: Final[int] = 32
+    ADAPTIVE: Final[bool] = True
+    ADAPTIVE_GAIN: Final[float] = 0.1
+
+@dataclass
+class NodeConfig:
+    ROLE: Final[str] = os.environ.get('YTDLP_HOST_ROLE', 'all')
+    NODE_ID: Final[str] = os.environ.get('YTDLP_HOST_NODE_ID') or socket.gethostname()
+    LEASE_SECONDS: Final[int] = 60
+    HEARTBEAT_SECONDS: Final[int] = 15
+    QUEUE_POLL_SECONDS: Final[float] = 1.0
+    MAX_TASK_ATTEMPTS: Final[int] = 3
+    DRAIN_TIMEOUT_SECONDS: Final[int] = 120
+    WORKER_NICENESS: Final[int] = 5
+
+@dataclass
+class ServerConfig:
+    BIND: Final[str] = '0.0.0.0:5000'
+    # gunicorn worker class of the API role; processes that run downloads use gthread
+    WORKER_CLASS: Final[str] = 'gevent'
+    WORKERS: Final[int] = 2
+    THREADS: Final[int] = 16
+    MAX_CONNECTIONS: Final[int] = 1000
+    BACKLOG: Final[int] = 2048
+    KEEPALIVE_SECONDS: Final[int] = 5
+    GRACEFUL_TIMEOUT_SECONDS: Final[int] = 30
+
+@dataclass
+class AuthConfig:
+    KEY_CACHE_TTL_SECONDS: Final[int] = 30
+    KEY_MISS_RELOAD_SECONDS: Final[float] = 1.0
+    LAST_ACCESS_FLUSH_SECONDS: Final[int] = 60
+    USAGE_PRUNE_SECONDS: Final[int] = 30
+
+@dataclass
+class CacheConfig:
+    INFO_CACHE_SIZE: Final[int] = 256
+    INFO_CACHE_TTL_SECONDS: Final[int] = 300
+    ESTIMATE_CACHE_SIZE: Final[int] = 1024
+    INFO_RESPONSE_CACHE_SIZE: Final[int] = 1024
+    INFO_RESPONSE_CACHE_TTL_SECONDS: Final[int] = 600
+
+@dataclass
+class CompressionConfig:
+    ENCODINGS: Final[tuple] = ('zstd', 'br', 'gzip')
+    MIN_BYTES: Final[int] = 1024
+    MIMETYPES: Final[tuple] = ('application/json',)
+    GZIP_LEVEL: Final[int] = 6
+    BROTLI_QUALITY: Final[int] = 4
+    ZSTD_LEVEL: Final[int] = 3
+    STATIC_GZIP_LEVEL: Final[int] = 9
+    STATIC_BROTLI_QUALITY: Final[int] = 9
+    STATIC_ZSTD_LEVEL: Final[int] = 15
+
+@dataclass
+class MetricsConfig:
+    METRICS_DIR: Final[str] = 'jsons/metrics'
+    METRICS_SNAPSHOT_SECONDS: Final[int] = 5
+    METRICS_STALE_SECONDS: Final[int] = 60
 
 @dataclass
 class MemoryConfig:
@@ -23,4 +140,12 @@ class MemoryConfig:
 
 storage = StorageConfig()
 task = TaskConfig()
+tiering = TieringConfig()
+acceleration = AccelerationConfig()
+node = NodeConfig()
+server = ServerConfig()
+auth = AuthConfig()
+cache = CacheConfig()
+compression = CompressionConfig()
+metrics = MetricsConfig()
 memory = MemoryConfig()
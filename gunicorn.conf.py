@@ -0,0 +1,26 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import node, server
+
+bind = server.BIND
+# With gevent a streaming response or slow client costs a greenlet, not a thread.
+# Download and ffmpeg threads must stay native threads, so processes running them use gthread.
+worker_class = server.WORKER_CLASS if node.ROLE == 'api' else 'gthread'
+workers = server.WORKERS
+threads = server.THREADS
+worker_connections = server.MAX_CONNECTIONS
+backlog = server.BACKLOG
+keepalive = server.KEEPALIVE_SECONDS
+graceful_timeout = server.GRACEFUL_TIMEOUT_SECONDS
+# The app starts threads when it is imported, which must happen after the fork
+preload_app = False
+
+if node.ROLE != 'api':
+    graceful_timeout += node.DRAIN_TIMEOUT_SECONDS
+
+def worker_exit(server, worker):
+    yt_handler = sys.modules.get('src.yt_handler')
+    if yt_handler and yt_handler.downloader.runs_workers:
+        yt_handler.downloader.shutdown(node.DRAIN_TIMEOUT_SECONDS)
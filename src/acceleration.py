@@ -0,0 +1,169 @@
+import time
+import threading
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from src.storage import Storage
+from config import acceleration as acceleration_config
+
+class Transfer:
+    """Connections granted to one download and the throughput it reached."""
+
+    __slots__ = ('task_id', 'profile', 'host', 'connections', 'started', 'ended', 'bytes', 'resumed', 'fragmented')
+
+    def __init__(self, task_id: str, profile: str, host: str, connections: int):
+        self.task_id = task_id
+        self.profile = profile
+        self.host = host
+        self.connections = connections
+        self.started = time.monotonic()
+        self.ended: Optional[float] = None
+        self.bytes = 0
+        # Bytes an earlier attempt left behind, which this one did not download
+        self.resumed = 0
+        # Files downloaded in fragments, the only ones concurrency applies to
+        self.fragmented: Set[str] = set()
+
+    def record(self, total_bytes: int) -> None:
+        self.bytes = total_bytes
+
+    def stop(self) -> None:
+        self.ended = time.monotonic()
+
+    @property
+    def throughput(self) -> int:
+        """Average bytes per second since the download started."""
+        elapsed = (self.ended or time.monotonic()) - self.started
+        return int(max(self.bytes - self.resumed, 0) / elapsed) if elapsed > 0 else 0
+
+    def summary(self) -> dict:
+        summary = {'acceleration': self.profile, 'connections': self.connections, 'throughput': self.throughput}
+        if self.resumed:
+            summary['resumed_bytes'] = self.resumed
+        return summary
+
+class ConnectionBudget:
+    """Caps the connections the downloads of all workers sharing storage hold at once.
+
+    Grants are made in storage, by `Storage.grant_connections`, and kept on
+    the running task. A download gets what it asks for, at most what is left
+    and at most an equal share among the running downloads. The grants of
+    this process are also kept here for its metrics.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._grants: Dict[str, int] = {}
+
+    def acquire(self, task_id: str, wanted: int) -> int:
+        granted = Storage.grant_connections(task_id, wanted, self.limit)
+        with self._lock:
+            self._grants[task_id] = granted
+        return granted
+
+    def release(self, task_id: str) -> None:
+        with self._lock:
+            self._grants.pop(task_id, None)
+        Storage.update_task(task_id, granted_connections=None)
+
+    def in_use(self) -> int:
+        """Connections held by the downloads of this process."""
+        with self._lock:
+            return sum(self._grants.values())
+
+class ConcurrencyTuner:
+    """Hill-climbs fragment concurrency per host and profile on measured throughput.
+
+    After each fragmented download the next one to the same host tries one
+    connection more or less. It keeps going while throughput improves by at
+    least ADAPTIVE_GAIN, turns around when it drops by as much, and stays
+    where it is in between.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (host, profile) -> [concurrency, direction, throughput]
+        self._state: Dict[Tuple[str, str], list] = {}
+
+    def suggest(self, host: str, profile: str, start: int, maximum: int) -> int:
+        with self._lock:
+            state = self._state.get((host, profile))
+        concurrency = state[0] if state else start
+        return min(max(concurrency, 1), maximum)
+
+    def observe(self, host: str, profile: str, concurrency: int, throughput: float, maximum: int) -> None:
+        gain = acceleration_config.ADAPTIVE_GAIN
+        with self._lock:
+            state = self._state.get((host, profile))
+            direction = state[1] if state else 1
+            step = direction
+            if state is not None:
+                if throughput < state[2] * (1 - gain):
+                    direction = step = -direction
+                elif throughput < state[2] * (1 + gain):
+                    step = 0
+            self._state[(host, profile)] = [min(max(concurrency + step, 1), maximum), direction, throughput]
+
+class Accelerator:
+    """Turns a task's acceleration profile into yt-dlp download options."""
+
+    def __init__(self, connection_limit: int):
+        self.budget = ConnectionBudget(connection_limit)
+        self.tuner = ConcurrencyTuner()
+
+    @staticmethod
+    def profile_name(task: dict, key_info: Optional[dict]) -> str:
+        """The request's profile, else the key's, else the default."""
+        for name in (task.get('acceleration'), (key_info or {}).get('acceleration')):
+            if name in acceleration_config.PROFILES:
+                return name
+        return acceleration_config.DEFAULT_PROFILE
+
+    def start(self, task_id: str, task: dict, key_info: Optional[dict]) -> Tuple[Transfer, dict]:
+        """Reserves connections for a download; returns its transfer and yt-dlp options."""
+        name = self.profile_name(task, key_info)
+        profile = acceleration_config.PROFILES[name]
+        host = urlsplit(task['url']).netloc.lower()
+        maximum = profile.get('max_fragments', profile['fragments'])
+        wanted = profile['fragments']
+        if acceleration_config.ADAPTIVE:
+            wanted = self.tuner.suggest(host, name, wanted, maximum)
+        connections = self.budget.acquire(task_id, wanted)
+
+        opts = {'concurrent_fragment_downloads': connections}
+        if profile.get('http_chunk_size'):
+            opts['http_chunk_size'] = profile['http_chunk_size']
+        if profile.get('buffersize'):
+            opts['buffersize'] = profile['buffersize']
+        # External downloaders write their own files, which streamed and live tasks cannot follow
+        downloader = profile.get('external_downloader')
+        if downloader and not task.get('stream') and 'live' not in task['task_type']:
+            opts['external_downloader'] = {'default': downloader}
+            args = [arg.format(connections=connections) for arg in profile.get('external_downloader_args', [])]
+            if args:
+                opts['external_downloader_args'] = {downloader: args}
+        return Transfer(task_id, name, host, connections), opts
+
+    def observe(self, transfer: Transfer, status: dict) -> None:
+        """Feeds the tuner with finished fragmented downloads of a transfer."""
+        filename = status.get('filename')
+        if status.get('fragment_count') and filename:
+            transfer.fragmented.add(filename)
+        # Only progress reports carry the fragment count, not the final one
+        if not acceleration_config.ADAPTIVE or status.get('status') != 'finished':
+            return
+        if filename not in transfer.fragmented or not status.get('elapsed'):
+            return
+        size = status.get('total_bytes') or status.get('downloaded_bytes')
+        if not size:
+            return
+        profile = acceleration_config.PROFILES[transfer.profile]
+        maximum = profile.get('max_fragments', profile['fragments'])
+        self.tuner.observe(transfer.host, transfer.profile, transfer.connections, size / status['elapsed'], maximum)
+
+    def finish(self, transfer: Transfer) -> None:
+        transfer.stop()
+        self.budget.release(transfer.task_id)
+
+accelerator = Accelerator(acceleration_config.MAX_DOWNLOAD_CONNECTIONS)
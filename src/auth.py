@@ -1,12 +1,118 @@
+import time
+import atexit
 import secrets
+import threading
 from functools import wraps
-from datetime import datetime, timedelta
-from typing import Optional, List, Tuple
+from datetime import datetime
+from typing import Optional, List, Tuple, Dict, FrozenSet
 
 from flask import request, jsonify
 from src.storage import Storage
 from src.models import ApiKey
+from src.usage import usage_tracker
+from src.disk_usage import disk_usage
+from src import metrics
 from config import task, memory
+from config import auth as auth_config
+
+class KeyRegistry:
+    """In-process index of API keys by secret.
+
+    Each lookup checks the key generation in storage, which saving or
+    deleting a key changes, and reloads the index when it moved, so keys
+    created or deleted through another process apply at once. A secret
+    that is not found also reloads the index, at most once per
+    KEY_MISS_RELOAD_SECONDS. Permission checks never touch storage;
+    `last_access` updates are buffered and written back by a background
+    flusher.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._names_by_secret: Dict[str, str] = {}
+        self._keys: Dict[str, dict] = {}
+        self._permissions: Dict[str, FrozenSet[str]] = {}
+        self._pending_access: Dict[str, str] = {}
+        self._generation: Optional[int] = None
+        self._loaded_at = 0.0
+        self._flusher: Optional[threading.Thread] = None
+    
+    def reload(self) -> None:
+        # Read first: a key saved in between reloads again on the next lookup
+        generation = Storage.key_generation()
+        keys = Storage.load_keys()
+        with self._lock:
+            self._names_by_secret = {info['key']: name for name, info in keys.items()}
+            self._keys = keys
+            self._permissions = {name: frozenset(info['permissions']) for name, info in keys.items()}
+            self._generation = generation
+            self._loaded_at = time.monotonic()
+    
+    def _is_stale(self) -> bool:
+        return (time.monotonic() - self._loaded_at > auth_config.KEY_CACHE_TTL_SECONDS
+                or Storage.key_generation() != self._generation)
+    
+    def lookup(self, api_key: str) -> Tuple[Optional[str], Optional[dict]]:
+        if self._is_stale():
+            self.reload()
+        name = self._names_by_secret.get(api_key)
+        if name is None and time.monotonic() - self._loaded_at > auth_config.KEY_MISS_RELOAD_SECONDS:
+            self.reload()
+            name = self._names_by_secret.get(api_key)
+        if name is None:
+            return None, None
+        return name, self._keys.get(name)
+    
+    def permissions(self, name: str) -> FrozenSet[str]:
+        return self._permissions.get(name, frozenset())
+    
+    def put(self, name: str, key_info: dict) -> None:
+        with self._lock:
+            previous = self._keys.get(name)
+            if previous is not None:
+                self._names_by_secret.pop(previous['key'], None)
+            self._names_by_secret[key_info['key']] = name
+            self._keys[name] = key_info
+            self._permissions[name] = frozenset(key_info['permissions'])
+    
+    def remove(self, name: str) -> None:
+        with self._lock:
+            key_info = self._keys.pop(name, None)
+            if key_info is not None:
+                self._names_by_secret.pop(key_info['key'], None)
+            self._permissions.pop(name, None)
+            self._pending_access.pop(name, None)
+    
+    def touch(self, name: str) -> None:
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._pending_access[name] = now
+            if name in self._keys:
+                self._keys[name]['last_access'] = now
+        self._start_flusher()
+    
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending_access = self._pending_access, {}
+        for name, last_access in pending.items():
+            Storage.update_key(name, last_access=last_access)
+    
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(auth_config.LAST_ACCESS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing key access times: {e}")
+    
+    def _start_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
 
 class AuthManager:
     @staticmethod
@@ -15,146 +121,174 @@ class AuthManager:
     
     @staticmethod
     def get_key_name(api_key: str) -> Optional[str]:
-        keys = Storage.load_keys()
-        for key_name, key_info in keys.items():
-            if key_info['key'] == api_key:
-                return key_name
-        return None
+        key_name, _ = key_registry.lookup(api_key)
+        return key_name
     
     def create_key(self, name: str, permissions: List[str], 
-                   memory_quota: int = memory.DEFAULT_QUOTA_BYTES) -> str:
-        keys = Storage.load_keys()
+                   memory_quota: int = memory.DEFAULT_QUOTA_BYTES, acceleration: Optional[str] = None) -> str:
         api_key = ApiKey(
             key=self.generate_key(),
             name=name,
             permissions=permissions,
             memory_quota=memory_quota,
-            last_access=datetime.now().isoformat()
+            last_access=datetime.now().isoformat(),
+            acceleration=acceleration
         )
-        keys[name] = api_key.to_dict()
-        Storage.save_keys(keys)
+        Storage.save_key(name, api_key.to_dict())
+        key_registry.put(name, api_key.to_dict())
         return api_key.key
     
     def delete_key(self, name: str) -> bool:
-        keys = Storage.load_keys()
-        if name in keys:
-            del keys[name]
-            Storage.save_keys(keys)
-            return True
-        return False
+        key_registry.remove(name)
+        usage_tracker.forget(name)
+        return Storage.delete_key(name)
 
 class MemoryManager:
     @staticmethod
-    def _clean_old_usage(memory_usage: List[dict]) -> List[dict]:
-        current_time = datetime.now()
-        cutoff_time = current_time - timedelta(minutes=memory.QUOTA_RATE_MINUTES)
-        return [
-            usage for usage in memory_usage
-            if datetime.fromisoformat(usage['timestamp']) > cutoff_time
-        ]
+    def _gb(size: int) -> float:
+        return size / (1024 ** 3)
     
     def get_total_usage(self) -> int:
-        keys = Storage.load_keys()
-        total = 0
-        
-        for key_info in keys.values():
-            if 'memory_usage' not in key_info:
-                continue
-            
-            key_info['memory_usage'] = self._clean_old_usage(key_info['memory_usage'])
-            total += sum(usage['size'] for usage in key_info['memory_usage'])
-        
-        return total
+        return disk_usage.total()
+    
+    def get_usage(self, key_name: str) -> List[dict]:
+        return usage_tracker.memory_entries(key_name)
+    
+    def get_disk_usage(self, key_name: str) -> int:
+        return disk_usage.key_usage(key_name)
+    
+    def _server_memory_error(self, total_usage: int, new_size: int) -> str:
+        gb = self._gb
+        return (
+            f"Server memory limit exceeded. "
+            f"Current: {gb(total_usage):.2f}GB, "
+            f"Requested: {gb(new_size):.2f}GB, "
+            f"Available: {gb(memory.AVAILABLE_BYTES - total_usage):.2f}GB"
+        )
+    
+    def _user_quota_error(self, current_usage: int, new_size: int, quota: int) -> str:
+        gb = self._gb
+        return (
+            f"User quota exceeded. Current: {gb(current_usage):.2f}GB, "
+            f"Requested: {gb(new_size):.2f}GB, Quota: {gb(quota):.2f}GB"
+        )
     
     def check_server_memory(self, new_size: int = 0) -> Tuple[bool, str]:
         total_usage = self.get_total_usage()
         
         if total_usage + new_size > memory.AVAILABLE_BYTES:
-            gb = lambda x: x / (1024 ** 3)
-            return False, (
-                f"Server memory limit exceeded. "
-                f"Current: {gb(total_usage):.2f}GB, "
-                f"Requested: {gb(new_size):.2f}GB, "
-                f"Available: {gb(memory.AVAILABLE_BYTES - total_usage):.2f}GB"
-            )
+            metrics.REJECTIONS.inc(reason='server_memory')
+            return False, self._server_memory_error(total_usage, new_size)
         return True, ""
     
-    def check_and_update_quota(self, api_key: str, new_size: int, task_id: str) -> None:
+    def check_quota(self, api_key: str, new_size: int = 0) -> Tuple[bool, str]:
+        """Checks server and user quota without recording any usage."""
         ok, error = self.check_server_memory(new_size)
         if not ok:
-            raise Exception(error)
-        
-        keys = Storage.load_keys()
-        key_name = AuthManager.get_key_name(api_key)
+            return ok, error
         
-        if not key_name or key_name not in keys:
-            raise Exception("Invalid API key")
+        key_name, key_info = key_registry.lookup(api_key)
+        if not key_name:
+            return False, "Invalid API key"
         
-        key_info = keys[key_name]
-        key_info.setdefault('memory_quota', memory.DEFAULT_QUOTA_BYTES)
-        key_info.setdefault('memory_usage', [])
-        
-        key_info['memory_usage'] = self._clean_old_usage(key_info['memory_usage'])
-        current_usage = sum(u['size'] for u in key_info['memory_usage'])
+        quota = key_info.get('memory_quota', memory.DEFAULT_QUOTA_BYTES)
+        current_usage = usage_tracker.memory_usage(key_name)
+        if current_usage + new_size > quota:
+            metrics.REJECTIONS.inc(reason='quota')
+            return False, self._user_quota_error(current_usage, new_size, quota)
+        return True, ""
+    
+    def reserve(self, key_name: str, key_info: dict, size: int, task_id: str) -> None:
+        """Sets the reservation of a task against the user quota and the disk cap.
         
-        if current_usage + new_size > key_info['memory_quota']:
-            gb = lambda x: x / (1024 ** 3)
-            raise Exception(
-                f"User quota exceeded. Current: {gb(current_usage):.2f}GB, "
-                f"Requested: {gb(new_size):.2f}GB, Quota: {gb(key_info['memory_quota']):.2f}GB"
-            )
+        Called once with the estimated size and again whenever a running
+        download outgrows its reservation.
+        """
+        quota = key_info.get('memory_quota', memory.DEFAULT_QUOTA_BYTES)
+        _, previous = disk_usage.task_usage(task_id)
         
-        if new_size > 0:
-            key_info['memory_usage'].append({
-                'size': new_size,
-                'timestamp': datetime.now().isoformat(),
-                'task_id': task_id
-            })
-            key_info['last_access'] = datetime.now().isoformat()
+        reserved, current_usage = usage_tracker.try_reserve_memory(key_name, size, task_id, quota)
+        if not reserved:
+            metrics.REJECTIONS.inc(reason='quota')
+            raise Exception(self._user_quota_error(current_usage, size, quota))
         
-        Storage.save_keys(keys)
+        reserved, total_usage = disk_usage.try_reserve(task_id, key_name, size, memory.AVAILABLE_BYTES)
+        if not reserved:
+            usage_tracker.try_reserve_memory(key_name, previous, task_id, quota)
+            metrics.REJECTIONS.inc(reason='server_memory')
+            raise Exception(self._server_memory_error(total_usage, size))
+    
+    def settle(self, task_id: str, task_dir: str) -> None:
+        """Charges a finished task with the bytes it actually left on disk."""
+        key_name = disk_usage.key_name(task_id)
+        if key_name is None:
+            return
+        actual = disk_usage.reconcile(task_id, task_dir)
+        usage_tracker.settle_memory(key_name, task_id, actual)
 
 class RateLimiter:
+    @staticmethod
+    def remaining(key_name: str) -> int:
+        return task.REQUEST_LIMIT - usage_tracker.request_count(key_name)
+    
     @staticmethod
     def check_rate_limit(api_key: str) -> bool:
-        tasks = Storage.load_tasks()
         key_name = AuthManager.get_key_name(api_key)
-        count = sum(1 for t in tasks.values() if t.get('key_name') == key_name)
-        return count < task.REQUEST_LIMIT
+        return RateLimiter.remaining(key_name) > 0
+    
+    @staticmethod
+    def record(key_name: str, count: int = 1) -> None:
+        usage_tracker.record_requests(key_name, count)
+
+def require_permission(permission: Optional[str] = None):
+    """Authenticates and rate-limits a request.
 
-def require_permission(permission: str):
+    Without `permission` the view is responsible for checking permissions,
+    e.g. per item of a batch.
+    """
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            api_key = request.headers.get('X-API-Key')
-            
-            if not api_key:
-                return jsonify({'error': 'No API key provided'}), 401
-            
-            keys = Storage.load_keys()
-            key_name = AuthManager.get_key_name(api_key)
-            
-            if not key_name:
-                return jsonify({'error': 'Invalid API key'}), 401
-            
-            key_info = keys[key_name]
-            
-            if not RateLimiter.check_rate_limit(api_key):
-                return jsonify({
-                    'error': f'Rate limit exceeded. Max {task.REQUEST_LIMIT} per {task.CLEANUP_TIME_MINUTES} min'
-                }), 429
-            
-            if permission not in key_info['permissions']:
-                return jsonify({'error': 'Insufficient permissions'}), 403
-            
-            key_info['last_access'] = datetime.now().isoformat()
-            Storage.save_keys(keys)
-            
+            with metrics.FUNCTION_SECONDS.time(function='require_permission'):
+                error = _check_request(permission)
+            if error:
+                return error
             return f(*args, **kwargs)
         return wrapper
     return decorator
 
+def _check_request(permission: Optional[str]):
+    api_key = request.headers.get('X-API-Key')
+    
+    if not api_key:
+        return jsonify({'error': 'No API key provided'}), 401
+    
+    key_name, _ = key_registry.lookup(api_key)
+    
+    if not key_name:
+        return jsonify({'error': 'Invalid API key'}), 401
+    
+    if not RateLimiter.check_rate_limit(api_key):
+        metrics.REJECTIONS.inc(reason='rate_limit')
+        return jsonify({
+            'error': f'Rate limit exceeded. Max {task.REQUEST_LIMIT} per {task.CLEANUP_TIME_MINUTES} min'
+        }), 429
+    
+    if permission is not None and permission not in key_registry.permissions(key_name):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    
+    key_registry.touch(key_name)
+    return None
+
+def _grant_stats() -> None:
+    """Gives admin keys created before `get_stats` existed the permission."""
+    for name, key_info in Storage.load_keys().items():
+        permissions = key_info.get('permissions', [])
+        if 'get_keys' in permissions and 'get_stats' not in permissions:
+            Storage.update_key(name, permissions=permissions + ['get_stats'])
+
 # Initialize admin key if needed
+key_registry = KeyRegistry()
 auth_manager = AuthManager()
 memory_manager = MemoryManager()
 
@@ -162,5 +296,8 @@ if not Storage.load_keys():
     auth_manager.create_key(
         "admin",
         ["create_key", "delete_key", "get_key", "get_keys", 
-         "get_video", "get_audio", "get_live_video", "get_live_audio", "get_info"]
+         "get_video", "get_audio", "get_live_video", "get_live_audio", "get_info",
+         "get_stats"]
     )
+else:
+    _grant_stats()
@@ -0,0 +1,150 @@
+import copy
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from src.ydl_pool import YDLPool
+from src import metrics
+from config import cache as cache_config
+
+TRACKING_PARAMS = {'si', 'feature', 'pp', 'fbclid', 'gclid'}
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry expiry.
+
+    `get_or_load` runs the loader once per key even when several threads
+    miss at the same time; the others wait for that result.
+    """
+
+    def __init__(self, max_size: int, ttl: float, name: str = 'default'):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            return self._get_locked(key)
+
+    def _get_locked(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._put_locked(key, value)
+
+    def _put_locked(self, key: Hashable, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any],
+                    cacheable: Callable[[Any], bool] = lambda value: True) -> Any:
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                self.hits += 1
+                metrics.CACHE_REQUESTS.inc(cache=self.name, result='hit')
+                return value
+            self.misses += 1
+            metrics.CACHE_REQUESTS.inc(cache=self.name, result='miss')
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            if not cacheable(flight.value):
+                return loader()
+            return flight.value
+
+        try:
+            flight.value = loader()
+            if cacheable(flight.value):
+                self.put(key, flight.value)
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS and not k.startswith('utm_')
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+class InfoCache:
+    """Caches unprocessed extractor results by normalized URL.
+
+    Entries hold the result of `extract_info(..., process=False)`; callers get
+    a private deep copy they can pass to `YoutubeDL.process_ie_result`.
+    """
+
+    def __init__(self, ydl_pool: YDLPool, profile: str):
+        self.ydl_pool = ydl_pool
+        self.profile = profile
+        self._opts_key = json.dumps(ydl_pool.profiles[profile], sort_keys=True, default=str)
+        self._cache = TTLCache(cache_config.INFO_CACHE_SIZE, cache_config.INFO_CACHE_TTL_SECONDS, 'info')
+
+    def _key(self, url: str) -> tuple:
+        return normalize_url(url), self._opts_key
+
+    @metrics.timed('extract_info')
+    def _extract(self, url: str) -> dict:
+        with self.ydl_pool.acquire(self.profile) as ydl:
+            return ydl.extract_info(url, download=False, process=False)
+
+    @staticmethod
+    def _is_cacheable(info: dict) -> bool:
+        # Playlists may hold lazy entry generators that cannot be reused
+        return info.get('_type', 'video') == 'video'
+
+    def get(self, url: str) -> dict:
+        info = self._cache.get_or_load(self._key(url), lambda: self._extract(url), self._is_cacheable)
+        if not self._is_cacheable(info):
+            return info
+        return copy.deepcopy(info)
+
+    def invalidate(self, url: str) -> None:
+        self._cache.invalidate(self._key(url))
+
+    def stats(self) -> dict:
+        return {'size': len(self._cache), 'hits': self._cache.hits, 'misses': self._cache.misses}
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from typing import Optional
+
+from config import task as task_config
+
+CHECKPOINT_NAME = '.checkpoint.json'
+
+def checkpoint_path(task_dir: str) -> str:
+    return os.path.join(task_dir, CHECKPOINT_NAME)
+
+def load(task_dir: str) -> Optional[dict]:
+    try:
+        with open(checkpoint_path(task_dir), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def remove(task_dir: str) -> None:
+    try:
+        os.remove(checkpoint_path(task_dir))
+    except FileNotFoundError:
+        pass
+
+def is_fresh(task_dir: str, max_age: float) -> bool:
+    """Whether `task_dir` holds a checkpoint written in the last `max_age` seconds."""
+    try:
+        return time.time() - os.path.getmtime(checkpoint_path(task_dir)) < max_age
+    except OSError:
+        return False
+
+class Checkpoint:
+    """Download state of a task, kept in its folder so a later attempt can resume.
+
+    yt-dlp resumes `.part` files and fragment downloads (from their `.ytdl`
+    index) by itself as long as the folder and output template stay the
+    same. The checkpoint records which attempt wrote what, so the next
+    attempt knows whether there is anything to resume and whether the last
+    one moved the download forward. It is written at most every
+    CHECKPOINT_SECONDS.
+
+    yt-dlp reports progress from its fragment threads as well, so the
+    state is changed and copied under a lock and every write goes through
+    its own temporary file. A checkpoint that cannot be written is logged;
+    it never fails the download.
+    """
+
+    def __init__(self, task_dir: str, format_spec: str, attempt: int, resumed_bytes: int = 0,
+                 previous: Optional[dict] = None):
+        self.task_dir = task_dir
+        self.state = {
+            'format': format_spec,
+            'attempt': attempt,
+            'resumed_bytes': resumed_bytes,
+            'downloaded_bytes': resumed_bytes,
+            'files': dict(previous.get('files', {})) if previous else {}
+        }
+        self._lock = threading.Lock()
+        self._saved_at = 0.0
+
+    @property
+    def resumed_bytes(self) -> int:
+        return self.state['resumed_bytes']
+
+    def record(self, status: dict) -> None:
+        filename = status.get('filename')
+        if not filename:
+            return
+        with self._lock:
+            self.state['files'][os.path.basename(filename)] = {
+                key: status.get(key) for key in ('status', 'downloaded_bytes', 'total_bytes', 'fragment_index', 'fragment_count')
+            }
+            self.state['downloaded_bytes'] = max(
+                sum(file.get('downloaded_bytes') or 0 for file in self.state['files'].values()), self.state['resumed_bytes'])
+            due = status['status'] == 'finished' or time.monotonic() - self._saved_at >= task_config.CHECKPOINT_SECONDS
+        if due:
+            self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            self._saved_at = time.monotonic()
+            data = json.dumps({**self.state, 'updated': time.time()})
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix=f'{CHECKPOINT_NAME}.', suffix='.tmp', dir=self.task_dir)
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, checkpoint_path(self.task_dir))
+        except Exception as e:
+            print(f"Error writing checkpoint in {self.task_dir}: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
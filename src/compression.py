@@ -0,0 +1,120 @@
+import os
+import zlib
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from config import compression as compression_config
+from config import storage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File suffix of the precompressed variant written next to a static artifact
+SUFFIXES = {'gzip': '.gz', 'br': '.br', 'zstd': '.zst'}
+
+class _Encoder:
+    """Incremental compressor with the same two calls for every encoding."""
+
+    def __init__(self, compress: Callable[[bytes], bytes], flush: Callable[[], bytes]):
+        self.compress = compress
+        self.flush = flush
+
+def _gzip(level: int) -> _Encoder:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return _Encoder(compressor.compress, compressor.flush)
+
+def _brotli(quality: int) -> _Encoder:
+    compressor = brotli.Compressor(quality=quality)
+    return _Encoder(compressor.process, compressor.finish)
+
+def _zstd(level: int) -> _Encoder:
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return _Encoder(compressor.compress, compressor.flush)
+
+_FACTORIES: Dict[str, Callable[[int], _Encoder]] = {'gzip': _gzip}
+if brotli is not None:
+    _FACTORIES['br'] = _brotli
+if zstandard is not None:
+    _FACTORIES['zstd'] = _zstd
+
+def available() -> List[str]:
+    """Configured encodings whose library is installed, most preferred first."""
+    return [encoding for encoding in compression_config.ENCODINGS if encoding in _FACTORIES]
+
+def _levels(static: bool) -> Dict[str, int]:
+    if static:
+        return {'gzip': compression_config.STATIC_GZIP_LEVEL, 'br': compression_config.STATIC_BROTLI_QUALITY,
+                'zstd': compression_config.STATIC_ZSTD_LEVEL}
+    return {'gzip': compression_config.GZIP_LEVEL, 'br': compression_config.BROTLI_QUALITY,
+            'zstd': compression_config.ZSTD_LEVEL}
+
+def encoder(encoding: str, static: bool = False) -> _Encoder:
+    return _FACTORIES[encoding](_levels(static)[encoding])
+
+def negotiate(accept_encodings, encodings: Optional[Iterable[str]] = None) -> Optional[str]:
+    """Picks the encoding the client weighs highest; ties go to our preference.
+
+    `accept_encodings` is the request's parsed Accept-Encoding header.
+    Returns None when the body should be sent as is.
+    """
+    best, best_quality = None, 0
+    for encoding in available() if encodings is None else encodings:
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, static: bool = False) -> Iterator[bytes]:
+    """Compresses chunk by chunk, so the output is never held in one piece."""
+    compressor = encoder(encoding, static)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return b''.join(compress_stream([data], encoding))
+
+def _read_chunks(path: str) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(storage.FILE_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+def variant_path(path: str, encoding: str) -> str:
+    return path + SUFFIXES[encoding]
+
+def write_variants(path: str) -> None:
+    """Stores a precompressed copy of `path` next to it for every available encoding."""
+    if os.path.getsize(path) < compression_config.MIN_BYTES:
+        return
+    for encoding in available():
+        target = variant_path(path, encoding)
+        tmp_path = f'{target}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            for data in compress_stream(_read_chunks(path), encoding, static=True):
+                f.write(data)
+        os.replace(tmp_path, target)
+
+def find_variant(path: str, stat: os.stat_result, accept_encodings) -> Optional[str]:
+    """Returns the encoding of the best fresh precompressed variant of `path`, if any."""
+    encodings = []
+    for encoding in available():
+        try:
+            variant = os.stat(variant_path(path, encoding))
+        except OSError:
+            continue
+        # Variants are written after their source, so an older one is stale
+        if variant.st_mtime_ns >= stat.st_mtime_ns:
+            encodings.append(encoding)
+    return negotiate(accept_encodings, encodings) if encodings else None
@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import storage
+
+class ContentStore:
+    """Stores finished media once and hardlinks it into task folders.
+
+    A blob lives in `<DOWNLOAD_DIR>/<BLOB_DIR>/<key>/<file>`. Every task folder
+    holding it adds a hardlink, so the file's link count is its reference
+    count: a blob whose only remaining link is its own can be deleted.
+    """
+
+    LINKED = 'linked'
+    ATTACHED = 'attached'
+    LEAD = 'lead'
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, List[Tuple[str, Callable[[Optional[str]], None]]]] = {}
+
+    @staticmethod
+    def make_key(info: dict, task: dict, format_option: str) -> Optional[str]:
+        if 'live' in task['task_type'] or info.get('is_live') or task.get('stream'):
+            return None
+        if not info.get('extractor_key') or not info.get('id'):
+            return None
+        material = json.dumps([
+            info['extractor_key'],
+            info['id'],
+            format_option,
+            task.get('start_time'),
+            task.get('end_time'),
+            task.get('force_keyframes', False),
+            (task.get('output_format') or '').lower()
+        ])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    def _blob_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def _find_blob(self, key: str) -> Optional[str]:
+        blob_dir = self._blob_dir(key)
+        if not os.path.isdir(blob_dir):
+            return None
+        for name in os.listdir(blob_dir):
+            path = os.path.join(blob_dir, name)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    @staticmethod
+    def _link(source: str, dest_dir: str) -> str:
+        os.makedirs(dest_dir, exist_ok=True)
+        dest = os.path.join(dest_dir, os.path.basename(source))
+        if os.path.exists(dest):
+            os.remove(dest)
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copy2(source, dest)
+        return dest
+
+    def claim(self, key: str, task_dir: str, on_ready: Callable[[Optional[str]], None]) -> str:
+        """Link an existing blob, attach to an in-flight download, or take the lead.
+
+        Attached callers get `on_ready` with the linked path once the leader
+        publishes, or with None if the leader gives up.
+        """
+        with self._lock:
+            blob = self._find_blob(key)
+            if blob:
+                self._link(blob, task_dir)
+                return self.LINKED
+            if key in self._waiters:
+                self._waiters[key].append((task_dir, on_ready))
+                return self.ATTACHED
+            self._waiters[key] = []
+            return self.LEAD
+
+    def publish(self, key: str, file_path: str) -> None:
+        with self._lock:
+            blob_dir = self._blob_dir(key)
+            os.makedirs(blob_dir, exist_ok=True)
+            blob = os.path.join(blob_dir, os.path.basename(file_path))
+            if not os.path.exists(blob):
+                try:
+                    os.link(file_path, blob)
+                except OSError:
+                    shutil.copy2(file_path, blob)
+            waiters = self._waiters.pop(key, [])
+            linked = []
+            for task_dir, on_ready in waiters:
+                try:
+                    linked.append((on_ready, self._link(blob, task_dir)))
+                except OSError as e:
+                    print(f"Error linking {blob} into {task_dir}: {e}")
+                    linked.append((on_ready, None))
+        for on_ready, path in linked:
+            on_ready(path)
+
+    def abandon(self, key: str) -> None:
+        with self._lock:
+            waiters = self._waiters.pop(key, [])
+        for _, on_ready in waiters:
+            on_ready(None)
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._release_locked(key)
+
+    def _release_locked(self, key: str) -> None:
+        if key in self._waiters:
+            return
+        blob = self._find_blob(key)
+        if blob is None or os.stat(blob).st_nlink <= 1:
+            shutil.rmtree(self._blob_dir(key), ignore_errors=True)
+
+    def collect(self) -> None:
+        if not os.path.isdir(self.root):
+            return
+        with self._lock:
+            for key in os.listdir(self.root):
+                self._release_locked(key)
+
+content_store = ContentStore(os.path.join(storage.DOWNLOAD_DIR, storage.BLOB_DIR))
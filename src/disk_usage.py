@@ -0,0 +1,205 @@
+import os
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+from src.storage import Storage
+
+InodeKey = Tuple[int, int]
+
+# The shared ledger is one usage window that never expires
+LEDGER = '*'
+KIND = 'disk'
+
+class _TaskUsage:
+    __slots__ = ('task_id', 'key_name', 'files', 'reserved', 'actual', 'charged')
+
+    def __init__(self, task_id: str, key_name: str):
+        self.task_id = task_id
+        self.key_name = key_name
+        # path -> (inode or None while the file is still being written, size)
+        self.files: Dict[str, Tuple[Optional[InodeKey], int]] = {}
+        self.reserved = 0
+        self.actual = 0
+        # Bytes of the finished files this task is charged for on the ledger
+        self.charged = 0
+
+    @property
+    def pending(self) -> int:
+        return max(self.reserved - self.actual, 0)
+
+class DiskUsageIndex:
+    """Bytes on disk per task and per key, maintained from download events.
+
+    Sizes come from progress hooks while a download runs and from a stat of
+    the task folder when it finishes, so the download directory is never
+    walked. Finished files are counted once per inode, which keeps hardlinked
+    duplicates from being charged to the server twice. Reservations that
+    have not been filled yet count towards the total as well.
+
+    What each task holds against the server's disk is also kept in a ledger
+    in storage: its reservation while it runs, and the bytes it added to
+    the disk once it finished. A file linked into several tasks is charged
+    to one of them, and passed on to another when that task goes. `total`
+    and the cap in `try_reserve` use the ledger, so they hold across all
+    API and worker processes. Progress is only tracked here; a download
+    that outgrows its reservation reserves more, which updates the ledger.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, _TaskUsage] = {}
+        self._keys: Dict[str, int] = {}
+        # inode -> [size, links, the task charged for it]
+        self._inodes: Dict[InodeKey, list] = {}
+        self._on_disk = 0
+        self._pending = 0
+        # Tasks that took over files from a task that went, to update on the ledger
+        self._heirs: Dict[str, _TaskUsage] = {}
+
+    def total(self) -> int:
+        return Storage.usage_total(LEDGER, KIND, 0.0)
+
+    def key_usage(self, key_name: str) -> int:
+        return self._keys.get(key_name, 0)
+
+    def key_name(self, task_id: str) -> Optional[str]:
+        usage = self._tasks.get(task_id)
+        return usage.key_name if usage else None
+
+    def task_usage(self, task_id: str) -> Tuple[int, int]:
+        """Returns (actual, reserved) bytes of a task."""
+        usage = self._tasks.get(task_id)
+        return (usage.actual, usage.reserved) if usage else (0, 0)
+
+    def try_reserve(self, task_id: str, key_name: str, size: int, available: int) -> Tuple[bool, int]:
+        """Raises the reservation of a task to `size` if the total stays within `available`.
+
+        Returns (reserved, total) with the total as it was before.
+        """
+        actual, _ = self.task_usage(task_id)
+        reserved, total = Storage.reserve_usage(LEDGER, task_id, max(size, actual), time.time(), 0.0, available, KIND)
+        if not reserved:
+            return False, total
+        with self._lock:
+            usage = self._tasks.get(task_id)
+            if usage is None:
+                usage = self._tasks[task_id] = _TaskUsage(task_id, key_name)
+            self._pending -= usage.pending
+            usage.reserved = max(size, 0)
+            self._pending += usage.pending
+        return True, total
+
+    def _set_file(self, usage: _TaskUsage, path: str, inode: Optional[InodeKey], size: int) -> None:
+        old = usage.files.get(path)
+        if old is not None:
+            self._drop_file(usage, old)
+        usage.files[path] = (inode, size)
+        usage.actual += size
+        self._keys[usage.key_name] = self._keys.get(usage.key_name, 0) + size
+        if inode is None:
+            self._on_disk += size
+            return
+        entry = self._inodes.get(inode)
+        if entry is None:
+            self._inodes[inode] = [size, 1, usage]
+            self._on_disk += size
+            usage.charged += size
+        else:
+            entry[1] += 1
+
+    def _drop_file(self, usage: _TaskUsage, file: Tuple[Optional[InodeKey], int]) -> None:
+        inode, size = file
+        usage.actual -= size
+        self._keys[usage.key_name] -= size
+        if inode is None:
+            self._on_disk -= size
+            return
+        entry = self._inodes[inode]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._inodes[inode]
+            self._on_disk -= entry[0]
+            usage.charged -= entry[0]
+        elif entry[2] is usage:
+            heir = next((
+                other for other in self._tasks.values()
+                if other is not usage and any(file[0] == inode for file in other.files.values())
+            ), None)
+            if heir is None:
+                # The other links are this task's own
+                return
+            entry[2] = heir
+            usage.charged -= entry[0]
+            heir.charged += entry[0]
+            self._heirs[heir.task_id] = heir
+
+    def _charge_heirs(self) -> None:
+        with self._lock:
+            heirs, self._heirs = self._heirs, {}
+        for task_id, heir in heirs.items():
+            Storage.reserve_usage(LEDGER, task_id, heir.charged, time.time(), 0.0, kind=KIND)
+
+    def record_progress(self, task_id: str, path: str, size: int) -> int:
+        """Records the bytes written so far to one file of a task; returns the task's total."""
+        with self._lock:
+            usage = self._tasks.get(task_id)
+            if usage is None:
+                return 0
+            self._pending -= usage.pending
+            self._set_file(usage, path, None, size)
+            self._pending += usage.pending
+            return usage.actual
+
+    def reconcile(self, task_id: str, task_dir: str, key_name: Optional[str] = None) -> int:
+        """Replaces the task's sizes with what is in its folder and drops its reservation."""
+        files = {}
+        if os.path.isdir(task_dir):
+            for name in os.listdir(task_dir):
+                path = os.path.join(task_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = ((stat.st_dev, stat.st_ino), stat.st_size)
+
+        with self._lock:
+            usage = self._tasks.get(task_id)
+            # Another node's task has no folder here, and its entry on the ledger is not ours to change
+            charge = usage is not None or bool(files)
+            if usage is None:
+                if key_name is None:
+                    return 0
+                usage = self._tasks[task_id] = _TaskUsage(task_id, key_name)
+            self._pending -= usage.pending
+            for file in list(usage.files.values()):
+                self._drop_file(usage, file)
+            usage.files = {}
+            usage.reserved = 0
+            for path, (inode, size) in files.items():
+                self._set_file(usage, path, inode, size)
+            charged, actual = usage.charged, usage.actual
+        if charge:
+            Storage.reserve_usage(LEDGER, task_id, charged, time.time(), 0.0, kind=KIND)
+        self._charge_heirs()
+        return actual
+
+    def remove(self, task_id: str) -> None:
+        # The task may have been downloaded by another process
+        Storage.release_usage(KIND, task_id)
+        self.forget(task_id)
+
+    def forget(self, task_id: str) -> None:
+        """Drops a task from this process's index only, leaving the ledger as it is."""
+        with self._lock:
+            usage = self._tasks.pop(task_id, None)
+            if usage is None:
+                return
+            self._pending -= usage.pending
+            for file in usage.files.values():
+                self._drop_file(usage, file)
+            if not self._keys.get(usage.key_name):
+                self._keys.pop(usage.key_name, None)
+        self._charge_heirs()
+
+disk_usage = DiskUsageIndex()
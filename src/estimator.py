@@ -0,0 +1,67 @@
+from typing import Optional
+
+from src.cache import InfoCache, TTLCache, normalize_url
+from src.ydl_pool import YDLPool
+from config import cache as cache_config
+
+def format_size(fmt: dict, duration: Optional[float], window: Optional[float]) -> Optional[int]:
+    """Bytes `fmt` takes for `window` seconds of a `duration` second video.
+
+    Uses the reported size when there is one, scaled down to the window,
+    and otherwise the bitrate times the window or the whole duration.
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        if window is not None and duration:
+            return int(size * min(window / duration, 1.0))
+        return int(size)
+
+    # tbr, vbr and abr are in KBit/s
+    bitrate = fmt.get('tbr') or (fmt.get('vbr') or 0) + (fmt.get('abr') or 0)
+    seconds = window if window is not None else duration
+    if bitrate and seconds:
+        return int(bitrate * 1000 / 8 * seconds)
+    return None
+
+class SizeEstimator:
+    """Predicts the bytes a download will write before it starts.
+
+    The formats are the ones yt-dlp itself selects for the task's format
+    spec, from the cached extraction, so the estimate matches what gets
+    downloaded. Results are memoized per video, spec and time range.
+    """
+
+    def __init__(self, ydl_pool: YDLPool, info_cache: InfoCache, profile: str):
+        self.ydl_pool = ydl_pool
+        self.info_cache = info_cache
+        self.profile = profile
+        self._cache = TTLCache(cache_config.ESTIMATE_CACHE_SIZE, cache_config.INFO_CACHE_TTL_SECONDS, 'estimate')
+
+    def estimate(self, url: str, format_spec: str, start: Optional[float] = None,
+                 end: Optional[float] = None) -> int:
+        """Returns the estimated size in bytes, or -1 if a selected format has neither size nor bitrate."""
+        return self._cache.get_or_load(
+            (normalize_url(url), format_spec, start, end),
+            lambda: self._estimate(url, format_spec, start, end)
+        )
+
+    def _estimate(self, url: str, format_spec: str, start: Optional[float], end: Optional[float]) -> int:
+        info = self.info_cache.get(url)
+        with self.ydl_pool.acquire(self.profile, format=format_spec) as ydl:
+            selected = ydl.process_ie_result(info, download=False)
+
+        duration = selected.get('duration')
+        window = None
+        if start is not None or end is not None:
+            if end is None or (duration and end > duration):
+                end = duration
+            if end is not None:
+                window = max(end - (start or 0), 0)
+
+        total = 0
+        for fmt in selected.get('requested_formats') or [selected]:
+            size = format_size(fmt, duration, window)
+            if size is None:
+                return -1
+            total += size
+        return total
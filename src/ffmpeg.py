@@ -0,0 +1,96 @@
+import re
+import subprocess
+import threading
+from collections import deque
+from typing import Callable, List, Optional
+
+DURATION_RE = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+class FFmpegError(Exception):
+    pass
+
+class FFmpegCancelled(FFmpegError):
+    pass
+
+class FFmpegJob:
+    """Runs one ffmpeg command with streamed `-progress` output.
+
+    stderr is drained on a side thread and only its tail is kept, so long
+    conversions do not buffer their whole log in memory.
+    """
+
+    STDERR_TAIL_LINES = 20
+
+    def __init__(self, cmd: List[str], timeout: Optional[float] = None,
+                 on_progress: Optional[Callable[[float], None]] = None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.duration: Optional[float] = None
+        self._stderr_tail = deque(maxlen=self.STDERR_TAIL_LINES)
+        self._process: Optional[subprocess.Popen] = None
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._timed_out = False
+
+    def _read_stderr(self):
+        for line in self._process.stderr:
+            if self.duration is None:
+                match = DURATION_RE.search(line)
+                if match:
+                    h, m, s = match.groups()
+                    self.duration = int(h) * 3600 + int(m) * 60 + float(s)
+            self._stderr_tail.append(line.rstrip())
+
+    def _on_timeout(self):
+        self._timed_out = True
+        self._kill()
+
+    def _kill(self):
+        with self._lock:
+            if self._process and self._process.poll() is None:
+                self._process.kill()
+
+    def cancel(self):
+        self._cancelled = True
+        self._kill()
+
+    def run(self) -> None:
+        cmd = [self.cmd[0], '-hide_banner', '-nostats', '-progress', 'pipe:1'] + self.cmd[1:]
+        with self._lock:
+            if self._cancelled:
+                raise FFmpegCancelled("Task was cancelled")
+            self._process = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, text=True, bufsize=1
+            )
+
+        stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        stderr_reader.start()
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self._on_timeout)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            for line in self._process.stdout:
+                key, _, value = line.strip().partition('=')
+                if key == 'out_time_us' and self.on_progress and self.duration:
+                    try:
+                        seconds = int(value) / 1_000_000
+                    except ValueError:
+                        continue
+                    self.on_progress(min(100.0, seconds / self.duration * 100))
+            returncode = self._process.wait()
+            stderr_reader.join(timeout=5)
+        finally:
+            if timer:
+                timer.cancel()
+
+        if self._cancelled:
+            raise FFmpegCancelled("Task was cancelled")
+        if self._timed_out:
+            raise FFmpegError(f"ffmpeg timed out after {self.timeout} seconds")
+        if returncode != 0:
+            raise FFmpegError('\n'.join(self._stderr_tail))
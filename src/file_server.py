@@ -0,0 +1,149 @@
+import os
+import mimetypes
+import secrets
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+from flask import Response, request
+from werkzeug.http import http_date
+
+from src import compression
+from config import storage
+from config import compression as compression_config
+
+# Live recording segments; the system table may map .ts to something else
+mimetypes.add_type('video/mp2t', '.ts')
+
+def make_etag(stat: os.stat_result) -> str:
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+def _read_range(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(storage.FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def _file_body(path: str, start: int, end: int, size: int):
+    # Servers such as gunicorn turn wsgi.file_wrapper into os.sendfile and
+    # stop after Content-Length bytes, so partial ranges can use it as well.
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    server = request.environ.get('SERVER_SOFTWARE', '')
+    if file_wrapper and (start == 0 and end == size or server.startswith('gunicorn')):
+        f = open(path, 'rb')
+        f.seek(start)
+        return file_wrapper(f, storage.FILE_CHUNK_SIZE)
+    return _read_range(path, start, end)
+
+def _resolve_ranges(stat: os.stat_result) -> Optional[List[Tuple[int, int]]]:
+    """Returns the satisfiable ranges as [start, end) pairs, [] if none are."""
+    header = request.range
+    if header is None or header.units != 'bytes':
+        return None
+    if not _if_range_matches(stat):
+        return None
+    return _normalize(header.ranges, stat.st_size)
+
+def _if_range_matches(stat: os.stat_result) -> bool:
+    if_range = request.if_range
+    if not if_range.etag and not if_range.date:
+        return True
+    if if_range.etag:
+        return if_range.etag == make_etag(stat)
+    modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    return if_range.date is not None and if_range.date >= modified
+
+def _normalize(ranges, size: int) -> List[Tuple[int, int]]:
+    result = []
+    for start, stop in ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            result.append((start, stop))
+    return result
+
+def _not_modified(etag: str, stat: os.stat_result) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+        return request.if_modified_since >= modified
+    return False
+
+def send_file(path: str, filename: str, raw: bool = False) -> Response:
+    """Serves a file with validators, single and multi-range support.
+
+    The body is streamed from disk (or handed to the server's sendfile via
+    wsgi.file_wrapper) so large files are never read into memory. A
+    precompressed variant written by `compression.write_variants` is sent
+    instead when the client accepts its encoding; ranges then apply to it.
+    """
+    stat = os.stat(path)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    if mimetype in compression_config.MIMETYPES:
+        encoding = compression.find_variant(path, stat, request.accept_encodings)
+        if encoding is not None:
+            path = compression.variant_path(path, encoding)
+            stat = os.stat(path)
+    size = stat.st_size
+    etag = make_etag(stat)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        # The playlist of a running recording changes with every segment
+        'Cache-Control': 'no-cache' if filename.endswith('.m3u8') else 'public, max-age=3600',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(stat.st_mtime)
+    }
+    if mimetype in compression_config.MIMETYPES:
+        headers['Vary'] = 'Accept-Encoding'
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    if raw:
+        headers['Content-Disposition'] = f'inline; filename="{os.path.basename(filename)}"'
+
+    if _not_modified(etag, stat):
+        return Response(status=304, headers=headers)
+
+    ranges = _resolve_ranges(stat)
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        return Response(_file_body(path, 0, size, size), status=200, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        headers['Content-Length'] = str(end - start)
+        return Response(_file_body(path, start, end, size), status=206, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+
+    boundary = secrets.token_hex(16)
+    parts = [
+        ((f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+          f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode(), start, end)
+        for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+
+    def generate() -> Iterator[bytes]:
+        for i, (part_header, start, end) in enumerate(parts):
+            yield (b'\r\n' if i else b'') + part_header
+            yield from _read_range(path, start, end)
+        yield closing
+
+    length = sum(len(h) + (end - start) for h, start, end in parts) + 2 * (len(parts) - 1) + len(closing)
+    headers['Content-Length'] = str(length)
+    return Response(generate(), status=206, headers=headers,
+                    mimetype=f'multipart/byteranges; boundary={boundary}', direct_passthrough=True)
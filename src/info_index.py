@@ -0,0 +1,152 @@
+import os
+import json
+import threading
+from typing import List, Optional
+
+from src import compression
+
+INDEX_NAME = 'info.index.json'
+INDEX_VERSION = 1
+
+def _int(value) -> Optional[int]:
+    """`int(value)`, or None for fields a format leaves out or sets to null."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def extract_qualities(data: dict) -> dict:
+    qualities = {"audio": {}, "video": {}}
+
+    for fmt in data.get('formats') or []:
+        if fmt.get('format_note') in ['unknown', 'storyboard'] or not fmt.get('format_id'):
+            continue
+
+        # Audio format
+        if fmt.get('acodec') != 'none' and fmt.get('vcodec') == 'none' and fmt.get('abr'):
+            qualities["audio"][fmt['format_id']] = {
+                "abr": _int(fmt.get('abr')),
+                "acodec": fmt.get('acodec'),
+                "audio_channels": _int(fmt.get('audio_channels')) or 0,
+                "language": fmt.get('language'),
+                "filesize": _int(fmt.get('filesize') or fmt.get('filesize_approx')) or 0
+            }
+
+        # Video format
+        elif fmt.get('vcodec') != 'none' and fmt.get('height') and fmt.get('fps'):
+            qualities["video"][fmt['format_id']] = {
+                "height": _int(fmt.get('height')),
+                "width": _int(fmt.get('width')),
+                "fps": _int(fmt.get('fps')),
+                "vcodec": fmt.get('vcodec'),
+                "format_note": fmt.get('format_note', 'unknown'),
+                "dynamic_range": fmt.get('dynamic_range', 'unknown'),
+                "filesize": _int(fmt.get('filesize') or fmt.get('filesize_approx')) or 0
+            }
+
+    qualities["video"] = dict(sorted(qualities["video"].items(),
+                                   key=lambda x: (x[1]['height'] or 0, x[1]['fps'] or 0)))
+    qualities["audio"] = dict(sorted(qualities["audio"].items(),
+                                   key=lambda x: x[1]['abr'] or 0))
+
+    return qualities
+
+def index_path(info_path: str) -> str:
+    return os.path.join(os.path.dirname(info_path), INDEX_NAME)
+
+def _validator(stat: os.stat_result) -> list:
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _tmp_path(path: str) -> str:
+    # Requests may rebuild the same index concurrently
+    return f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def write_info(info_path: str, info: dict) -> dict:
+    """Writes info.json and its index; returns the index.
+
+    The document is the same as `json.dump(info, f)` produces, but it is
+    written one top-level field at a time so the byte range of every
+    list or object value can be recorded. Scalars are copied into the
+    index and the qualities table is computed once here, before anything
+    is written. Both files get precompressed variants for `send_file`.
+    """
+    qualities = extract_qualities(info)
+    scalars = {}
+    sections = {}
+    tmp_path = _tmp_path(info_path)
+    with open(tmp_path, 'wb') as f:
+        f.write(b'{')
+        for i, (key, value) in enumerate(info.items()):
+            f.write(f"{', ' if i else ''}{json.dumps(key)}: ".encode())
+            # ensure_ascii is on, so characters and bytes line up
+            encoded = json.dumps(value).encode()
+            if isinstance(value, (dict, list)):
+                sections[key] = [f.tell(), len(encoded)]
+            else:
+                scalars[key] = value
+            f.write(encoded)
+        f.write(b'}')
+    os.replace(tmp_path, info_path)
+
+    index = {
+        'version': INDEX_VERSION,
+        'source': _validator(os.stat(info_path)),
+        'qualities': qualities,
+        'scalars': scalars,
+        'sections': sections
+    }
+    _write_atomic(index_path(info_path), json.dumps(index, separators=(',', ':')).encode())
+    compression.write_variants(info_path)
+    compression.write_variants(index_path(info_path))
+    return index
+
+def load_index(info_path: str) -> dict:
+    """Returns the index of `info_path`, rebuilding it when missing or stale.
+
+    Files written before the index existed are parsed once and rewritten.
+    """
+    try:
+        with open(index_path(info_path), 'rb') as f:
+            index = json.load(f)
+        if index.get('version') == INDEX_VERSION and index.get('source') == _validator(os.stat(info_path)):
+            return index
+    except (OSError, ValueError):
+        pass
+
+    with open(info_path, 'r') as f:
+        info = json.load(f)
+    return write_info(info_path, info)
+
+def query(info_path: str, fields: List[str]) -> Optional[dict]:
+    """Returns the requested fields of info.json, or None if none exist.
+
+    `qualities` and scalar fields come from the index; other fields are
+    read from their byte range without parsing the rest of the document.
+    """
+    index = load_index(info_path)
+    result = {}
+    if 'qualities' in fields:
+        result['qualities'] = index['qualities']
+    f = None
+    try:
+        for key in fields:
+            if key == 'qualities':
+                continue
+            if key in index['scalars']:
+                result[key] = index['scalars'][key]
+            elif key in index['sections']:
+                offset, length = index['sections'][key]
+                if f is None:
+                    f = open(info_path, 'rb')
+                f.seek(offset)
+                result[key] = json.loads(f.read(length))
+    finally:
+        if f is not None:
+            f.close()
+    return result or None
@@ -0,0 +1,167 @@
+import os
+import time
+import threading
+import subprocess
+from typing import Callable, Dict, List, Optional
+
+from config import task as task_config
+
+PLAYLIST_NAME = 'live.m3u8'
+SEGMENT_PATTERN = 'segment_%06d.ts'
+LOG_NAME = '.ffmpeg.log'
+# Protocols of formats ffmpeg can read by itself
+PROTOCOLS = ('m3u8', 'm3u8_native', 'http', 'https')
+
+def is_segment(name: str) -> bool:
+    return name.startswith('segment_') and name.endswith('.ts')
+
+def build_command(inputs: List[dict], task_dir: str, audio_only: bool,
+                  seconds: Optional[float], window: int) -> List[str]:
+    """ffmpeg command copying `inputs` (yt-dlp formats) into a rolling HLS playlist.
+
+    With a `window` only the segments of its last `window` seconds are kept,
+    otherwise every segment stays in the playlist.
+    """
+    cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y']
+    for fmt in inputs:
+        headers = ''.join(f'{name}: {value}\r\n' for name, value in (fmt.get('http_headers') or {}).items())
+        if headers:
+            cmd += ['-headers', headers]
+        cmd += ['-i', fmt['url']]
+    for i in range(len(inputs)):
+        if not audio_only:
+            cmd += ['-map', f'{i}:v?']
+        cmd += ['-map', f'{i}:a?']
+    cmd += ['-c', 'copy']
+    if seconds is not None:
+        cmd += ['-t', f'{seconds:.3f}']
+
+    # A retried recording continues the playlist and numbering it left behind
+    flags = ['append_list', 'program_date_time', 'temp_file']
+    segment_seconds = task_config.LIVE_SEGMENT_SECONDS
+    if window:
+        flags.append('delete_segments')
+        list_size = max(-(-window // segment_seconds), 1)
+    else:
+        list_size = 0
+        cmd += ['-hls_playlist_type', 'event']
+    cmd += [
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_list_size', str(list_size),
+        '-hls_flags', '+'.join(flags),
+        '-hls_segment_filename', os.path.join(task_dir, SEGMENT_PATTERN),
+        os.path.join(task_dir, PLAYLIST_NAME)
+    ]
+    return cmd
+
+class Recording:
+    __slots__ = ('task_id', 'task_dir', 'process', 'log', 'stopped', 'error')
+
+    def __init__(self, task_id: str, task_dir: str, process: subprocess.Popen, log):
+        self.task_id = task_id
+        self.task_dir = task_dir
+        self.process = process
+        self.log = log
+        # Set when we ended the recording rather than ffmpeg or the stream
+        self.stopped = False
+        self.error: Optional[str] = None
+
+    def stats(self) -> dict:
+        segments, size = 0, 0
+        try:
+            for entry in os.scandir(self.task_dir):
+                if is_segment(entry.name):
+                    segments += 1
+                    size += entry.stat().st_size
+        except OSError:
+            pass
+        return {'segments': segments, 'bytes': size}
+
+    def log_tail(self, limit: int = 2000) -> str:
+        try:
+            with open(os.path.join(self.task_dir, LOG_NAME), 'rb') as f:
+                f.seek(max(os.fstat(f.fileno()).st_size - limit, 0))
+                return f.read().decode(errors='replace').strip()
+        except OSError:
+            return ''
+
+class LiveRecorder:
+    """Runs live recordings as ffmpeg processes watched by one thread.
+
+    ffmpeg cuts the stream into LIVE_SEGMENT_SECONDS segments and keeps the
+    playlist current, so segments can be served while the recording runs.
+    Its log goes to a file in the task folder, which leaves nothing to read
+    per recording: a single supervisor polls every process each
+    LIVE_POLL_SECONDS, reports progress with `on_progress(task_id, stats)`
+    and calls `on_exit(task_id, error, stopped)` once a recording ends.
+    """
+
+    def __init__(self, on_progress: Callable[[str, dict], None],
+                 on_exit: Callable[[str, Optional[str], bool], None]):
+        self.on_progress = on_progress
+        self.on_exit = on_exit
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, Recording] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def room(self) -> int:
+        with self._lock:
+            return max(task_config.MAX_LIVE_RECORDINGS - len(self._recordings), 0)
+
+    def active(self) -> int:
+        return len(self._recordings)
+
+    def start(self, task_id: str, cmd: List[str], task_dir: str) -> None:
+        log = open(os.path.join(task_dir, LOG_NAME), 'ab')
+        try:
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log)
+        except BaseException:
+            log.close()
+            raise
+        with self._lock:
+            self._recordings[task_id] = Recording(task_id, task_dir, process, log)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-recorder', daemon=True)
+                self._thread.start()
+
+    def stop(self, task_id: str, error: Optional[str] = None) -> bool:
+        """Ends a recording; ffmpeg finishes the playlist before it exits."""
+        with self._lock:
+            recording = self._recordings.get(task_id)
+        if recording is None:
+            return False
+        recording.stopped = True
+        recording.error = recording.error or error
+        if recording.process.poll() is None:
+            recording.process.terminate()
+        return True
+
+    def stop_all(self) -> None:
+        for task_id in list(self._recordings):
+            self.stop(task_id)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(task_config.LIVE_POLL_SECONDS)
+            with self._lock:
+                recordings = list(self._recordings.values())
+            for recording in recordings:
+                try:
+                    self._check(recording)
+                except Exception as e:
+                    print(f"Error checking live recording {recording.task_id}: {e}")
+
+    def _check(self, recording: Recording) -> None:
+        returncode = recording.process.poll()
+        if returncode is None:
+            self.on_progress(recording.task_id, recording.stats())
+            return
+
+        with self._lock:
+            self._recordings.pop(recording.task_id, None)
+        recording.log.close()
+        error = recording.error
+        if error is None and returncode != 0 and not recording.stopped:
+            error = recording.log_tail() or f"ffmpeg exited with code {returncode}"
+        self.on_exit(recording.task_id, error, recording.stopped)
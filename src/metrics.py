@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import node as node_config
+from config import metrics as metrics_config
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def describe(self) -> dict:
+        return {'type': self.kind, 'help': self.help, 'labels': list(self.labels)}
+
+    def samples(self) -> List[list]:
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """Bucket counts plus a sum per label set; buckets are made cumulative when rendered."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def describe(self) -> dict:
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # One count per bucket, one for +Inf, then the sum
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def samples(self) -> List[list]:
+        with self._lock:
+            return [[list(key), list(value)] for key, value in self._values.items()]
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: List[str], values: List[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+class Registry:
+    """Metrics of this process, merged with the other processes of the node.
+
+    Every process writes its samples to `directory` every
+    METRICS_SNAPSHOT_SECONDS, so the API can report what the gunicorn workers
+    and download workers next to it recorded. Files not refreshed for
+    METRICS_STALE_SECONDS are dropped.
+    """
+
+    def __init__(self, directory: str, process_name: str):
+        self.directory = directory
+        self.snapshot_file = os.path.join(directory, f'{process_name}.json')
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._snapshotter: Optional[threading.Thread] = None
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """Registers a callback that refreshes gauges before samples are read."""
+        self._collectors.append(collector)
+
+    def collect(self) -> Dict[str, dict]:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Error in metrics collector: {e}")
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {**metric.describe(), 'samples': metric.samples()} for metric in metrics}
+
+    def snapshot(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_file = f'{self.snapshot_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.collect(), f)
+        os.replace(tmp_file, self.snapshot_file)
+
+    def _remove_snapshot(self) -> None:
+        try:
+            os.remove(self.snapshot_file)
+        except OSError:
+            pass
+
+    def _snapshot_loop(self) -> None:
+        while True:
+            time.sleep(metrics_config.METRICS_SNAPSHOT_SECONDS)
+            try:
+                self.snapshot()
+            except Exception as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+    def start(self) -> None:
+        if self._snapshotter is not None:
+            return
+        self._snapshotter = threading.Thread(target=self._snapshot_loop, name='metrics-snapshot', daemon=True)
+        self._snapshotter.start()
+        atexit.register(self._remove_snapshot)
+
+    def _other_snapshots(self) -> List[Dict[str, dict]]:
+        snapshots = []
+        if not os.path.isdir(self.directory):
+            return snapshots
+        stale_before = time.time() - metrics_config.METRICS_STALE_SECONDS
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.json') or path == self.snapshot_file:
+                continue
+            try:
+                if os.path.getmtime(path) < stale_before:
+                    os.remove(path)
+                    continue
+                with open(path, 'r') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    @staticmethod
+    def _merge(merged: Dict[str, dict], snapshot: Dict[str, dict]) -> None:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'samples': {}})
+            for labels, value in metric['samples']:
+                key = tuple(labels)
+                current = target['samples'].get(key)
+                if current is None:
+                    target['samples'][key] = value
+                elif metric['type'] == 'histogram':
+                    target['samples'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['samples'][key] = current + value
+
+    def render(self) -> str:
+        """Returns the merged metrics in the Prometheus text format."""
+        merged: Dict[str, dict] = {}
+        for snapshot in [self.collect()] + self._other_snapshots():
+            self._merge(merged, snapshot)
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            names = metric['labels']
+            lines.append(f'# HELP {name} {metric["help"]}')
+            lines.append(f'# TYPE {name} {metric["type"]}')
+            for labels, value in sorted(metric['samples'].items()):
+                labels = list(labels)
+                if metric['type'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(names, labels)} {value}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else repr(float(bound))
+                    lines.append(f'{name}_bucket{_format_labels(names + ["le"], labels + [le])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(names, labels)} {value[-1]}')
+                lines.append(f'{name}_count{_format_labels(names, labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def timed(function: str):
+    """Records the duration of every call in FUNCTION_SECONDS."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                FUNCTION_SECONDS.observe(time.perf_counter() - start, function=function)
+        return wrapper
+    return decorator
+
+registry = Registry(metrics_config.METRICS_DIR, f'{node_config.NODE_ID}-{os.getpid()}')
+
+HTTP_REQUESTS = registry.counter(
+    'ytdlp_host_http_requests_total', 'HTTP requests by route, method and status.', ('route', 'method', 'status'))
+HTTP_SECONDS = registry.histogram(
+    'ytdlp_host_http_request_duration_seconds', 'Time until the response headers were ready.', ('route', 'method'))
+FUNCTION_SECONDS = registry.histogram(
+    'ytdlp_host_function_duration_seconds', 'Duration of instrumented hot paths.', ('function',))
+STORAGE_SECONDS = registry.histogram(
+    'ytdlp_host_storage_operation_duration_seconds', 'Duration of storage backend operations.', ('operation',))
+STORAGE_BYTES = registry.counter(
+    'ytdlp_host_storage_bytes_total', 'Serialized task and key data read from and written to storage.', ('direction',))
+POOL_WAIT_SECONDS = registry.histogram(
+    'ytdlp_host_pool_wait_seconds', 'Time tasks spent queued before a worker picked them up.', ('pool',))
+POOL_REJECTED = registry.counter(
+    'ytdlp_host_pool_rejected_total', 'Tasks rejected because the pool queue was full.', ('pool',))
+POOL_WORKERS = registry.gauge('ytdlp_host_pool_workers', 'Worker threads per pool.', ('pool',))
+POOL_RUNNING = registry.gauge('ytdlp_host_pool_running', 'Tasks running per pool.', ('pool',))
+POOL_QUEUED = registry.gauge('ytdlp_host_pool_queued', 'Tasks queued per pool.', ('pool',))
+CACHE_REQUESTS = registry.counter(
+    'ytdlp_host_cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+DOWNLOAD_BYTES = registry.counter('ytdlp_host_download_bytes_total', 'Bytes downloaded by yt-dlp.')
+DOWNLOAD_CONNECTIONS = registry.gauge(
+    'ytdlp_host_download_connections', 'Connections granted to running downloads.')
+LIVE_RECORDINGS = registry.gauge('ytdlp_host_live_recordings', 'Segmented live recordings running.')
+TASKS_FINISHED = registry.counter(
+    'ytdlp_host_tasks_finished_total', 'Tasks finished by this process, by status.', ('status',))
+EVICTIONS = registry.counter(
+    'ytdlp_host_evictions_total', 'Completed tasks moved to the cold tier or deleted, by reason.', ('reason',))
+REJECTIONS = registry.counter(
+    'ytdlp_host_rejections_total', 'Requests and downloads refused by a limit.', ('reason',))
+
+registry.start()
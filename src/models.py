@@ -1,3 +1,5 @@
+import random
+import string
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Any
 from enum import Enum
@@ -14,6 +16,11 @@ class TaskType(Enum):
     GET_INFO = "get_info"
     GET_LIVE_VIDEO = "get_live_video"
     GET_LIVE_AUDIO = "get_live_audio"
+    # Created by /batch; turns a playlist into one task per entry
+    EXPAND_PLAYLIST = "expand_playlist"
+
+def generate_task_id(length: int = 16) -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
 @dataclass
 class Task:
@@ -30,6 +37,12 @@ class Task:
     start: Optional[int] = 0
     duration: Optional[int] = None
     output_format: Optional[str] = None
+    stream: bool = False
+    segmented: bool = False
+    window: Optional[int] = None
+    acceleration: Optional[str] = None
+    # Of an expand_playlist task: the task each entry becomes, but for its url
+    entry_task: Optional[Dict[str, Any]] = None
     completed_time: Optional[str] = None
     error: Optional[str] = None
     file: Optional[str] = None
@@ -44,7 +57,8 @@ class Task:
         
         optional_fields = ['video_format', 'audio_format', 'start_time', 
                           'end_time', 'force_keyframes', 'start', 'duration',
-                          'output_format', 'completed_time', 'error', 'file']
+                          'output_format', 'stream', 'segmented', 'window', 'acceleration', 'entry_task',
+                          'completed_time', 'error', 'file']
         
         for field_name in optional_fields:
             value = getattr(self, field_name, None)
@@ -61,12 +75,16 @@ class ApiKey:
     memory_quota: int = 5368709120
     memory_usage: List[Dict] = field(default_factory=list)
     last_access: Optional[str] = None
+    acceleration: Optional[str] = None
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
+        data = {
             'key': self.key,
             'permissions': self.permissions,
             'memory_quota': self.memory_quota,
             'memory_usage': self.memory_usage,
             'last_access': self.last_access
         }
+        if self.acceleration is not None:
+            data['acceleration'] = self.acceleration
+        return data
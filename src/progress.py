@@ -0,0 +1,158 @@
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+from src.storage import Storage
+from config import task as task_config
+
+class ProgressTracker:
+    """In-memory progress table for running tasks.
+
+    Updates are cheap and wake up anyone waiting on the task; they reach
+    storage at most once per PROGRESS_UPDATE_SECONDS per task.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._progress: Dict[str, dict] = {}
+        self._versions: Dict[str, int] = {}
+        self._persisted_at: Dict[str, float] = {}
+
+    def update(self, task_id: str, force_persist: bool = False, **fields) -> None:
+        now = time.monotonic()
+        with self._cond:
+            progress = self._progress.setdefault(task_id, {})
+            progress.update(fields)
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            self._cond.notify_all()
+            persist = force_persist or now - self._persisted_at.get(task_id, 0.0) >= task_config.PROGRESS_UPDATE_SECONDS
+            if persist:
+                self._persisted_at[task_id] = now
+                snapshot = dict(progress)
+        if persist:
+            Storage.update_task(task_id, progress=snapshot)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._cond:
+            progress = self._progress.get(task_id)
+            return dict(progress) if progress is not None else None
+
+    def version(self, task_id: str) -> int:
+        with self._cond:
+            return self._versions.get(task_id, 0)
+
+    def wait(self, task_id: str, version: int, timeout: float) -> Tuple[int, bool]:
+        """Blocks until the task changes past `version`; returns (version, changed)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._versions.get(task_id, 0) == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return version, False
+                self._cond.wait(remaining)
+            return self._versions.get(task_id, 0), True
+
+    def finish(self, task_id: str) -> None:
+        with self._cond:
+            self._progress.pop(task_id, None)
+            self._persisted_at.pop(task_id, None)
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            self._cond.notify_all()
+
+    def notify(self, task_id: str) -> None:
+        """Wakes whoever waits on a task that changed elsewhere, e.g. in another process."""
+        with self._cond:
+            self._versions[task_id] = self._versions.get(task_id, 0) + 1
+            self._cond.notify_all()
+
+    def forget(self, task_id: str) -> None:
+        with self._cond:
+            self._versions.pop(task_id, None)
+
+    def on_download(self, task_id: str, status: dict, **extra) -> None:
+        total = status.get('total_bytes') or status.get('total_bytes_estimate')
+        downloaded = status.get('downloaded_bytes') or 0
+        fields = {
+            'stage': 'downloading' if status['status'] == 'downloading' else 'downloaded',
+            'filename': status.get('filename'),
+            'downloaded_bytes': downloaded,
+            'total_bytes': int(total) if total else None,
+            'speed': int(status['speed']) if status.get('speed') else None,
+            'eta': status.get('eta'),
+            'percent': round(downloaded / total * 100, 1) if total else None
+        }
+        if status.get('fragment_count'):
+            fields['fragment_index'] = status.get('fragment_index')
+            fields['fragment_count'] = status['fragment_count']
+        fields.update(extra)
+        self.update(task_id, force_persist=status['status'] == 'finished', **fields)
+
+    def on_postprocess(self, task_id: str, status: dict) -> None:
+        self.update(task_id, stage='postprocessing', postprocessor=status.get('postprocessor'))
+
+class TaskWatcher:
+    """Keeps the stored state of tasks that status streams follow.
+
+    Instead of every subscriber reading its task, one thread per process
+    reads all watched tasks at once every PROGRESS_UPDATE_SECONDS and wakes
+    the subscribers of those that changed through the progress tracker, as
+    a local progress update does.
+    """
+
+    def __init__(self, tracker: ProgressTracker):
+        self.tracker = tracker
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, int] = {}
+        self._tasks: Dict[str, Optional[dict]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, task_id: str) -> None:
+        with self._lock:
+            self._subscribers[task_id] = self._subscribers.get(task_id, 0) + 1
+            loaded = task_id in self._tasks
+        if not loaded:
+            task = Storage.get_task(task_id)
+        with self._lock:
+            if not loaded:
+                self._tasks.setdefault(task_id, task)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='task-watcher', daemon=True)
+                self._thread.start()
+
+    def unwatch(self, task_id: str) -> None:
+        with self._lock:
+            self._subscribers[task_id] -= 1
+            if not self._subscribers[task_id]:
+                del self._subscribers[task_id]
+                self._tasks.pop(task_id, None)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return dict(task) if task is not None else None
+
+    def refresh(self) -> None:
+        with self._lock:
+            task_ids = list(self._subscribers)
+        if not task_ids:
+            return
+        tasks = Storage.get_tasks(task_ids)
+        changed = []
+        with self._lock:
+            for task_id in task_ids:
+                if task_id in self._subscribers and self._tasks.get(task_id) != tasks.get(task_id):
+                    self._tasks[task_id] = tasks.get(task_id)
+                    changed.append(task_id)
+        for task_id in changed:
+            self.tracker.notify(task_id)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(task_config.PROGRESS_UPDATE_SECONDS)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing watched tasks: {e}")
+
+progress_tracker = ProgressTracker()
+task_watcher = TaskWatcher(progress_tracker)
@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from src import metrics
+
+class QueueFullError(Exception):
+    pass
+
+class WorkerPool:
+    """Fixed set of worker threads fed from a bounded priority queue.
+
+    Lower priority values run first; equal priorities run in submission
+    order. A task id can only be queued once at a time.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue_size = max_queue_size
+        self._queue: List[Tuple[int, int, float, str, Callable, tuple]] = []
+        self._queued: Set[str] = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running = 0
+        self._closed = False
+        self._started = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def submit(self, task_id: str, fn: Callable, *args, priority: int = 0, force: bool = False) -> bool:
+        with self._cond:
+            if self._closed or task_id in self._queued:
+                return False
+            if not force and len(self._queue) >= self.max_queue_size:
+                self._rejected += 1
+                metrics.POOL_REJECTED.inc(pool=self.name)
+                raise QueueFullError(f"{self.name} queue is full ({self.max_queue_size} tasks)")
+            heapq.heappush(self._queue, (priority, next(self._seq), time.monotonic(), task_id, fn, args))
+            self._queued.add(task_id)
+            self._cond.notify()
+            return True
+
+    def close(self) -> List[str]:
+        """Stops accepting tasks and drops the queued ones; running tasks carry on."""
+        with self._cond:
+            self._closed = True
+            dropped = [entry[3] for entry in self._queue]
+            self._queue.clear()
+            self._queued.clear()
+            return dropped
+    
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, enqueued, task_id, fn, args = heapq.heappop(self._queue)
+                self._queued.discard(task_id)
+                wait = time.monotonic() - enqueued
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._started += 1
+                self._running += 1
+            metrics.POOL_WAIT_SECONDS.observe(wait, pool=self.name)
+            try:
+                fn(task_id, *args)
+            except Exception as e:
+                print(f"Unhandled error in {self.name} worker for task {task_id}: {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            oldest_wait = 0.0
+            if self._queue:
+                oldest_wait = time.monotonic() - min(entry[2] for entry in self._queue)
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': len(self._queue),
+                'max_queue_size': self.max_queue_size,
+                'started': self._started,
+                'rejected': self._rejected,
+                'avg_wait_seconds': round(self._wait_total / self._started, 3) if self._started else 0.0,
+                'max_wait_seconds': round(self._wait_max, 3),
+                'oldest_wait_seconds': round(oldest_wait, 3)
+            }
+
+class TimerQueue:
+    """Runs callbacks at wall-clock times from a single thread."""
+
+    def __init__(self):
+        self._timers: List[Tuple[float, int, Callable, tuple]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def call_at(self, when: float, callback: Callable, *args) -> None:
+        with self._cond:
+            heapq.heappush(self._timers, (when, next(self._seq), callback, args))
+            self._cond.notify()
+
+    def call_later(self, delay: float, callback: Callable, *args) -> None:
+        self.call_at(time.time() + delay, callback, *args)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='timers', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if not self._timers:
+                        self._cond.wait()
+                        continue
+                    delay = self._timers[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                _, _, callback, args = heapq.heappop(self._timers)
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in timer callback {getattr(callback, '__name__', callback)}: {e}")
@@ -1,32 +1,104 @@
 import os
 import json
-import random
-import string
-from flask import Flask, request, jsonify, send_from_directory
+import hashlib
+import mimetypes
+import time
+from typing import List, Optional
+from flask import Flask, Response, request, jsonify, g
 
 from src.storage import Storage
-from src.auth import auth_manager, memory_manager, require_permission, AuthManager
-from src.models import Task, TaskStatus, TaskType
+from src.auth import auth_manager, memory_manager, key_registry, require_permission, AuthManager, RateLimiter
+from src.models import Task, TaskStatus, TaskType, generate_task_id
+from src.scheduler import QueueFullError
+from src.file_server import send_file
+from src.cache import TTLCache
+from src import info_index
+from src import compression
+from src import streaming
+from src import tiering
+from src.tiering import access_log
+from src.progress import progress_tracker, task_watcher
+from src import metrics
 from config import storage
+from config import task as task_config
+from config import cache as cache_config
+from config import compression as compression_config
+from config import acceleration as acceleration_config
 
 from src import yt_handler
 
 app = Flask(__name__)
 app.json.sort_keys = False
 
-def generate_task_id(length: int = 16) -> str:
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+# Rendered info.json query responses, keyed by file version and query
+info_responses = TTLCache(cache_config.INFO_RESPONSE_CACHE_SIZE, cache_config.INFO_RESPONSE_CACHE_TTL_SECONDS, 'info_response')
 
-def create_task(task_type: TaskType, data: dict) -> dict:
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response: Response) -> Response:
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_start, route=route, method=request.method)
+    return response
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """Adds a strong ETag to JSON responses and compresses them as negotiated.
+
+    Responses that set their own ETag or encoding (files, info.json queries)
+    are left alone. The body is compressed as it is sent rather than into
+    a second buffer.
+    """
+    if (response.direct_passthrough or response.is_streamed or response.mimetype not in compression_config.MIMETYPES
+            or 'ETag' in response.headers or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    conditional = request.method in ('GET', 'HEAD') and response.status_code == 200
+    encoding = None
+    if len(body) >= compression_config.MIN_BYTES:
+        response.vary.add('Accept-Encoding')
+        encoding = compression.negotiate(request.accept_encodings)
+    if conditional:
+        response.add_etag()
+        etag = response.get_etag()[0]
+        if encoding is not None:
+            etag = f'{etag}-{encoding}'
+            response.set_etag(etag)
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers={
+                name: value for name, value in response.headers.items() if name in ('ETag', 'Vary', 'Cache-Control')
+            })
+    if encoding is not None:
+        response.response = compression.compress_stream([body], encoding)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Length', None)
+    return response
+
+TASK_TYPES = {task_type.value: task_type for task_type in TaskType if task_type is not TaskType.EXPAND_PLAYLIST}
+MEDIA_TASK_TYPES = {TaskType.GET_VIDEO, TaskType.GET_AUDIO, TaskType.GET_LIVE_VIDEO, TaskType.GET_LIVE_AUDIO}
+
+def validate_task_data(data: dict) -> Optional[str]:
     if not data.get('url'):
-        return {'status': 'error', 'message': 'URL is required'}, 400
-    
-    task_id = generate_task_id()
-    api_key = request.headers.get('X-API-Key')
-    
-    task = Task(
-        task_id=task_id,
-        key_name=AuthManager.get_key_name(api_key),
+        return 'URL is required'
+    if data.get('stream') and (data.get('output_format') or '').lower() == 'gif':
+        return 'GIF output cannot be streamed'
+    if data.get('segmented') and (data.get('output_format') or '').lower() == 'gif':
+        return 'Segmented recordings are MPEG-TS and cannot be converted to GIF'
+    window = data.get('window')
+    if window is not None and (not isinstance(window, int) or isinstance(window, bool) or window < 0):
+        return 'window must be a non-negative number of seconds'
+    if data.get('acceleration') is not None and data['acceleration'] not in acceleration_config.PROFILES:
+        return f"Unknown acceleration profile, expected one of: {', '.join(acceleration_config.PROFILES)}"
+    return None
+
+def build_task(task_type: TaskType, data: dict, key_name: str) -> Task:
+    return Task(
+        task_id=generate_task_id(),
+        key_name=key_name,
         status=TaskStatus.WAITING,
         task_type=task_type,
         url=data['url'],
@@ -37,13 +109,32 @@ def create_task(task_type: TaskType, data: dict) -> dict:
         force_keyframes=data.get('force_keyframes', False),
         start=data.get('start', 0),
         duration=data.get('duration'),
-        output_format=data.get('output_format')
+        output_format=data.get('output_format'),
+        stream=bool(data.get('stream', False)),
+        segmented=bool(data.get('segmented', False)) and task_type in (TaskType.GET_LIVE_VIDEO, TaskType.GET_LIVE_AUDIO),
+        window=data.get('window'),
+        acceleration=data.get('acceleration')
     )
+
+def create_task(task_type: TaskType, data: dict) -> dict:
+    error = validate_task_data(data)
+    if error:
+        return {'status': 'error', 'message': error}, 400
     
-    tasks = Storage.load_tasks()
-    tasks[task_id] = task.to_dict()
-    Storage.save_tasks(tasks)
+    api_key = request.headers.get('X-API-Key')
+    task = build_task(task_type, data, AuthManager.get_key_name(api_key))
+    task_id = task.task_id
+    
+    task_data = task.to_dict()
+    Storage.add_task(task_id, task_data)
     
+    try:
+        yt_handler.downloader.submit_task(task_id, task_data)
+    except QueueFullError as e:
+        Storage.delete_task(task_id)
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    
+    RateLimiter.record(task.key_name)
     return jsonify({'status': 'waiting', 'task_id': task_id})
 
 @app.route('/get_video', methods=['POST'])
@@ -71,91 +162,282 @@ def get_live_video():
 def get_live_audio():
     return create_task(TaskType.GET_LIVE_AUDIO, request.json)
 
+@app.route('/batch', methods=['POST'])
+@require_permission()
+def batch():
+    data = request.json or {}
+    items = data.get('tasks')
+    if not isinstance(items, list) or not items:
+        return jsonify({'status': 'error', 'message': 'tasks must be a non-empty list'}), 400
+    if len(items) > task_config.BATCH_MAX_TASKS:
+        return jsonify({'status': 'error', 'message': f'At most {task_config.BATCH_MAX_TASKS} tasks per batch'}), 400
+    
+    api_key = request.headers.get('X-API-Key')
+    key_name = AuthManager.get_key_name(api_key)
+    permissions = key_registry.permissions(key_name)
+    allowance = RateLimiter.remaining(key_name)
+    quota_ok, quota_error = memory_manager.check_quota(api_key)
+    rate_error = f'Rate limit exceeded. Max {task_config.REQUEST_LIMIT} per {task_config.CLEANUP_TIME_MINUTES} min'
+    
+    results = []
+    created = []
+    new_tasks = {}
+    expansions = set()
+    for index, item in enumerate(items):
+        result = {'index': index}
+        results.append(result)
+        
+        task_type = TASK_TYPES.get(item.get('type')) if isinstance(item, dict) else None
+        if task_type is None:
+            error = 'Unknown task type'
+        elif task_type.value not in permissions:
+            error = 'Insufficient permissions'
+        elif task_type in MEDIA_TASK_TYPES and not quota_ok:
+            error = quota_error
+        else:
+            error = validate_task_data(item)
+        if error:
+            result.update(status='error', message=error)
+            continue
+        
+        if allowance <= 0:
+            metrics.REJECTIONS.inc(reason='rate_limit')
+            result.update(status='error', message=rate_error)
+            continue
+        
+        task = build_task(task_type, item, key_name)
+        if item.get('expand_playlist', data.get('expand_playlists', False)):
+            # Extraction can take long; a worker creates the entries' tasks, within the rate limit then
+            task = Task(
+                task_id=generate_task_id(),
+                key_name=key_name,
+                status=TaskStatus.WAITING,
+                task_type=TaskType.EXPAND_PLAYLIST,
+                url=item['url'],
+                entry_task=task.to_dict()
+            )
+            expansions.add(task.task_id)
+        else:
+            allowance -= 1
+        new_tasks[task.task_id] = task.to_dict()
+        result.update(status='waiting', task_id=task.task_id)
+        created.append(result)
+    
+    if new_tasks:
+        Storage.add_tasks(new_tasks)
+    
+    submitted = 0
+    for entry in created:
+        task_id = entry['task_id']
+        try:
+            yt_handler.downloader.submit_task(task_id, new_tasks[task_id])
+            if task_id not in expansions:
+                submitted += 1
+        except QueueFullError as e:
+            Storage.delete_task(task_id)
+            del entry['task_id']
+            entry.update(status='error', message=str(e))
+    
+    if submitted:
+        RateLimiter.record(key_name, submitted)
+    return jsonify({'results': results})
+
+def _with_progress(task_id: str, task: dict) -> dict:
+    progress = progress_tracker.get(task_id)
+    if progress is not None and task['status'] == TaskStatus.PROCESSING.value:
+        task['progress'] = progress
+    return task
+
+def get_task_status(task_id: str) -> Optional[dict]:
+    task = Storage.get_task(task_id)
+    if task is None:
+        return None
+    return _with_progress(task_id, task)
+
+@app.route('/status/batch', methods=['POST'])
+def status_batch():
+    task_ids = (request.json or {}).get('task_ids')
+    if not isinstance(task_ids, list) or not all(isinstance(t, str) for t in task_ids):
+        return jsonify({'status': 'error', 'message': 'task_ids must be a list of task IDs'}), 400
+    if len(task_ids) > task_config.BATCH_MAX_TASKS:
+        return jsonify({'status': 'error', 'message': f'At most {task_config.BATCH_MAX_TASKS} task IDs per request'}), 400
+    
+    tasks = Storage.get_tasks(task_ids)
+    return jsonify({
+        'tasks': {
+            task_id: _with_progress(task_id, tasks[task_id]) if task_id in tasks
+            else {'status': 'error', 'message': 'Task not found'}
+            for task_id in task_ids
+        }
+    })
+
 @app.route('/status/<task_id>', methods=['GET'])
 def status(task_id: str):
-    tasks = Storage.load_tasks()
-    if task_id not in tasks:
+    task = get_task_status(task_id)
+    if task is None:
+        return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    return jsonify(task)
+
+@app.route('/status/<task_id>/stream', methods=['GET'])
+def status_stream(task_id: str):
+    if Storage.get_task(task_id) is None:
+        return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    
+    def events():
+        version = progress_tracker.version(task_id)
+        task_watcher.watch(task_id)
+        try:
+            last = None
+            last_sent = time.monotonic()
+            while True:
+                task = task_watcher.get(task_id)
+                if task is None:
+                    yield 'event: error\ndata: {"message": "Task not found"}\n\n'
+                    return
+                task = _with_progress(task_id, task)
+                payload = json.dumps(task)
+                if payload != last:
+                    last = payload
+                    last_sent = time.monotonic()
+                    yield f'event: status\ndata: {payload}\n\n'
+                elif time.monotonic() - last_sent >= task_config.STATUS_STREAM_HEARTBEAT_SECONDS:
+                    last_sent = time.monotonic()
+                    yield ': keepalive\n\n'
+                if task['status'] in [TaskStatus.COMPLETED.value, TaskStatus.ERROR.value]:
+                    return
+                # Woken by local progress and by the watcher when storage changes
+                timeout = task_config.STATUS_STREAM_HEARTBEAT_SECONDS - (time.monotonic() - last_sent)
+                version, _ = progress_tracker.wait(task_id, version, max(timeout, 0))
+        finally:
+            task_watcher.unwatch(task_id)
+    
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/stream/<task_id>', methods=['GET'])
+def stream(task_id: str):
+    task = Storage.get_task(task_id)
+    if task is None:
         return jsonify({'status': 'error', 'message': 'Task not found'}), 404
-    return jsonify(tasks[task_id])
+    if task['status'] == TaskStatus.ERROR.value:
+        return jsonify({'status': 'error', 'message': task.get('error')}), 409
+    
+    if task['status'] == TaskStatus.COMPLETED.value and task.get('file'):
+        filename = task['file'][len('/files/'):]
+        file_path = tiering.locate(filename)
+        if file_path is None:
+            return jsonify({"error": "File not found"}), 404
+        access_log.touch(task_id)
+        return handle_regular_file(file_path, filename)
+    
+    if task.get('segmented'):
+        response = Response(streaming.follow_segments(task_id, os.path.join(storage.DOWNLOAD_DIR, task_id)),
+                            mimetype='video/mp2t')
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    
+    path = streaming.wait_for_file(task_id)
+    if path is None:
+        return jsonify({'status': 'error', 'message': 'Nothing to stream yet'}), 404
+    
+    name = streaming.output_name(path)
+    response = Response(streaming.follow(task_id, path),
+                        mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/files/<path:filename>', methods=['GET'])
 def get_file(filename: str):
     file_path = os.path.abspath(os.path.join(storage.DOWNLOAD_DIR, filename))
     
-    if not os.path.isfile(file_path):
-        return jsonify({"error": "File not found"}), 404
-    
     if not file_path.startswith(os.path.abspath(storage.DOWNLOAD_DIR)):
         return jsonify({"error": "Access denied"}), 403
     
+    # Completed files may have moved to the cold tier
+    file_path = tiering.locate(filename)
+    if file_path is None:
+        return jsonify({"error": "File not found"}), 404
+    
+    access_log.touch(filename.split('/', 1)[0])
     if filename.endswith('info.json'):
         return handle_info_file(file_path)
     
-    return handle_regular_file(filename)
+    return handle_regular_file(file_path, filename)
+
+def _load_info_response(file_path: str, fields: List[str]) -> dict:
+    result = info_index.query(file_path, fields)
+    body = app.json.dumps(result or {"error": "No matching parameters"}, separators=(',', ':')).encode()
+    return {
+        'status': 200 if result is not None else 404,
+        'etag': hashlib.sha1(body).hexdigest(),
+        'body': body,
+        # Compressed bodies by encoding, filled in as clients ask for them
+        'encoded': {}
+    }
 
 def handle_info_file(file_path: str):
-    with open(file_path, 'r') as f:
-        data = json.load(f)
+    fields = list(request.args)
+    if not fields:
+        return send_file(file_path, 'info.json')
+
+    stat = os.stat(file_path)
+    cached = info_responses.get_or_load(
+        (file_path, stat.st_size, stat.st_mtime_ns, tuple(fields)),
+        lambda: _load_info_response(file_path, fields)
+    )
+
+    body, etag = cached['body'], cached['etag']
+    headers = {'Cache-Control': 'public, max-age=3600', 'Vary': 'Accept-Encoding'}
+    encoding = compression.negotiate(request.accept_encodings) if len(body) >= compression_config.MIN_BYTES else None
+    if encoding is not None:
+        etag = f'{etag}-{encoding}'
+        headers['Content-Encoding'] = encoding
+    headers['ETag'] = f'"{etag}"'
+
+    if cached['status'] == 200 and request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    if encoding is not None:
+        if encoding not in cached['encoded']:
+            cached['encoded'][encoding] = compression.compress(cached['body'], encoding)
+        body = cached['encoded'][encoding]
+    return Response(body, status=cached['status'], headers=headers, mimetype='application/json')
+
+def handle_regular_file(file_path: str, filename: str):
+    raw = request.args.get('raw', 'false').lower() == 'true'
+    return send_file(file_path, filename, raw)
+
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel(task_id: str):
+    api_key = request.headers.get('X-API-Key')
+    if not api_key:
+        return jsonify({'error': 'No API key provided'}), 401
     
-    params = request.args
-    if not params: 
-        return jsonify(data)
+    key_name = AuthManager.get_key_name(api_key)
+    if not key_name:
+        return jsonify({'error': 'Invalid API key'}), 401
     
-    result = {}
-    if 'qualities' in params:
-        result['qualities'] = extract_qualities(data)
-    for key in params:
-        if key != 'qualities' and key in data:
-            result[key] = data[key]
+    task = Storage.get_task(task_id)
+    if task is None:
+        return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+    if task.get('key_name') != key_name:
+        return jsonify({'error': 'Insufficient permissions'}), 403
     
-    if result:
-        return jsonify(result)
-    return jsonify({"error": "No matching parameters"}), 404
+    if not yt_handler.downloader.cancel_task(task_id):
+        return jsonify({'status': 'error', 'message': 'Task has already finished'}), 409
+    return jsonify({'status': 'cancelling', 'task_id': task_id}), 200
 
-def extract_qualities(data: dict) -> dict:
-    qualities = {"audio": {}, "video": {}}
-    
-    for fmt in data.get('formats', []):
-        if fmt.get('format_note') in ['unknown', 'storyboard']:
-            continue
-        
-        # Audio format
-        if fmt.get('acodec') != 'none' and fmt.get('vcodec') == 'none' and fmt.get('abr'):
-            qualities["audio"][fmt['format_id']] = {
-                "abr": int(fmt['abr']),
-                "acodec": fmt['acodec'],
-                "audio_channels": int(fmt.get('audio_channels', 0)),
-                "language": fmt['language'],
-                "filesize": int(fmt.get('filesize') or fmt.get('filesize_approx') or 0)
-            }
-        
-        # Video format
-        elif fmt.get('vcodec') != 'none' and fmt.get('height') and fmt.get('fps'):
-            qualities["video"][fmt['format_id']] = {
-                "height": int(fmt['height']),
-                "width": int(fmt['width']),
-                "fps": int(fmt['fps']),
-                "vcodec": fmt['vcodec'],
-                "format_note": fmt.get('format_note', 'unknown'),
-                "dynamic_range": fmt.get('dynamic_range', 'unknown'),
-                "filesize": int(fmt.get('filesize') or fmt.get('filesize_approx') or 0)
-            }
-    
-    qualities["video"] = dict(sorted(qualities["video"].items(), 
-                                   key=lambda x: (x[1]['height'], x[1]['fps'])))
-    qualities["audio"] = dict(sorted(qualities["audio"].items(), 
-                                   key=lambda x: x[1]['abr']))
-    
-    return qualities
-
-def handle_regular_file(filename: str):
-    raw = request.args.get('raw', 'false').lower() == 'true'
-    response = send_from_directory(storage.DOWNLOAD_DIR, filename, as_attachment=raw)
-    response.headers['Accept-Ranges'] = 'bytes'
-    response.headers['Cache-Control'] = 'public, max-age=3600'
-    if raw:
-        response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
-    return response
+@app.route('/pools', methods=['GET'])
+@require_permission('get_stats')
+def pools():
+    return jsonify(yt_handler.downloader.pool_stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/create_key', methods=['POST'])
 @require_permission('create_key')
@@ -166,8 +448,11 @@ def create_key():
     
     if not name or not permissions:
         return jsonify({'error': 'Name and permissions required'}), 400
+    acceleration = data.get('acceleration')
+    if acceleration is not None and acceleration not in acceleration_config.PROFILES:
+        return jsonify({'error': f"Unknown acceleration profile, expected one of: {', '.join(acceleration_config.PROFILES)}"}), 400
     
-    key = auth_manager.create_key(name, permissions)
+    key = auth_manager.create_key(name, permissions, acceleration=acceleration)
     return jsonify({'message': 'API key created', 'name': name, 'key': key}), 201
 
 @app.route('/delete_key/<name>', methods=['DELETE'])
@@ -180,15 +465,20 @@ def delete_key(name: str):
 @app.route('/get_key/<name>', methods=['GET'])
 @require_permission('get_key')
 def get_key(name: str):
-    keys = Storage.load_keys()
-    if name in keys:
-        return jsonify({'name': name, 'key': keys[name]['key']}), 200
+    key_info = Storage.get_key(name)
+    if key_info is not None:
+        return jsonify({'name': name, 'key': key_info['key']}), 200
     return jsonify({'error': 'Key not found'}), 404
 
 @app.route('/get_keys', methods=['GET'])
 @require_permission('get_keys')
 def get_keys():
-    return jsonify(Storage.load_keys()), 200
+    key_registry.flush()
+    keys = Storage.load_keys()
+    for name, key_info in keys.items():
+        key_info['memory_usage'] = memory_manager.get_usage(name)
+        key_info['disk_usage'] = memory_manager.get_disk_usage(name)
+    return jsonify(keys), 200
 
 @app.route('/check_permissions', methods=['POST'])
 def check_permissions():
@@ -196,16 +486,14 @@ def check_permissions():
     if not api_key:
         return jsonify({'error': 'No API key provided'}), 401
     
-    keys = Storage.load_keys()
-    key_name = AuthManager.get_key_name(api_key)
+    key_name, _ = key_registry.lookup(api_key)
     
-    if not key_name or key_name not in keys:
+    if not key_name:
         return jsonify({'error': 'Invalid API key'}), 401
     
     required = request.json.get('permissions', [])
-    current = keys[key_name]['permissions']
     
-    if set(required).issubset(current):
+    if key_registry.permissions(key_name).issuperset(required):
         return jsonify({'message': 'Permissions granted'}), 200
     return jsonify({'message': 'Insufficient permissions'}), 403
 
@@ -1,33 +1,1057 @@
 import json
 import os
-from typing import Dict, Any
+import sys
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Dict, Any, List, Optional, Tuple, Union, Iterable
+from src.models import TaskStatus
+from src import metrics
 from config import storage
 
-class Storage:
+Statuses = Union[str, Iterable[str]]
+# (timestamp, amount, task_id) of a rate limit or memory quota window
+UsageEvent = Tuple[float, int, Optional[str]]
+
+def _as_tuple(statuses: Statuses) -> Tuple[str, ...]:
+    if isinstance(statuses, str):
+        return (statuses,)
+    return tuple(statuses)
+
+def _loads(data: str) -> Dict[str, Any]:
+    metrics.STORAGE_BYTES.inc(len(data), direction='read')
+    return json.loads(data)
+
+def _dumps(data: Dict[str, Any], **kwargs) -> str:
+    encoded = json.dumps(data, **kwargs)
+    metrics.STORAGE_BYTES.inc(len(encoded), direction='write')
+    return encoded
+
+def _expired_lease_update(task: Dict[str, Any], max_attempts: int, completed_time: str) -> Dict[str, Any]:
+    """Puts a task whose worker stopped renewing its lease back in the queue."""
+    task.update(lease_owner=None, lease_expires=None)
+    if task.get('cancel_requested'):
+        task.update(status=TaskStatus.ERROR.value, error='Task was cancelled', completed_time=completed_time)
+    elif task.get('attempts', 0) >= max_attempts:
+        task.update(status=TaskStatus.ERROR.value, error='Task was interrupted', completed_time=completed_time)
+    else:
+        task.update(status=TaskStatus.WAITING.value)
+    return task
+
+def _fair_share(wanted: int, limit: int, in_use: int, active: int) -> int:
+    """Connections for a download when `active` others hold `in_use` of `limit`.
+
+    At most what is left and an equal share among the running downloads;
+    even alone a download gets at most half, leaving room for the next ones.
+    Every download gets at least one.
+    """
+    return max(min(wanted, limit // max(active + 1, 2), limit - in_use), 1)
+
+def _apply_access(task: Dict[str, Any], last_access: str, hits: int) -> Dict[str, Any]:
+    task['hits'] = task.get('hits', 0) + hits
+    task['last_access'] = max(task.get('last_access') or '', last_access)
+    return task
+
+class StorageBackend:
+    def load_tasks(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def save_tasks(self, tasks: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_tasks(self, task_ids: Iterable[str]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def add_task(self, task_id: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def add_tasks(self, tasks: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def update_task(self, task_id: str, **fields) -> bool:
+        raise NotImplementedError
+
+    def transition_task(self, task_id: str, from_status: Statuses, to_status: str, **fields) -> bool:
+        raise NotImplementedError
+
+    def delete_task(self, task_id: str) -> bool:
+        raise NotImplementedError
+
+    def find_tasks(self, status: Optional[Statuses] = None, key_name: Optional[str] = None,
+                   completed_before: Optional[str] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def count_tasks(self, key_name: Optional[str] = None, status: Optional[Statuses] = None,
+                    task_types: Optional[Iterable[str]] = None) -> int:
+        raise NotImplementedError
+
+    def find_waiting(self, task_types: Iterable[str], limit: int) -> Dict[str, Any]:
+        """Returns up to `limit` waiting tasks of the given types, oldest first."""
+        raise NotImplementedError
+
+    def renew_lease(self, task_id: str, owner: str, expires: float) -> Optional[Dict[str, Any]]:
+        """Extends a lease held by `owner`; returns the task, or None if the lease was lost."""
+        raise NotImplementedError
+
+    def expire_leases(self, now: float, max_attempts: int, completed_time: str) -> Dict[str, Any]:
+        """Re-queues processing tasks whose lease ran out, or fails them after `max_attempts`."""
+        raise NotImplementedError
+
+    def grant_connections(self, task_id: str, wanted: int, limit: int) -> int:
+        """Grants a running task its `_fair_share` of `limit` connections and records it on the task.
+
+        Grants count while their task is processing, so those of a stopped
+        worker lapse when its lease expires.
+        """
+        raise NotImplementedError
+
+    def record_access(self, accesses: Dict[str, Tuple[str, int]]) -> None:
+        """Adds `hits` to tasks and raises their `last_access`; unknown tasks are skipped."""
+        raise NotImplementedError
+
+    def load_keys(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def save_keys(self, keys: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def get_key(self, name: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_key(self, name: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def update_key(self, name: str, **fields) -> bool:
+        raise NotImplementedError
+
+    def delete_key(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def find_key(self, api_key: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def key_generation(self) -> int:
+        """A number that changes whenever a key is saved or deleted, cheap enough to check per request."""
+        raise NotImplementedError
+
+    def add_usage(self, key_name: str, kind: str, amount: int, timestamp: float,
+                  task_id: Optional[str] = None) -> None:
+        """Records an event in a key's `kind` window ('requests' or 'memory')."""
+        raise NotImplementedError
+
+    def usage_entries(self, key_name: str, kind: str, since: float) -> List[UsageEvent]:
+        """Events of a key's `kind` window newer than `since`, oldest first."""
+        raise NotImplementedError
+
+    def usage_total(self, key_name: str, kind: str, since: float) -> int:
+        return sum(amount for _, amount, _ in self.usage_entries(key_name, kind, since))
+
+    def reserve_usage(self, key_name: str, task_id: str, size: int, timestamp: float, since: float,
+                      quota: Optional[int] = None, kind: str = 'memory') -> Tuple[bool, int]:
+        """Sets the `kind` event of `task_id` newer than `since` to `size`, adding one if there is none.
+
+        Fails without a change if growing it takes the window past `quota`.
+        Returns (reserved, window total) with the total as it was before.
+        """
+        raise NotImplementedError
+
+    def release_usage(self, kind: str, task_id: str) -> None:
+        """Drops the `kind` events of a task, whichever key they were recorded for."""
+        raise NotImplementedError
+
+    def forget_usage(self, key_name: str) -> None:
+        raise NotImplementedError
+
+    def prune_usage(self, kind: str, before: float) -> None:
+        """Drops `kind` events that are no newer than `before`, and those of keys that no longer exist."""
+        raise NotImplementedError
+
+class JsonStorageBackend(StorageBackend):
+    """Legacy backend: every operation reads and rewrites the whole file."""
+
+    def __init__(self, tasks_file: str, keys_file: str, usage_file: str):
+        self.tasks_file = tasks_file
+        self.keys_file = keys_file
+        self.usage_file = usage_file
+        self._lock = threading.RLock()
+
     @staticmethod
     def _load_json(file_path: str) -> Dict[str, Any]:
         if not os.path.exists(file_path):
             return {}
         with open(file_path, 'r') as f:
-            return json.load(f)
-    
+            return _loads(f.read())
+
     @staticmethod
     def _save_json(file_path: str, data: Dict[str, Any]) -> None:
         with open(file_path, 'w') as f:
-            json.dump(data, f, indent=4)
-    
+            f.write(_dumps(data, indent=4))
+
+    def load_tasks(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._load_json(self.tasks_file)
+
+    def save_tasks(self, tasks: Dict[str, Any]) -> None:
+        with self._lock:
+            self._save_json(self.tasks_file, tasks)
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return self.load_tasks().get(task_id)
+
+    def get_tasks(self, task_ids: Iterable[str]) -> Dict[str, Any]:
+        tasks = self.load_tasks()
+        return {task_id: tasks[task_id] for task_id in task_ids if task_id in tasks}
+
+    def add_task(self, task_id: str, data: Dict[str, Any]) -> None:
+        self.add_tasks({task_id: data})
+
+    def add_tasks(self, tasks: Dict[str, Any]) -> None:
+        with self._lock:
+            stored = self.load_tasks()
+            stored.update(tasks)
+            self.save_tasks(stored)
+
+    def update_task(self, task_id: str, **fields) -> bool:
+        with self._lock:
+            tasks = self.load_tasks()
+            if task_id not in tasks:
+                return False
+            tasks[task_id].update(fields)
+            self.save_tasks(tasks)
+            return True
+
+    def transition_task(self, task_id: str, from_status: Statuses, to_status: str, **fields) -> bool:
+        with self._lock:
+            tasks = self.load_tasks()
+            task = tasks.get(task_id)
+            if task is None or task['status'] not in _as_tuple(from_status):
+                return False
+            task.update(fields, status=to_status)
+            self.save_tasks(tasks)
+            return True
+
+    def delete_task(self, task_id: str) -> bool:
+        with self._lock:
+            tasks = self.load_tasks()
+            if task_id not in tasks:
+                return False
+            del tasks[task_id]
+            self.save_tasks(tasks)
+            return True
+
+    def find_tasks(self, status: Optional[Statuses] = None, key_name: Optional[str] = None,
+                   completed_before: Optional[str] = None) -> Dict[str, Any]:
+        statuses = _as_tuple(status) if status is not None else None
+        return {
+            task_id: task for task_id, task in self.load_tasks().items()
+            if (statuses is None or task['status'] in statuses)
+            and (key_name is None or task.get('key_name') == key_name)
+            and (completed_before is None or
+                 (task.get('completed_time') and task['completed_time'] < completed_before))
+        }
+
+    def count_tasks(self, key_name: Optional[str] = None, status: Optional[Statuses] = None,
+                    task_types: Optional[Iterable[str]] = None) -> int:
+        task_types = set(task_types) if task_types is not None else None
+        return sum(
+            1 for task in self.find_tasks(status=status, key_name=key_name).values()
+            if task_types is None or task.get('task_type') in task_types
+        )
+
+    def find_waiting(self, task_types: Iterable[str], limit: int) -> Dict[str, Any]:
+        task_types = set(task_types)
+        waiting = {}
+        for task_id, task in self.load_tasks().items():
+            if len(waiting) >= limit:
+                break
+            if task['status'] == TaskStatus.WAITING.value and task['task_type'] in task_types:
+                waiting[task_id] = task
+        return waiting
+
+    def renew_lease(self, task_id: str, owner: str, expires: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            tasks = self.load_tasks()
+            task = tasks.get(task_id)
+            if task is None or task['status'] != TaskStatus.PROCESSING.value or task.get('lease_owner') != owner:
+                return None
+            task['lease_expires'] = expires
+            self.save_tasks(tasks)
+            return task
+
+    def expire_leases(self, now: float, max_attempts: int, completed_time: str) -> Dict[str, Any]:
+        with self._lock:
+            tasks = self.load_tasks()
+            expired = {
+                task_id: _expired_lease_update(task, max_attempts, completed_time)
+                for task_id, task in tasks.items()
+                if task['status'] == TaskStatus.PROCESSING.value and (task.get('lease_expires') or 0) < now
+            }
+            if expired:
+                self.save_tasks(tasks)
+            return expired
+
+    def grant_connections(self, task_id: str, wanted: int, limit: int) -> int:
+        with self._lock:
+            tasks = self.load_tasks()
+            grants = [
+                task['granted_connections'] for other_id, task in tasks.items()
+                if other_id != task_id and task['status'] == TaskStatus.PROCESSING.value
+                and task.get('granted_connections')
+            ]
+            granted = _fair_share(wanted, limit, sum(grants), len(grants))
+            if task_id in tasks:
+                tasks[task_id]['granted_connections'] = granted
+                self.save_tasks(tasks)
+            return granted
+
+    def record_access(self, accesses: Dict[str, Tuple[str, int]]) -> None:
+        with self._lock:
+            tasks = self.load_tasks()
+            changed = False
+            for task_id, (last_access, hits) in accesses.items():
+                task = tasks.get(task_id)
+                if task is not None:
+                    _apply_access(task, last_access, hits)
+                    changed = True
+            if changed:
+                self.save_tasks(tasks)
+
+    def load_keys(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._load_json(self.keys_file)
+
+    def save_keys(self, keys: Dict[str, Any]) -> None:
+        with self._lock:
+            self._save_json(self.keys_file, keys)
+
+    def get_key(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.load_keys().get(name)
+
+    def save_key(self, name: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            keys = self.load_keys()
+            keys[name] = data
+            self.save_keys(keys)
+
+    def update_key(self, name: str, **fields) -> bool:
+        with self._lock:
+            keys = self.load_keys()
+            if name not in keys:
+                return False
+            keys[name].update(fields)
+            self.save_keys(keys)
+            return True
+
+    def delete_key(self, name: str) -> bool:
+        with self._lock:
+            keys = self.load_keys()
+            if name not in keys:
+                return False
+            del keys[name]
+            self.save_keys(keys)
+            return True
+
+    def find_key(self, api_key: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        for name, key_info in self.load_keys().items():
+            if key_info['key'] == api_key:
+                return name, key_info
+        return None, None
+
+    def key_generation(self) -> int:
+        # Every write replaces the file
+        try:
+            return os.stat(self.keys_file).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    @classmethod
+    def _read_usage(cls, usage_file: str, load_keys: Callable[[], Dict[str, Any]]) -> Dict[str, Dict[str, list]]:
+        """kind -> key name -> [timestamp, amount, task_id] events.
+
+        Without a usage file yet, the memory usage recorded on the keys is
+        taken over; only then are the keys loaded.
+        """
+        if not os.path.exists(usage_file):
+            keys = load_keys()
+            return {'memory': {
+                name: sorted(
+                    [datetime.fromisoformat(usage['timestamp']).timestamp(), usage['size'], usage.get('task_id')]
+                    for usage in key_info.get('memory_usage', [])
+                )
+                for name, key_info in keys.items() if key_info.get('memory_usage')
+            }}
+        usage = cls._load_json(usage_file)
+        # Request events were written without a task
+        return {
+            kind: {name: [event + [None] * (3 - len(event)) for event in events] for name, events in by_key.items()}
+            for kind, by_key in usage.items()
+        }
+
+    def _load_usage(self) -> Dict[str, Dict[str, list]]:
+        return self._read_usage(self.usage_file, self.load_keys)
+
+    def add_usage(self, key_name: str, kind: str, amount: int, timestamp: float,
+                  task_id: Optional[str] = None) -> None:
+        with self._lock:
+            usage = self._load_usage()
+            usage.setdefault(kind, {}).setdefault(key_name, []).append([timestamp, amount, task_id])
+            self._save_json(self.usage_file, usage)
+
+    def usage_entries(self, key_name: str, kind: str, since: float) -> List[UsageEvent]:
+        with self._lock:
+            events = self._load_usage().get(kind, {}).get(key_name, [])
+        return [tuple(event) for event in events if event[0] > since]
+
+    def reserve_usage(self, key_name: str, task_id: str, size: int, timestamp: float, since: float,
+                      quota: Optional[int] = None, kind: str = 'memory') -> Tuple[bool, int]:
+        with self._lock:
+            usage = self._load_usage()
+            events = usage.setdefault(kind, {}).setdefault(key_name, [])
+            current = sum(event[1] for event in events if event[0] > since)
+            event = next((event for event in reversed(events) if event[0] > since and event[2] == task_id), None)
+            growth = size - event[1] if event is not None else size
+            if quota is not None and growth > 0 and current + growth > quota:
+                return False, current
+            if event is not None:
+                event[1] = size
+            elif size > 0:
+                events.append([timestamp, size, task_id])
+            self._save_json(self.usage_file, usage)
+            return True, current
+
+    def release_usage(self, kind: str, task_id: str) -> None:
+        with self._lock:
+            usage = self._load_usage()
+            by_key = usage.get(kind, {})
+            for name, events in list(by_key.items()):
+                events[:] = [event for event in events if event[2] != task_id]
+                if not events:
+                    del by_key[name]
+            self._save_json(self.usage_file, usage)
+
+    def forget_usage(self, key_name: str) -> None:
+        with self._lock:
+            usage = self._load_usage()
+            for by_key in usage.values():
+                by_key.pop(key_name, None)
+            self._save_json(self.usage_file, usage)
+
+    def prune_usage(self, kind: str, before: float) -> None:
+        with self._lock:
+            usage = self._load_usage()
+            keys = self.load_keys()
+            by_key = usage.get(kind, {})
+            for name, events in list(by_key.items()):
+                events[:] = [event for event in events if event[0] > before]
+                if not events or name not in keys:
+                    del by_key[name]
+            self._save_json(self.usage_file, usage)
+
+class SQLiteStorageBackend(StorageBackend):
+    """WAL-mode SQLite backend with per-row reads and writes.
+
+    Each task and key is stored as a JSON document; the fields used for
+    lookups are mirrored into indexed columns.
+    """
+
+    # Stays below SQLITE_MAX_VARIABLE_NUMBER on old SQLite builds
+    MAX_QUERY_PARAMS = 500
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            key_name TEXT,
+            status TEXT NOT NULL,
+            completed_time TEXT,
+            task_type TEXT,
+            lease_expires REAL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+        CREATE INDEX IF NOT EXISTS idx_tasks_key_name ON tasks (key_name);
+        CREATE INDEX IF NOT EXISTS idx_tasks_completed_time ON tasks (completed_time);
+        CREATE TABLE IF NOT EXISTS api_keys (
+            name TEXT PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS usage (
+            key_name TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            amount INTEGER NOT NULL,
+            task_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_usage_window ON usage (key_name, kind, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_usage_kind ON usage (kind, timestamp);
+    """
+
+    def __init__(self, database_file: str, tasks_file: Optional[str] = None,
+                 keys_file: Optional[str] = None, usage_file: Optional[str] = None):
+        self.database_file = database_file
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+        self._upgrade_schema()
+        self._migrate_from_json(tasks_file, keys_file)
+        self._migrate_usage(usage_file)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.database_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.database_file, timeout=storage.SQLITE_BUSY_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _upgrade_schema(self) -> None:
+        with self._transaction() as conn:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(tasks)')}
+            if 'task_type' not in columns:
+                conn.execute('ALTER TABLE tasks ADD COLUMN task_type TEXT')
+                conn.execute("UPDATE tasks SET task_type = json_extract(data, '$.task_type')")
+            if 'lease_expires' not in columns:
+                conn.execute('ALTER TABLE tasks ADD COLUMN lease_expires REAL')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_queue ON tasks (status, task_type)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_lease ON tasks (status, lease_expires)')
+
+    def _migrate_from_json(self, tasks_file: Optional[str], keys_file: Optional[str]) -> None:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE name = 'json_migrated'").fetchone():
+                return
+            if tasks_file:
+                for task_id, task in JsonStorageBackend._load_json(tasks_file).items():
+                    self._write_task(conn, task_id, task, replace=False)
+            if keys_file:
+                for name, key_info in JsonStorageBackend._load_json(keys_file).items():
+                    conn.execute(
+                        'INSERT OR IGNORE INTO api_keys (name, key, data) VALUES (?, ?, ?)',
+                        (name, key_info['key'], _dumps(key_info))
+                    )
+            conn.execute("INSERT INTO meta (name, value) VALUES ('json_migrated', '1')")
+
+    def _migrate_usage(self, usage_file: Optional[str]) -> None:
+        """Takes over the windows from the usage file, which held them before they were shared."""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE name = 'usage_migrated'").fetchone():
+                return
+            if usage_file:
+                keys = {name: _loads(data) for name, data in conn.execute('SELECT name, data FROM api_keys')}
+                for kind, by_key in JsonStorageBackend._read_usage(usage_file, lambda: keys).items():
+                    conn.executemany(
+                        'INSERT INTO usage (key_name, kind, timestamp, amount, task_id) VALUES (?, ?, ?, ?, ?)',
+                        [(name, kind, *event) for name, events in by_key.items() for event in events]
+                    )
+            conn.execute("INSERT INTO meta (name, value) VALUES ('usage_migrated', '1')")
+
+    @staticmethod
+    def _write_task(conn: sqlite3.Connection, task_id: str, data: Dict[str, Any],
+                    replace: bool = True) -> None:
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        conn.execute(
+            f'{verb} INTO tasks (task_id, key_name, status, completed_time, task_type, lease_expires, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (task_id, data.get('key_name'), data['status'], data.get('completed_time'),
+             data.get('task_type'), data.get('lease_expires'), _dumps(data))
+        )
+
+    def load_tasks(self) -> Dict[str, Any]:
+        rows = self._connect().execute('SELECT task_id, data FROM tasks')
+        return {task_id: _loads(data) for task_id, data in rows}
+
+    def save_tasks(self, tasks: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM tasks')
+            for task_id, task in tasks.items():
+                self._write_task(conn, task_id, task)
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            'SELECT data FROM tasks WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        return _loads(row[0]) if row else None
+
+    def get_tasks(self, task_ids: Iterable[str]) -> Dict[str, Any]:
+        task_ids = list(dict.fromkeys(task_ids))
+        conn = self._connect()
+        result = {}
+        for i in range(0, len(task_ids), self.MAX_QUERY_PARAMS):
+            chunk = task_ids[i:i + self.MAX_QUERY_PARAMS]
+            rows = conn.execute(
+                f'SELECT task_id, data FROM tasks WHERE task_id IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            result.update((task_id, _loads(data)) for task_id, data in rows)
+        return result
+
+    def add_task(self, task_id: str, data: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            self._write_task(conn, task_id, data)
+
+    def add_tasks(self, tasks: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            for task_id, data in tasks.items():
+                self._write_task(conn, task_id, data)
+
+    def update_task(self, task_id: str, **fields) -> bool:
+        with self._transaction() as conn:
+            row = conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            if not row:
+                return False
+            task = _loads(row[0])
+            task.update(fields)
+            self._write_task(conn, task_id, task)
+            return True
+
+    def transition_task(self, task_id: str, from_status: Statuses, to_status: str, **fields) -> bool:
+        statuses = _as_tuple(from_status)
+        with self._transaction() as conn:
+            row = conn.execute(
+                f'SELECT data FROM tasks WHERE task_id = ? AND status IN ({",".join("?" * len(statuses))})',
+                (task_id, *statuses)
+            ).fetchone()
+            if not row:
+                return False
+            task = _loads(row[0])
+            task.update(fields, status=to_status)
+            self._write_task(conn, task_id, task)
+            return True
+
+    def delete_task(self, task_id: str) -> bool:
+        with self._transaction() as conn:
+            return conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,)).rowcount > 0
+
+    @staticmethod
+    def _where(status: Optional[Statuses] = None, key_name: Optional[str] = None,
+               completed_before: Optional[str] = None,
+               task_types: Optional[Iterable[str]] = None) -> Tuple[str, list]:
+        clauses, params = [], []
+        if status is not None:
+            statuses = _as_tuple(status)
+            clauses.append(f'status IN ({",".join("?" * len(statuses))})')
+            params.extend(statuses)
+        if task_types is not None:
+            task_types = tuple(task_types)
+            clauses.append(f'task_type IN ({",".join("?" * len(task_types))})')
+            params.extend(task_types)
+        if key_name is not None:
+            clauses.append('key_name = ?')
+            params.append(key_name)
+        if completed_before is not None:
+            clauses.append('completed_time < ?')
+            params.append(completed_before)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def find_tasks(self, status: Optional[Statuses] = None, key_name: Optional[str] = None,
+                   completed_before: Optional[str] = None) -> Dict[str, Any]:
+        where, params = self._where(status, key_name, completed_before)
+        rows = self._connect().execute('SELECT task_id, data FROM tasks' + where, params)
+        return {task_id: _loads(data) for task_id, data in rows}
+
+    def count_tasks(self, key_name: Optional[str] = None, status: Optional[Statuses] = None,
+                    task_types: Optional[Iterable[str]] = None) -> int:
+        where, params = self._where(status, key_name, task_types=task_types)
+        return self._connect().execute('SELECT COUNT(*) FROM tasks' + where, params).fetchone()[0]
+
+    def find_waiting(self, task_types: Iterable[str], limit: int) -> Dict[str, Any]:
+        task_types = tuple(task_types)
+        # Rewriting a row gives it a new rowid, so re-queued tasks go to the back
+        rows = self._connect().execute(
+            f'SELECT task_id, data FROM tasks WHERE status = ? AND task_type IN ({",".join("?" * len(task_types))}) '
+            'ORDER BY rowid LIMIT ?',
+            (TaskStatus.WAITING.value, *task_types, limit)
+        )
+        return {task_id: _loads(data) for task_id, data in rows}
+
+    def renew_lease(self, task_id: str, owner: str, expires: float) -> Optional[Dict[str, Any]]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                'SELECT data FROM tasks WHERE task_id = ? AND status = ?',
+                (task_id, TaskStatus.PROCESSING.value)
+            ).fetchone()
+            if not row:
+                return None
+            task = _loads(row[0])
+            if task.get('lease_owner') != owner:
+                return None
+            task['lease_expires'] = expires
+            conn.execute(
+                'UPDATE tasks SET lease_expires = ?, data = ? WHERE task_id = ?',
+                (expires, _dumps(task), task_id)
+            )
+            return task
+
+    def expire_leases(self, now: float, max_attempts: int, completed_time: str) -> Dict[str, Any]:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                'SELECT task_id, data FROM tasks WHERE status = ? AND (lease_expires IS NULL OR lease_expires < ?)',
+                (TaskStatus.PROCESSING.value, now)
+            ).fetchall()
+            expired = {}
+            for task_id, data in rows:
+                task = _expired_lease_update(_loads(data), max_attempts, completed_time)
+                self._write_task(conn, task_id, task)
+                expired[task_id] = task
+            return expired
+
+    def grant_connections(self, task_id: str, wanted: int, limit: int) -> int:
+        with self._transaction() as conn:
+            in_use, active = conn.execute(
+                "SELECT COALESCE(SUM(json_extract(data, '$.granted_connections')), 0), COUNT(*) FROM tasks "
+                "WHERE status = ? AND task_id != ? AND json_extract(data, '$.granted_connections') > 0",
+                (TaskStatus.PROCESSING.value, task_id)
+            ).fetchone()
+            granted = _fair_share(wanted, limit, in_use, active)
+            row = conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            if row:
+                task = _loads(row[0])
+                task['granted_connections'] = granted
+                self._write_task(conn, task_id, task)
+            return granted
+
+    def record_access(self, accesses: Dict[str, Tuple[str, int]]) -> None:
+        task_ids = list(accesses)
+        with self._transaction() as conn:
+            for i in range(0, len(task_ids), self.MAX_QUERY_PARAMS):
+                chunk = task_ids[i:i + self.MAX_QUERY_PARAMS]
+                rows = conn.execute(
+                    f'SELECT task_id, data FROM tasks WHERE task_id IN ({",".join("?" * len(chunk))})',
+                    chunk
+                ).fetchall()
+                for task_id, data in rows:
+                    task = _apply_access(_loads(data), *accesses[task_id])
+                    conn.execute('UPDATE tasks SET data = ? WHERE task_id = ?', (_dumps(task), task_id))
+
+    def load_keys(self) -> Dict[str, Any]:
+        rows = self._connect().execute('SELECT name, data FROM api_keys')
+        return {name: _loads(data) for name, data in rows}
+
+    def save_keys(self, keys: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM api_keys')
+            for name, key_info in keys.items():
+                conn.execute(
+                    'INSERT INTO api_keys (name, key, data) VALUES (?, ?, ?)',
+                    (name, key_info['key'], _dumps(key_info))
+                )
+            self._bump_key_generation(conn)
+
+    def get_key(self, name: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            'SELECT data FROM api_keys WHERE name = ?', (name,)
+        ).fetchone()
+        return _loads(row[0]) if row else None
+
+    def save_key(self, name: str, data: Dict[str, Any]) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO api_keys (name, key, data) VALUES (?, ?, ?)',
+                (name, data['key'], _dumps(data))
+            )
+            self._bump_key_generation(conn)
+
+    def update_key(self, name: str, **fields) -> bool:
+        with self._transaction() as conn:
+            row = conn.execute('SELECT data FROM api_keys WHERE name = ?', (name,)).fetchone()
+            if not row:
+                return False
+            key_info = _loads(row[0])
+            key_info.update(fields)
+            conn.execute(
+                'UPDATE api_keys SET key = ?, data = ? WHERE name = ?',
+                (key_info['key'], _dumps(key_info), name)
+            )
+            return True
+
+    def delete_key(self, name: str) -> bool:
+        with self._transaction() as conn:
+            if conn.execute('DELETE FROM api_keys WHERE name = ?', (name,)).rowcount == 0:
+                return False
+            self._bump_key_generation(conn)
+            return True
+
+    def find_key(self, api_key: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        row = self._connect().execute(
+            'SELECT name, data FROM api_keys WHERE key = ?', (api_key,)
+        ).fetchone()
+        return (row[0], _loads(row[1])) if row else (None, None)
+
+    @staticmethod
+    def _bump_key_generation(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "INSERT INTO meta (name, value) VALUES ('key_generation', '1') "
+            "ON CONFLICT (name) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def key_generation(self) -> int:
+        row = self._connect().execute("SELECT value FROM meta WHERE name = 'key_generation'").fetchone()
+        return int(row[0]) if row else 0
+
+    def add_usage(self, key_name: str, kind: str, amount: int, timestamp: float,
+                  task_id: Optional[str] = None) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT INTO usage (key_name, kind, timestamp, amount, task_id) VALUES (?, ?, ?, ?, ?)',
+                (key_name, kind, timestamp, amount, task_id)
+            )
+
+    def usage_entries(self, key_name: str, kind: str, since: float) -> List[UsageEvent]:
+        return self._connect().execute(
+            'SELECT timestamp, amount, task_id FROM usage WHERE key_name = ? AND kind = ? AND timestamp > ? '
+            'ORDER BY timestamp',
+            (key_name, kind, since)
+        ).fetchall()
+
+    def usage_total(self, key_name: str, kind: str, since: float) -> int:
+        return self._usage_total(self._connect(), key_name, kind, since)
+
+    @staticmethod
+    def _usage_total(conn: sqlite3.Connection, key_name: str, kind: str, since: float) -> int:
+        return conn.execute(
+            'SELECT COALESCE(SUM(amount), 0) FROM usage WHERE key_name = ? AND kind = ? AND timestamp > ?',
+            (key_name, kind, since)
+        ).fetchone()[0]
+
+    def reserve_usage(self, key_name: str, task_id: str, size: int, timestamp: float, since: float,
+                      quota: Optional[int] = None, kind: str = 'memory') -> Tuple[bool, int]:
+        with self._transaction() as conn:
+            current = self._usage_total(conn, key_name, kind, since)
+            row = conn.execute(
+                'SELECT rowid, amount FROM usage WHERE key_name = ? AND kind = ? AND task_id = ? '
+                'AND timestamp > ? ORDER BY timestamp DESC LIMIT 1',
+                (key_name, kind, task_id, since)
+            ).fetchone()
+            growth = size - row[1] if row else size
+            if quota is not None and growth > 0 and current + growth > quota:
+                return False, current
+            if row:
+                conn.execute('UPDATE usage SET amount = ? WHERE rowid = ?', (size, row[0]))
+            elif size > 0:
+                conn.execute(
+                    'INSERT INTO usage (key_name, kind, timestamp, amount, task_id) VALUES (?, ?, ?, ?, ?)',
+                    (key_name, kind, timestamp, size, task_id)
+                )
+            return True, current
+
+    def release_usage(self, kind: str, task_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM usage WHERE kind = ? AND task_id = ?', (kind, task_id))
+
+    def forget_usage(self, key_name: str) -> None:
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM usage WHERE key_name = ?', (key_name,))
+
+    def prune_usage(self, kind: str, before: float) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                'DELETE FROM usage WHERE kind = ? AND (timestamp <= ? OR key_name NOT IN (SELECT name FROM api_keys))',
+                (kind, before)
+            )
+
+def create_backend() -> StorageBackend:
+    if storage.BACKEND == 'json':
+        return JsonStorageBackend(storage.TASKS_FILE, storage.KEYS_FILE, storage.USAGE_FILE)
+    if storage.BACKEND == 'sqlite':
+        return SQLiteStorageBackend(storage.DATABASE_FILE, storage.TASKS_FILE, storage.KEYS_FILE, storage.USAGE_FILE)
+    raise ValueError(f"Unknown storage backend: {storage.BACKEND}")
+
+def _native_runner() -> Optional[Callable]:
+    """Under gevent, runs storage calls on its pool of native threads.
+
+    SQLite waits for locks and the disk in C, where the call would stop
+    every greenlet of the process.
+    """
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is None or not monkey.is_module_patched('threading'):
+        return None
+    import gevent
+    return lambda fn, *args, **kwargs: gevent.get_hub().threadpool.apply(fn, args, kwargs)
+
+class TimedBackend:
+    """Forwards to a backend and records how long each operation takes.
+
+    Operations go through `run` if given, e.g. to leave the event loop.
+    """
+
+    def __init__(self, backend: StorageBackend, run: Optional[Callable] = None):
+        self._backend = backend
+        self._run = run
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._backend, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def timed(*args, **kwargs):
+            with metrics.STORAGE_SECONDS.time(operation=name):
+                if self._run is None:
+                    return attr(*args, **kwargs)
+                return self._run(attr, *args, **kwargs)
+        # Later lookups find the wrapper directly
+        setattr(self, name, timed)
+        return timed
+
+class Storage:
+    _backend: Optional[StorageBackend] = None
+    _backend_lock = threading.Lock()
+
+    @classmethod
+    def backend(cls) -> StorageBackend:
+        if cls._backend is None:
+            with cls._backend_lock:
+                if cls._backend is None:
+                    cls._backend = TimedBackend(create_backend(), _native_runner())
+        return cls._backend
+
     @classmethod
     def load_tasks(cls) -> Dict[str, Any]:
-        return cls._load_json(storage.TASKS_FILE)
-    
+        return cls.backend().load_tasks()
+
     @classmethod
     def save_tasks(cls, tasks: Dict[str, Any]) -> None:
-        cls._save_json(storage.TASKS_FILE, tasks)
-    
+        cls.backend().save_tasks(tasks)
+
+    @classmethod
+    def get_task(cls, task_id: str) -> Optional[Dict[str, Any]]:
+        return cls.backend().get_task(task_id)
+
+    @classmethod
+    def get_tasks(cls, task_ids: Iterable[str]) -> Dict[str, Any]:
+        return cls.backend().get_tasks(task_ids)
+
+    @classmethod
+    def add_task(cls, task_id: str, data: Dict[str, Any]) -> None:
+        cls.backend().add_task(task_id, data)
+
+    @classmethod
+    def add_tasks(cls, tasks: Dict[str, Any]) -> None:
+        cls.backend().add_tasks(tasks)
+
+    @classmethod
+    def update_task(cls, task_id: str, **fields) -> bool:
+        return cls.backend().update_task(task_id, **fields)
+
+    @classmethod
+    def transition_task(cls, task_id: str, from_status: Statuses, to_status: str, **fields) -> bool:
+        return cls.backend().transition_task(task_id, from_status, to_status, **fields)
+
+    @classmethod
+    def delete_task(cls, task_id: str) -> bool:
+        return cls.backend().delete_task(task_id)
+
+    @classmethod
+    def find_tasks(cls, status: Optional[Statuses] = None, key_name: Optional[str] = None,
+                   completed_before: Optional[str] = None) -> Dict[str, Any]:
+        return cls.backend().find_tasks(status, key_name, completed_before)
+
+    @classmethod
+    def count_tasks(cls, key_name: Optional[str] = None, status: Optional[Statuses] = None,
+                    task_types: Optional[Iterable[str]] = None) -> int:
+        return cls.backend().count_tasks(key_name, status, task_types)
+
+    @classmethod
+    def find_waiting(cls, task_types: Iterable[str], limit: int) -> Dict[str, Any]:
+        return cls.backend().find_waiting(task_types, limit)
+
+    @classmethod
+    def renew_lease(cls, task_id: str, owner: str, expires: float) -> Optional[Dict[str, Any]]:
+        return cls.backend().renew_lease(task_id, owner, expires)
+
+    @classmethod
+    def expire_leases(cls, now: float, max_attempts: int, completed_time: str) -> Dict[str, Any]:
+        return cls.backend().expire_leases(now, max_attempts, completed_time)
+
+    @classmethod
+    def grant_connections(cls, task_id: str, wanted: int, limit: int) -> int:
+        return cls.backend().grant_connections(task_id, wanted, limit)
+
+    @classmethod
+    def record_access(cls, accesses: Dict[str, Tuple[str, int]]) -> None:
+        cls.backend().record_access(accesses)
+
     @classmethod
     def load_keys(cls) -> Dict[str, Any]:
-        return cls._load_json(storage.KEYS_FILE)
-    
+        return cls.backend().load_keys()
+
     @classmethod
     def save_keys(cls, keys: Dict[str, Any]) -> None:
-        cls._save_json(storage.KEYS_FILE, keys)
+        cls.backend().save_keys(keys)
+
+    @classmethod
+    def get_key(cls, name: str) -> Optional[Dict[str, Any]]:
+        return cls.backend().get_key(name)
+
+    @classmethod
+    def save_key(cls, name: str, data: Dict[str, Any]) -> None:
+        cls.backend().save_key(name, data)
+
+    @classmethod
+    def update_key(cls, name: str, **fields) -> bool:
+        return cls.backend().update_key(name, **fields)
+
+    @classmethod
+    def delete_key(cls, name: str) -> bool:
+        return cls.backend().delete_key(name)
+
+    @classmethod
+    def find_key(cls, api_key: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        return cls.backend().find_key(api_key)
+
+    @classmethod
+    def key_generation(cls) -> int:
+        return cls.backend().key_generation()
+
+    @classmethod
+    def add_usage(cls, key_name: str, kind: str, amount: int, timestamp: float,
+                  task_id: Optional[str] = None) -> None:
+        cls.backend().add_usage(key_name, kind, amount, timestamp, task_id)
+
+    @classmethod
+    def usage_entries(cls, key_name: str, kind: str, since: float) -> List[UsageEvent]:
+        return cls.backend().usage_entries(key_name, kind, since)
+
+    @classmethod
+    def usage_total(cls, key_name: str, kind: str, since: float) -> int:
+        return cls.backend().usage_total(key_name, kind, since)
+
+    @classmethod
+    def reserve_usage(cls, key_name: str, task_id: str, size: int, timestamp: float, since: float,
+                      quota: Optional[int] = None, kind: str = 'memory') -> Tuple[bool, int]:
+        return cls.backend().reserve_usage(key_name, task_id, size, timestamp, since, quota, kind)
+
+    @classmethod
+    def release_usage(cls, kind: str, task_id: str) -> None:
+        cls.backend().release_usage(kind, task_id)
+
+    @classmethod
+    def forget_usage(cls, key_name: str) -> None:
+        cls.backend().forget_usage(key_name)
+
+    @classmethod
+    def prune_usage(cls, kind: str, before: float) -> None:
+        cls.backend().prune_usage(kind, before)
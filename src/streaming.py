@@ -0,0 +1,114 @@
+import os
+import time
+from typing import Iterator, Optional
+
+from src.storage import Storage
+from src.models import TaskStatus
+from src import live
+from config import storage
+from config import task as task_config
+
+IGNORED_SUFFIXES = ('.ytdl', '.json', '.m3u8')
+
+def find_growing_file(task_dir: str) -> Optional[str]:
+    """Returns the file yt-dlp is currently writing in `task_dir`, if any."""
+    if not os.path.isdir(task_dir):
+        return None
+    candidates = [
+        name for name in os.listdir(task_dir)
+        if not name.startswith('.') and '-Frag' not in name and not name.endswith(IGNORED_SUFFIXES)
+    ]
+    partial = [name for name in candidates if name.endswith('.part')]
+    names = partial or candidates
+    if not names:
+        return None
+    return os.path.join(task_dir, max(names, key=lambda n: os.path.getmtime(os.path.join(task_dir, n))))
+
+def output_name(path: str) -> str:
+    name = os.path.basename(path)
+    return name[:-len('.part')] if name.endswith('.part') else name
+
+def _task_running(task_id: str) -> bool:
+    task = Storage.get_task(task_id)
+    return task is not None and task['status'] in [TaskStatus.WAITING.value, TaskStatus.PROCESSING.value]
+
+def wait_for_file(task_id: str) -> Optional[str]:
+    task_dir = os.path.join(storage.DOWNLOAD_DIR, task_id)
+    deadline = time.monotonic() + task_config.STREAM_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        path = find_growing_file(task_dir)
+        if path:
+            return path
+        if not _task_running(task_id):
+            return None
+        time.sleep(task_config.STREAM_POLL_SECONDS)
+    return None
+
+def follow(task_id: str, path: str) -> Iterator[bytes]:
+    """Yields the contents of a file that is still being written.
+
+    At EOF the reader waits for more data until the task leaves the
+    PROCESSING state. The descriptor stays open, so the final rename of
+    the `.part` file does not interrupt the stream.
+    """
+    idle_since = time.monotonic()
+    last_check = 0.0
+    running = True
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(storage.FILE_CHUNK_SIZE)
+            if chunk:
+                idle_since = time.monotonic()
+                yield chunk
+                continue
+            if not running:
+                return
+
+            now = time.monotonic()
+            if now - idle_since > task_config.STREAM_IDLE_TIMEOUT_SECONDS:
+                return
+            if now - last_check >= 1.0:
+                last_check = now
+                # Drain whatever was written before the task finished
+                running = _task_running(task_id)
+                if not running:
+                    continue
+            time.sleep(task_config.STREAM_POLL_SECONDS)
+
+def follow_segments(task_id: str, task_dir: str) -> Iterator[bytes]:
+    """Yields the segments of a live recording as MPEG-TS, starting at the newest.
+
+    Segments show up once complete, so each one is sent whole. Segments that
+    left the retention window before they were sent are skipped.
+    """
+    last = None
+    idle_since = time.monotonic()
+    while True:
+        try:
+            names = sorted(name for name in os.listdir(task_dir) if live.is_segment(name))
+        except OSError:
+            names = []
+        pending = [name for name in names if last is None or name > last]
+        if last is None:
+            pending = pending[-1:]
+        for name in pending:
+            last = name
+            try:
+                f = open(os.path.join(task_dir, name), 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                while True:
+                    chunk = f.read(storage.FILE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            idle_since = time.monotonic()
+        if pending:
+            continue
+
+        if not _task_running(task_id):
+            return
+        if time.monotonic() - idle_since > task_config.STREAM_IDLE_TIMEOUT_SECONDS:
+            return
+        time.sleep(task_config.LIVE_POLL_SECONDS)
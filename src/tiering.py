@@ -0,0 +1,260 @@
+import os
+import time
+import shutil
+import atexit
+import fcntl
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.storage import Storage
+from src.models import TaskStatus
+from src.disk_usage import disk_usage
+from src import metrics
+from config import storage, memory
+from config import task as task_config
+from config import node as node_config
+from config import tiering as tiering_config
+
+LOCK_NAME = '.eviction.lock'
+
+def cold_dir() -> Optional[str]:
+    return tiering_config.COLD_DIR or None
+
+def task_dirs(task_id: str) -> List[str]:
+    """The folders a task's files may live in, hot tier first."""
+    dirs = [os.path.join(storage.DOWNLOAD_DIR, task_id)]
+    if cold_dir():
+        dirs.append(os.path.join(cold_dir(), task_id))
+    return dirs
+
+def locate(filename: str) -> Optional[str]:
+    """Returns the path of a `/files` name in whichever tier holds it.
+
+    Names that would leave the tier's directory resolve to nothing.
+    """
+    for root in filter(None, [storage.DOWNLOAD_DIR, cold_dir()]):
+        root = os.path.abspath(root)
+        path = os.path.abspath(os.path.join(root, filename))
+        if path.startswith(root + os.sep) and os.path.isfile(path):
+            return path
+    return None
+
+def _folder_size(path: str) -> int:
+    size = 0
+    try:
+        for entry in os.scandir(path):
+            if entry.is_file(follow_symlinks=False):
+                size += entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        pass
+    return size
+
+def _free_bytes(path: str) -> Optional[int]:
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return None
+
+class AccessLog:
+    """Buffers `/files` hits per task and adds them to the task records.
+
+    Like key access times, hits are kept in memory and written by a
+    background flusher every ACCESS_FLUSH_SECONDS, so serving a file never
+    waits on storage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # task_id -> [last access, hits since the last flush]
+        self._pending: Dict[str, list] = {}
+        self._flusher: Optional[threading.Thread] = None
+
+    def touch(self, task_id: str) -> None:
+        now = datetime.now().isoformat()
+        with self._lock:
+            entry = self._pending.get(task_id)
+            if entry is None:
+                self._pending[task_id] = [now, 1]
+            else:
+                entry[0] = now
+                entry[1] += 1
+        self._start_flusher()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            Storage.record_access({task_id: (last, hits) for task_id, (last, hits) in pending.items()})
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(tiering_config.ACCESS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing file access counts: {e}")
+
+    def _start_flusher(self) -> None:
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='access-flusher', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+class TierManager:
+    """Keeps DOWNLOAD_DIR under its high-water mark by evicting cold artifacts.
+
+    Finished tasks stay on disk for at least CLEANUP_TIME_MINUTES. After
+    that nothing is deleted until the tracked task bytes fill the hot tier
+    past HIGH_WATER_MARK of AVAILABLE_BYTES. Then the least recently
+    accessed tasks, fewest hits first among equals, are moved to COLD_DIR
+    if one is set, or deleted, until usage is back under LOW_WATER_MARK or
+    nothing is left to evict. The cold tier is trimmed the same way against
+    COLD_AVAILABLE_BYTES. The task bytes come from the ledger in storage,
+    which all nodes share, but each node only evicts the tasks it
+    downloaded. Data that is not ours never causes an eviction; the free
+    space of the filesystem is only a floor for new reservations.
+
+    `remove` deletes a task and its files; it is the downloader's cleanup.
+    """
+
+    def __init__(self, remove: Callable[[str], None]):
+        self.remove = remove
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def hot_fill(extra: int = 0) -> float:
+        """Fraction of AVAILABLE_BYTES in use, counting `extra` bytes about to be written."""
+        return (disk_usage.total() + extra) / memory.AVAILABLE_BYTES
+
+    @staticmethod
+    def _is_local(task_id: str, task: dict) -> bool:
+        """Whether this node downloaded the task; without a recorded node, whether its files are here."""
+        node = task.get('node')
+        if node is not None:
+            return node == node_config.NODE_ID
+        return any(os.path.isdir(task_dir) for task_dir in task_dirs(task_id))
+
+    @staticmethod
+    def _last_access(task: dict) -> str:
+        return task.get('last_access') or task.get('completed_time') or ''
+
+    @staticmethod
+    def _candidates(tasks: Dict[str, dict], tier: str, now: datetime) -> List[Tuple[str, dict]]:
+        """Completed tasks of a tier past their minimum retention, least valuable first."""
+        retained = (now - timedelta(minutes=task_config.CLEANUP_TIME_MINUTES)).isoformat()
+        candidates = [
+            (task_id, task) for task_id, task in tasks.items()
+            if task.get('tier', 'hot') == tier and task.get('completed_time', '') <= retained
+        ]
+        candidates.sort(key=lambda item: (TierManager._last_access(item[1]), item[1].get('hits', 0)))
+        return candidates
+
+    def ensure_room(self, size: int) -> None:
+        """Evicts before a download of `size` bytes would cross the high-water mark.
+
+        Raises if the filesystem does not have `size` bytes free even so.
+        """
+        if tiering_config.EVICTION and self.hot_fill(size) > tiering_config.HIGH_WATER_MARK:
+            self.sweep(reserve=size)
+        free = _free_bytes(storage.DOWNLOAD_DIR)
+        if free is not None and size > free:
+            metrics.REJECTIONS.inc(reason='disk_full')
+            raise Exception(f"Not enough free disk space. Requested: {size / 1024 ** 3:.2f}GB, "
+                            f"Free: {free / 1024 ** 3:.2f}GB")
+
+    def sweep(self, reserve: int = 0) -> None:
+        if not tiering_config.EVICTION:
+            return
+        # One process per host evicts at a time; the others would evict the same tasks again
+        with self._lock, open(os.path.join(storage.DOWNLOAD_DIR, LOCK_NAME), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                self._sweep(reserve)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sweep(self, reserve: int) -> None:
+        now = datetime.now()
+        tasks = {
+            task_id: task for task_id, task in Storage.find_tasks(status=TaskStatus.COMPLETED.value).items()
+            if self._is_local(task_id, task)
+        }
+
+        for task_id, task in tasks.items():
+            if task.get('tier') == 'cold':
+                # Demoted by another process, which took it off the ledger
+                disk_usage.forget(task_id)
+
+        if tiering_config.MAX_RETENTION_MINUTES is not None:
+            expired = (now - timedelta(minutes=tiering_config.MAX_RETENTION_MINUTES)).isoformat()
+            for task_id, task in list(tasks.items()):
+                if self._last_access(task) < expired:
+                    self._evict(task_id, 'expired')
+                    del tasks[task_id]
+
+        # Evicting a task takes it off the shared ledger
+        if self.hot_fill(reserve) > tiering_config.HIGH_WATER_MARK:
+            for task_id, task in self._candidates(tasks, 'hot', now):
+                if self.hot_fill(reserve) <= tiering_config.LOW_WATER_MARK:
+                    break
+                if cold_dir() and self._demote(task_id):
+                    task['tier'] = 'cold'
+                else:
+                    self._evict(task_id, 'hot')
+
+        if cold_dir():
+            self._trim_cold(tasks, now)
+
+    def _trim_cold(self, tasks: Dict[str, dict], now: datetime) -> None:
+        cold = {task_id: task for task_id, task in tasks.items() if task.get('tier') == 'cold'}
+        sizes = {task_id: _folder_size(os.path.join(cold_dir(), task_id)) for task_id in cold}
+        used = sum(sizes.values())
+
+        def fill() -> float:
+            return used / tiering_config.COLD_AVAILABLE_BYTES
+
+        if fill() <= tiering_config.HIGH_WATER_MARK:
+            return
+        for task_id, _ in self._candidates(cold, 'cold', now):
+            if fill() <= tiering_config.LOW_WATER_MARK:
+                break
+            self._evict(task_id, 'cold')
+            used -= sizes[task_id]
+
+    def _demote(self, task_id: str) -> bool:
+        """Moves a task's folder to the cold tier; returns False if it could not."""
+        source, target = task_dirs(task_id)
+        if not os.path.isdir(source):
+            return False
+        tmp_target = f'{target}.tmp'
+        try:
+            shutil.rmtree(tmp_target, ignore_errors=True)
+            os.makedirs(cold_dir(), exist_ok=True)
+            # Copy first, so the files stay readable in one tier or the other
+            shutil.copytree(source, tmp_target)
+            os.replace(tmp_target, target)
+        except OSError as e:
+            print(f"Error moving task {task_id} to {cold_dir()}: {e}")
+            shutil.rmtree(tmp_target, ignore_errors=True)
+            return False
+        if not Storage.update_task(task_id, tier='cold'):
+            # Deleted meanwhile
+            shutil.rmtree(target, ignore_errors=True)
+            return False
+        shutil.rmtree(source, ignore_errors=True)
+        disk_usage.remove(task_id)
+        metrics.EVICTIONS.inc(reason='demoted')
+        return True
+
+    def _evict(self, task_id: str, reason: str) -> None:
+        self.remove(task_id)
+        metrics.EVICTIONS.inc(reason=reason)
+
+access_log = AccessLog()
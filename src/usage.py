@@ -0,0 +1,83 @@
+import time
+import threading
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from src.storage import Storage
+from config import task, memory
+from config import auth as auth_config
+
+class UsageTracker:
+    """Per-key request and memory windows backing rate limits and quotas.
+
+    The events of both windows are kept in storage, so every API and worker
+    process checks against the same windows and a limit holds however many
+    of them run. A check sums one key's events inside its window; events
+    that left it are pruned every USAGE_PRUNE_SECONDS.
+    """
+
+    def __init__(self, request_window: float, memory_window: float):
+        self.request_window = request_window
+        self.memory_window = memory_window
+        self._lock = threading.Lock()
+        self._pruner: Optional[threading.Thread] = None
+
+    def request_count(self, name: str) -> int:
+        return Storage.usage_total(name, 'requests', time.time() - self.request_window)
+
+    def record_requests(self, name: str, count: int = 1) -> None:
+        Storage.add_usage(name, 'requests', count, time.time())
+        self._start_pruner()
+
+    def memory_usage(self, name: str) -> int:
+        return Storage.usage_total(name, 'memory', time.time() - self.memory_window)
+
+    def try_reserve_memory(self, name: str, size: int, task_id: str, quota: int) -> Tuple[bool, int]:
+        """Sets the reservation of `task_id` to `size` unless growing it exceeds `quota`.
+
+        Returns (reserved, key usage) with the usage as it was before.
+        """
+        now = time.time()
+        reserved = Storage.reserve_usage(name, task_id, size, now, now - self.memory_window, quota)
+        self._start_pruner()
+        return reserved
+
+    def settle_memory(self, name: str, task_id: str, size: int) -> None:
+        """Replaces a reservation with the size that was actually used."""
+        now = time.time()
+        Storage.reserve_usage(name, task_id, size, now, now - self.memory_window)
+
+    def memory_entries(self, name: str) -> List[dict]:
+        return [
+            {'size': size, 'timestamp': datetime.fromtimestamp(timestamp).isoformat(), 'task_id': task_id}
+            for timestamp, size, task_id in Storage.usage_entries(name, 'memory', time.time() - self.memory_window)
+        ]
+
+    def forget(self, name: str) -> None:
+        Storage.forget_usage(name)
+
+    def prune(self) -> None:
+        now = time.time()
+        Storage.prune_usage('requests', now - self.request_window)
+        Storage.prune_usage('memory', now - self.memory_window)
+
+    def _prune_loop(self) -> None:
+        while True:
+            time.sleep(auth_config.USAGE_PRUNE_SECONDS)
+            try:
+                self.prune()
+            except Exception as e:
+                print(f"Error pruning usage windows: {e}")
+
+    def _start_pruner(self) -> None:
+        if self._pruner is not None:
+            return
+        with self._lock:
+            if self._pruner is None:
+                self._pruner = threading.Thread(target=self._prune_loop, name='usage-pruner', daemon=True)
+                self._pruner.start()
+
+usage_tracker = UsageTracker(
+    task.CLEANUP_TIME_MINUTES * 60,
+    memory.QUOTA_RATE_MINUTES * 60
+)
@@ -0,0 +1,26 @@
+import os
+import signal
+import threading
+
+from config import node as node_config
+
+def main():
+    # Threads inherit the niceness of the thread that starts them, so this comes before the import
+    os.nice(node_config.WORKER_NICENESS)
+    from src.yt_handler import downloader
+
+    if not downloader.runs_workers:
+        raise SystemExit(f"YTDLP_HOST_ROLE is '{node_config.ROLE}', nothing to run")
+    print(f"Worker {downloader.worker_id} is polling the task queue")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    while not stop.wait(1):
+        pass
+
+    print(f"Draining running tasks for up to {node_config.DRAIN_TIMEOUT_SECONDS} seconds")
+    downloader.shutdown(node_config.DRAIN_TIMEOUT_SECONDS)
+
+if __name__ == '__main__':
+    main()
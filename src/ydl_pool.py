@@ -0,0 +1,94 @@
+import copy
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+import yt_dlp
+from yt_dlp.utils import DEFAULT_OUTTMPL
+
+from config import task as task_config
+
+class YDLPool:
+    """Long-lived YoutubeDL instances, one per worker thread and option profile.
+
+    Reusing an instance keeps its extractor instances (and their player JS
+    caches), cookie jar and HTTP connections warm between tasks. Per-task
+    options are applied on top of the profile and reverted afterwards.
+
+    Hooks are kept on the instance's entry rather than looked up by thread:
+    yt-dlp calls them from its own fragment download threads as well.
+    """
+
+    def __init__(self, profiles: Dict[str, dict]):
+        self.profiles = profiles
+        self._local = threading.local()
+
+    def _instances(self) -> Dict[str, list]:
+        if not hasattr(self._local, 'instances'):
+            self._local.instances = {}
+        return self._local.instances
+
+    @staticmethod
+    def _dispatcher(hooks: Dict[str, list], kind: str) -> Callable[[dict], None]:
+        def dispatch(status: dict) -> None:
+            for hook in hooks[kind]:
+                hook(status)
+        return dispatch
+
+    def _create(self, profile: str, hooks: Dict[str, list]) -> yt_dlp.YoutubeDL:
+        params = copy.deepcopy(self.profiles[profile])
+        params['progress_hooks'] = [self._dispatcher(hooks, 'progress')]
+        params['postprocessor_hooks'] = [self._dispatcher(hooks, 'postprocessor')]
+        return yt_dlp.YoutubeDL(params)
+
+    def _get(self, profile: str) -> list:
+        """Returns the thread's [instance, uses, hooks] entry for `profile`."""
+        instances = self._instances()
+        entry = instances.get(profile)
+        if entry is None or entry[1] >= task_config.YDL_MAX_USES:
+            if entry is not None:
+                entry[0].close()
+            hooks = {'progress': [], 'postprocessor': []}
+            entry = instances[profile] = [self._create(profile, hooks), 0, hooks]
+        entry[1] += 1
+        return entry
+
+    def _discard(self, profile: str) -> None:
+        entry = self._instances().pop(profile, None)
+        if entry is not None:
+            entry[0].close()
+
+    @contextmanager
+    def acquire(self, profile: str, progress_hooks: List = (), postprocessor_hooks: List = (),
+                **overrides) -> Iterator[yt_dlp.YoutubeDL]:
+        ydl, _, hooks = self._get(profile)
+        base = self.profiles[profile]
+        saved = {key: ydl.params[key] for key in overrides if key in ydl.params}
+
+        for key, value in overrides.items():
+            if key == 'outtmpl':
+                value = {**DEFAULT_OUTTMPL, 'default': value}
+            ydl.params[key] = value
+        if 'format' in overrides:
+            ydl.format_selector = ydl.build_format_selector(overrides['format'])
+        hooks['progress'] = list(progress_hooks)
+        hooks['postprocessor'] = list(postprocessor_hooks)
+
+        try:
+            yield ydl
+        except BaseException:
+            # The instance may be left half-way through a download
+            self._discard(profile)
+            raise
+        finally:
+            hooks['progress'] = []
+            hooks['postprocessor'] = []
+
+        for key in overrides:
+            if key in saved:
+                ydl.params[key] = saved[key]
+            else:
+                ydl.params.pop(key, None)
+        if 'format' in overrides:
+            ydl.format_selector = (ydl.build_format_selector(base['format'])
+                                   if base.get('format') else None)
@@ -1,25 +1,93 @@
 import os
-import json
 import time
 import shutil
 import threading
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Set, Tuple
 
-import yt_dlp
-from yt_dlp.utils import download_range_func
+from yt_dlp.utils import download_range_func, DownloadCancelled
 
 from src.storage import Storage
-from src.auth import memory_manager
-from src.models import TaskStatus, TaskType
+from src.auth import memory_manager, RateLimiter
+from src.models import TaskStatus, TaskType, generate_task_id
+from src.scheduler import WorkerPool, TimerQueue, QueueFullError
+from src.ffmpeg import FFmpegJob, FFmpegError, FFmpegCancelled
+from src.progress import progress_tracker
+from src.cache import InfoCache
+from src.estimator import SizeEstimator
+from src.ydl_pool import YDLPool
+from src.content_store import ContentStore, content_store
+from src.disk_usage import disk_usage
+from src.acceleration import Transfer, accelerator
+from src.checkpoint import Checkpoint
+from src.tiering import TierManager
+from src.live import LiveRecorder
+from src import checkpoint
+from src import metrics
+from src import info_index
+from src import tiering
+from src import live
 from config import storage, memory
 from config import task as task_config
+from config import node as node_config
+from config import tiering as tiering_config
 
 class YTDownloader:
+    EXTRACTOR_ARGS = { 'youtube': { 'player_client': ['default', '-tv_simply'], }, }
+    EXTRACT_OPTS = {
+        'quiet': True,
+        'no_warnings': True,
+        'extractor_args': EXTRACTOR_ARGS,
+    }
+    YDL_PROFILES = {
+        'extract': EXTRACT_OPTS,
+        'info': {**EXTRACT_OPTS, 'extract_flat': True, 'skip_download': True},
+        'download': {'extractor_args': EXTRACTOR_ARGS},
+    }
+    # Lower runs first within a pool: quick lookups before downloads, playlist expansion last
+    PRIORITIES = {
+        TaskType.GET_INFO.value: 0,
+        TaskType.GET_VIDEO.value: 1,
+        TaskType.GET_AUDIO.value: 1,
+        TaskType.GET_LIVE_VIDEO.value: 2,
+        TaskType.GET_LIVE_AUDIO.value: 2,
+        TaskType.EXPAND_PLAYLIST.value: 3,
+    }
+    
     def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=task_config.MAX_WORKERS)
+        self.pools = {
+            'metadata': WorkerPool('metadata', task_config.METADATA_WORKERS, task_config.METADATA_QUEUE_SIZE),
+            'download': WorkerPool('download', task_config.DOWNLOAD_WORKERS, task_config.DOWNLOAD_QUEUE_SIZE),
+            'live': WorkerPool('live', task_config.LIVE_WORKERS, task_config.LIVE_QUEUE_SIZE),
+            'postprocess': WorkerPool('postprocess', task_config.POSTPROCESS_WORKERS, task_config.POSTPROCESS_QUEUE_SIZE)
+        }
+        self.timers = TimerQueue()
+        self.worker_id = f'{node_config.NODE_ID}:{os.getpid()}'
+        self._leases: Set[str] = set()
+        self._draining = False
+        self._cancelled = set()
+        self._ffmpeg_jobs: Dict[str, FFmpegJob] = {}
+        self._leading: Dict[str, str] = {}
+        self._transfers: Dict[str, Transfer] = {}
+        # task_id -> (key name, key info) of running segmented recordings
+        self._recording_keys: Dict[str, Tuple[str, dict]] = {}
+        self.ydl_pool = YDLPool(self.YDL_PROFILES)
+        self.info_cache = InfoCache(self.ydl_pool, 'extract')
+        self.estimator = SizeEstimator(self.ydl_pool, self.info_cache, 'download')
+        self.tiers = TierManager(self.cleanup_task)
+        self.recorder = LiveRecorder(self._on_recording_progress, self._on_recording_exit)
         self._ensure_download_dir()
+        metrics.registry.add_collector(self._collect_metrics)
+    
+    def _collect_metrics(self):
+        if not self.runs_workers:
+            return
+        for name, stats in self.pool_stats().items():
+            metrics.POOL_WORKERS.set(stats['workers'], pool=name)
+            metrics.POOL_RUNNING.set(stats['running'], pool=name)
+            metrics.POOL_QUEUED.set(stats['queued'], pool=name)
+        metrics.DOWNLOAD_CONNECTIONS.set(accelerator.budget.in_use())
+        metrics.LIVE_RECORDINGS.set(self.recorder.active())
     
     def _ensure_download_dir(self):
         os.makedirs(storage.DOWNLOAD_DIR, exist_ok=True)
@@ -27,114 +95,170 @@ class YTDownloader:
     def _get_task_dir(self, task_id: str) -> str:
         return os.path.join(storage.DOWNLOAD_DIR, task_id)
     
+    @property
+    def runs_workers(self) -> bool:
+        return node_config.ROLE in ('all', 'worker')
+    
+    @property
+    def _polls_queue(self) -> bool:
+        """Dedicated workers poll storage; in the `all` role the API submits to the pools directly."""
+        return node_config.ROLE == 'worker'
+    
     def _update_task(self, task_id: str, **kwargs):
-        tasks = Storage.load_tasks()
-        if task_id in tasks:
-            tasks[task_id].update(kwargs)
-            Storage.save_tasks(tasks)
+        Storage.update_task(task_id, **kwargs)
     
-    def _handle_error(self, task_id: str, error: Exception):
+    def _claim_task(self, task_id: str) -> Optional[dict]:
+        """Takes a waiting task with a lease that the heartbeat keeps renewing."""
+        task = Storage.get_task(task_id)
+        if task is None:
+            return None
+        lease = {
+            'node': node_config.NODE_ID,
+            'lease_owner': self.worker_id,
+            'lease_expires': time.time() + node_config.LEASE_SECONDS,
+            'attempts': task.get('attempts', 0) + 1
+        }
+        if not Storage.transition_task(task_id, TaskStatus.WAITING.value, TaskStatus.PROCESSING.value, **lease):
+            return None
+        self._leases.add(task_id)
+        task.update(lease, status=TaskStatus.PROCESSING.value)
+        return task
+    
+    def _finish_task(self, task_id: str, status: TaskStatus, **kwargs):
+        self._cancelled.discard(task_id)
+        transfer = self._transfers.pop(task_id, None)
+        if transfer is not None and status == TaskStatus.COMPLETED:
+            kwargs.update(transfer.summary())
+        progress_tracker.finish(task_id)
+        memory_manager.settle(task_id, self._get_task_dir(task_id))
+        if task_id not in self._leases:
+            # The lease was lost and the task re-queued; its new owner reports the result
+            return
+        self._leases.discard(task_id)
+        
+        completed_time = datetime.now()
         self._update_task(
             task_id,
-            status=TaskStatus.ERROR.value,
-            error=str(error),
-            completed_time=datetime.now().isoformat()
+            status=status.value,
+            completed_time=completed_time.isoformat(),
+            lease_owner=None,
+            lease_expires=None,
+            **kwargs
         )
+        metrics.TASKS_FINISHED.inc(status=status.value)
+        self._schedule_cleanup(task_id, completed_time)
+    
+    def _handle_error(self, task_id: str, error: Exception):
+        self._finish_task(task_id, TaskStatus.ERROR, error=str(error))
+        content_key = self._leading.pop(task_id, None)
+        if content_key:
+            content_store.abandon(content_key)
         print(f"Error in task {task_id}: {error}")
     
-    def estimate_size(self, url: str, video_format: Optional[str] = None, 
-                      audio_format: Optional[str] = None) -> int:
+    @metrics.timed('estimate_size')
+    def estimate_size(self, task: dict) -> int:
+        """Bytes the task's download is expected to write with headroom, or -1 if unknown."""
         try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-                'skip_download': True
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                total_size = 0
-                formats = info.get('formats', [])
-                
-                if video_format:
-                    total_size += self._get_format_size(formats, video_format, is_video=True)
-                
-                if audio_format:
-                    total_size += self._get_format_size(formats, audio_format, is_video=False)
-                
-                return int(total_size * memory.SIZE_BUFFER) if total_size > 0 else -1
+            start, end = self._time_range(task)
+            size = self.estimator.estimate(task['url'], self._format_option(task)[0], start, end)
+            return int(size * memory.SIZE_BUFFER) if size > 0 else -1
         except Exception as e:
             print(f"Error in estimate_size: {str(e)}")
             return -1
     
-    def _get_format_size(self, formats: list, format_spec: str, is_video: bool) -> int:
-        if format_spec == 'bestvideo':
-            filtered = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') == 'none']
-        elif format_spec == 'bestaudio':
-            filtered = [f for f in formats if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
-        else:
-            filtered = [f for f in formats if f.get('format_id') == format_spec]
-        
-        if not filtered:
-            return 0
-        
-        best = max(filtered, key=lambda f: f.get('filesize') or f.get('filesize_approx', 0))
-        return best.get('filesize') or best.get('filesize_approx', 0)
+    def expand_playlist(self, url: str, limit: int) -> List[str]:
+        """Returns the entry URLs of a playlist, or just `url` for a single video."""
+        with self.ydl_pool.acquire('info') as ydl:
+            result = ydl.extract_info(url, download=False, process=False)
+            if result.get('_type') not in ('playlist', 'multi_video'):
+                return [url]
+            result = ydl.process_ie_result(result, download=False)
     
+        urls = []
+        for entry in result.get('entries') or []:
+            entry_url = entry and (entry.get('webpage_url') or entry.get('url'))
+            if entry_url:
+                urls.append(entry_url)
+            if len(urls) >= limit:
+                break
+        return urls
+    
+    @metrics.timed('expand_task')
+    def expand_task(self, task_id: str):
+        """Stores a waiting task per playlist entry, as many as the key's rate limit allows."""
+        try:
+            task = self._claim_task(task_id)
+            if task is None:
+                return
+            
+            key_name = task['key_name']
+            allowance = RateLimiter.remaining(key_name)
+            if allowance <= 0:
+                raise Exception(f'Rate limit exceeded. Max {task_config.REQUEST_LIMIT} per {task_config.CLEANUP_TIME_MINUTES} min')
+            try:
+                urls = self.expand_playlist(task['url'], allowance + 1)
+            except Exception as e:
+                raise Exception(f'Could not expand playlist: {e}')
+            if not urls:
+                raise Exception('Playlist is empty')
+            
+            entries, new_tasks = [], {}
+            for url in urls[:allowance]:
+                entry_id = generate_task_id()
+                new_tasks[entry_id] = {**task['entry_task'], 'url': url}
+                entries.append({'url': url, 'task_id': entry_id})
+            # Workers pick the entries up from storage
+            Storage.add_tasks(new_tasks)
+            RateLimiter.record(key_name, len(new_tasks))
+            
+            result = {'tasks': entries}
+            if len(urls) > allowance:
+                # The rest of the playlist was dropped
+                result['truncated'] = True
+            self._finish_task(task_id, TaskStatus.COMPLETED, **result)
+        except Exception as e:
+            self._handle_error(task_id, e)
+    
+    @metrics.timed('download_info')
     def download_info(self, task_id: str):
         try:
-            tasks = Storage.load_tasks()
-            task = tasks[task_id]
-            self._update_task(task_id, status=TaskStatus.PROCESSING.value)
+            task = self._claim_task(task_id)
+            if task is None:
+                return
             
             download_path = self._get_task_dir(task_id)
             os.makedirs(download_path, exist_ok=True)
             
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': True,
-                'skip_download': True
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(task['url'], download=False)
+            with self.ydl_pool.acquire('info') as ydl:
+                info = ydl.process_ie_result(self.info_cache.get(task['url']), download=False)
+                info = ydl.sanitize_info(info)
             
-            info_file = os.path.join(download_path, 'info.json')
-            with open(info_file, 'w') as f:
-                json.dump(info, f)
+            info_index.write_info(os.path.join(download_path, 'info.json'), info)
             
-            self._update_task(
+            self._finish_task(
                 task_id,
-                status=TaskStatus.COMPLETED.value,
-                completed_time=datetime.now().isoformat(),
+                TaskStatus.COMPLETED,
                 file=f'/files/{task_id}/info.json'
             )
         except Exception as e:
             self._handle_error(task_id, e)
     
+    @metrics.timed('download_media')
     def download_media(self, task_id: str):
         try:
-            tasks = Storage.load_tasks()
-            task = tasks[task_id]
-            self._update_task(task_id, status=TaskStatus.PROCESSING.value)
+            task = self._claim_task(task_id)
+            if task is None:
+                return
             
             # Check memory quota
-            is_video = task['task_type'] in ['get_video', 'get_live_video']
-            total_size = self.estimate_size(
-                task['url'],
-                task.get('video_format') if is_video else None,
-                task.get('audio_format')
-            )
+            total_size = self.estimate_size(task)
             
-            if total_size <= 0:
-                raise Exception("Could not estimate file size")
-            
-            keys = Storage.load_keys()
-            api_key = keys[task['key_name']]['key']
-            memory_manager.check_and_update_quota(api_key, total_size, task_id)
+            key_info = Storage.get_key(task['key_name'])
+            if key_info is None:
+                raise Exception("Invalid API key")
+            # Without an estimate the reservation starts empty and grows with the download
+            self.tiers.ensure_room(max(total_size, 0))
+            memory_manager.reserve(task['key_name'], key_info, max(total_size, 0), task_id)
             
             # Prepare download
             download_path = self._get_task_dir(task_id)
@@ -142,30 +266,280 @@ class YTDownloader:
             
             # Configure yt-dlp
             ydl_opts = self._build_ydl_options(task, download_path)
+            info = self.info_cache.get(task['url'])
+            progress = self._prepare_resume(task_id, task, download_path, ydl_opts['format'])
+            
+            # Reuse or join an identical download if there is one
+            if task_config.DEDUPLICATE_DOWNLOADS:
+                content_key = ContentStore.make_key(info, task, ydl_opts['format'])
+                if content_key:
+                    self._update_task(task_id, content_key=content_key)
+                    claim = content_store.claim(
+                        content_key, download_path,
+                        lambda path: self._on_shared_content(task_id, path)
+                    )
+                    if claim == ContentStore.LINKED:
+                        self._complete_media(task_id, download_path)
+                        return
+                    if claim == ContentStore.ATTACHED:
+                        progress_tracker.update(task_id, force_persist=True, stage='waiting_for_shared_download')
+                        return
+                    self._leading[task_id] = content_key
             
-            # Download
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([task['url']])
+            # Download, reusing the extraction done for the size estimate
+            transfer, acceleration_opts = accelerator.start(task_id, task, key_info)
+            transfer.resumed = progress.resumed_bytes
+            self._transfers[task_id] = transfer
+            hooks = {
+                'progress_hooks': [self._download_hook(task_id, task['key_name'], key_info, transfer, progress)],
+                'postprocessor_hooks': [lambda status: progress_tracker.on_postprocess(task_id, status)]
+            }
+            try:
+                with self.ydl_pool.acquire('download', **hooks, **ydl_opts, **acceleration_opts) as ydl:
+                    ydl.process_ie_result(info, download=True)
+            finally:
+                accelerator.finish(transfer)
+            metrics.DOWNLOAD_BYTES.inc(disk_usage.task_usage(task_id)[0])
             
-            # Handle GIF conversion manually if needed
-            if task.get('output_format', '').lower() == 'gif':
-                self._convert_to_gif(download_path, task['task_type'])
+            if task_id in self._cancelled:
+                raise DownloadCancelled("Task was cancelled")
             
-            # Update task
-            files = os.listdir(download_path)
-            if files:
-                self._update_task(
-                    task_id,
-                    status=TaskStatus.COMPLETED.value,
-                    completed_time=datetime.now().isoformat(),
-                    file=f'/files/{task_id}/{files[0]}'
-                )
+            # Hand GIF conversion to the post-processing pool to free the download slot
+            if (task.get('output_format') or '').lower() == 'gif':
+                self.pools['postprocess'].submit(task_id, self.postprocess_media, force=True)
+                return
+            
+            self._complete_media(task_id, download_path)
         except Exception as e:
             self._handle_error(task_id, e)
     
-    def _convert_to_gif(self, download_path: str, task_type: str):
-        import subprocess
+    def record_live(self, task_id: str):
+        """Starts a segmented live recording and returns; the recorder runs it from there."""
+        try:
+            if not self.recorder.room():
+                # Stays waiting until a recording ends
+                return
+            task = self._claim_task(task_id)
+            if task is None:
+                return
+            
+            key_info = Storage.get_key(task['key_name'])
+            if key_info is None:
+                raise Exception("Invalid API key")
+            
+            # Only the retention window is ever on disk
+            window = task_config.LIVE_WINDOW_SECONDS if task.get('window') is None else task['window']
+            span = min(filter(None, [task.get('duration'), window]), default=None)
+            format_option, _ = self._format_option(task)
+            total_size = self.estimator.estimate(task['url'], format_option, 0.0, span) if span else -1
+            self.tiers.ensure_room(max(total_size, 0))
+            memory_manager.reserve(task['key_name'], key_info, max(total_size, 0), task_id)
+            
+            download_path = self._get_task_dir(task_id)
+            os.makedirs(download_path, exist_ok=True)
+            info = self.info_cache.get(task['url'])
+            with self.ydl_pool.acquire('download', format=format_option) as ydl:
+                selected = ydl.process_ie_result(info, download=False)
+            inputs = selected.get('requested_formats') or [selected]
+            for fmt in inputs:
+                if fmt.get('protocol') not in live.PROTOCOLS:
+                    raise Exception(f"Segmented recording needs an HLS or HTTP stream, not {fmt.get('protocol')}")
+            
+            # A retried recording ends when the first attempt would have
+            started = task.get('live_started') or time.time()
+            if not task.get('live_started'):
+                self._update_task(task_id, live_started=started)
+            seconds = None
+            if task.get('duration'):
+                seconds = started + task['duration'] - time.time()
+                if seconds <= 0:
+                    self._complete_recording(task_id, download_path)
+                    return
+            
+            cmd = live.build_command(inputs, download_path, task['task_type'] == TaskType.GET_LIVE_AUDIO.value,
+                                     seconds, window)
+            self._recording_keys[task_id] = (task['key_name'], key_info)
+            self.recorder.start(task_id, cmd, download_path)
+            progress_tracker.update(task_id, force_persist=True, stage='recording',
+                                    playlist=f'/files/{task_id}/{live.PLAYLIST_NAME}', segments=0, downloaded_bytes=0)
+        except Exception as e:
+            self._recording_keys.pop(task_id, None)
+            self._handle_error(task_id, e)
+    
+    def _on_recording_progress(self, task_id: str, stats: dict):
+        keys = self._recording_keys.get(task_id)
+        if keys is None:
+            return
+        key_name, key_info = keys
+        try:
+            # The folder counts as one file whose size is that of its segments
+            self._enforce_reservation(task_id, key_name, key_info,
+                                      {'filename': self._get_task_dir(task_id), 'downloaded_bytes': stats['bytes']})
+        except DownloadCancelled as e:
+            self.recorder.stop(task_id, error=str(e))
+        progress_tracker.update(task_id, segments=stats['segments'], downloaded_bytes=stats['bytes'])
+    
+    def _on_recording_exit(self, task_id: str, error: Optional[str], stopped: bool):
+        self._recording_keys.pop(task_id, None)
+        if task_id in self._cancelled:
+            self._handle_error(task_id, DownloadCancelled("Task was cancelled"))
+        elif error is not None:
+            self._handle_error(task_id, Exception(error))
+        elif stopped and self._draining:
+            # Continued by the next worker, which appends to the playlist
+            memory_manager.settle(task_id, self._get_task_dir(task_id))
+            progress_tracker.finish(task_id)
+            if self._release_task(task_id):
+                print(f"Recording {task_id} stopped for shutdown, re-queued")
+        else:
+            self._complete_recording(task_id, self._get_task_dir(task_id))
+    
+    def _complete_recording(self, task_id: str, download_path: str):
+        if not os.path.exists(os.path.join(download_path, live.PLAYLIST_NAME)):
+            self._handle_error(task_id, Exception("Nothing was recorded"))
+            return
+        self._finish_task(task_id, TaskStatus.COMPLETED, file=f'/files/{task_id}/{live.PLAYLIST_NAME}')
+    
+    def postprocess_media(self, task_id: str):
+        try:
+            if task_id in self._cancelled:
+                raise FFmpegCancelled("Task was cancelled")
+            task = Storage.get_task(task_id)
+            download_path = self._get_task_dir(task_id)
+            progress_tracker.update(task_id, force_persist=True, stage='postprocessing', percent=0.0)
+            self._convert_to_gif(download_path, task['task_type'], task_id)
+            self._complete_media(task_id, download_path)
+        except Exception as e:
+            self._handle_error(task_id, e)
+    
+    def cancel_task(self, task_id: str) -> bool:
+        if Storage.transition_task(task_id, TaskStatus.WAITING.value, TaskStatus.ERROR.value,
+                                   error='Task was cancelled', completed_time=datetime.now().isoformat()):
+            self._schedule_cleanup(task_id, datetime.now())
+            return True
+        
+        task = Storage.get_task(task_id)
+        if task is None or task['status'] != TaskStatus.PROCESSING.value:
+            return False
+        
+        if task_id in self._leases:
+            self._cancel_local(task_id)
+        else:
+            # Running in another process; its heartbeat picks this up
+            self._update_task(task_id, cancel_requested=True)
+        return True
+    
+    def _cancel_local(self, task_id: str):
+        self._cancelled.add(task_id)
+        job = self._ffmpeg_jobs.get(task_id)
+        if job:
+            job.cancel()
+        self.recorder.stop(task_id)
+    
+    def _prepare_resume(self, task_id: str, task: dict, download_path: str, format_spec: str) -> Checkpoint:
+        """Keeps what an interrupted attempt downloaded if it can be continued.
+
+        yt-dlp continues the `.part` files and fragment indexes it finds, so
+        the folder is only emptied when it holds something else: another
+        format, a live recording, or files without a checkpoint.
+        """
+        resumable = task_config.RESUMABLE_DOWNLOADS and 'live' not in task['task_type']
+        previous = checkpoint.load(download_path) if resumable else None
+        resumed = 0
+        if previous is None or previous.get('format') != format_spec:
+            previous = None
+            if os.listdir(download_path):
+                shutil.rmtree(download_path, ignore_errors=True)
+                os.makedirs(download_path, exist_ok=True)
+        else:
+            resumed = sum(
+                os.path.getsize(os.path.join(download_path, name))
+                for name in os.listdir(download_path) if not name.startswith('.')
+            )
+            if resumed > previous.get('resumed_bytes', 0):
+                # The last attempt moved the download forward, so it does not count towards MAX_TASK_ATTEMPTS
+                task['attempts'] = max(task.get('attempts', 1) - 1, 1)
+                self._update_task(task_id, attempts=task['attempts'])
+        
+        progress = Checkpoint(download_path, format_spec, task.get('attempts', 1), resumed, previous)
+        if progress.resumed_bytes:
+            progress_tracker.update(task_id, force_persist=True, stage='resuming', resumed_bytes=progress.resumed_bytes)
+        return progress
+    
+    def _output_files(self, download_path: str) -> List[str]:
+        """Finished files in a task folder, without yt-dlp's leftovers and the checkpoint."""
+        return [
+            name for name in os.listdir(download_path)
+            if not name.startswith('.') and '-Frag' not in name and not name.endswith(('.part', '.ytdl', '.tmp'))
+        ]
+    
+    def _complete_media(self, task_id: str, download_path: str):
+        checkpoint.remove(download_path)
+        files = self._output_files(download_path)
+        if files:
+            content_key = self._leading.pop(task_id, None)
+            if content_key:
+                content_store.publish(content_key, os.path.join(download_path, files[0]))
+            self._finish_task(
+                task_id,
+                TaskStatus.COMPLETED,
+                file=f'/files/{task_id}/{files[0]}'
+            )
+        else:
+            # Finish the task so its lease and reservation are released
+            self._handle_error(task_id, Exception("No output files"))
+    
+    def _download_hook(self, task_id: str, key_name: str, key_info: dict, transfer: Transfer,
+                       progress: Checkpoint):
+        def hook(status: dict):
+            if task_id in self._cancelled:
+                raise DownloadCancelled("Task was cancelled")
+            progress.record(status)
+            self._enforce_reservation(task_id, key_name, key_info, status)
+            transfer.record(disk_usage.task_usage(task_id)[0])
+            accelerator.observe(transfer, status)
+            progress_tracker.on_download(task_id, status, throughput=transfer.throughput,
+                                         connections=transfer.connections)
+        return hook
+    
+    def _enforce_reservation(self, task_id: str, key_name: str, key_info: dict, status: dict):
+        if not status.get('filename'):
+            return
+        actual = disk_usage.record_progress(task_id, status['filename'], status.get('downloaded_bytes') or 0)
+        _, reserved = disk_usage.task_usage(task_id)
+        if actual <= reserved:
+            return
+        # Grow with some headroom; abort if the quota or the disk cap cannot take it
+        try:
+            memory_manager.reserve(key_name, key_info, int(actual * memory.SIZE_BUFFER), task_id)
+        except Exception as e:
+            raise DownloadCancelled(f"Download exceeded its reservation. {e}")
+    
+    def _on_shared_content(self, task_id: str, path: Optional[str]):
+        if path:
+            self._complete_media(task_id, self._get_task_dir(task_id))
+            return
         
+        # The shared download failed; run this task on its own
+        task = self._release_task(task_id)
+        if task:
+            self.submit_task(task_id, task, force=True)
+    
+    def _release_task(self, task_id: str) -> Optional[dict]:
+        """Gives up the lease of a running task and puts it back in the queue."""
+        self._leases.discard(task_id)
+        task = Storage.get_task(task_id)
+        if task is None:
+            return None
+        # Not the task's fault, so it does not count as an attempt
+        fields = {'lease_owner': None, 'lease_expires': None, 'attempts': max(task.get('attempts', 1) - 1, 0)}
+        if not Storage.transition_task(task_id, TaskStatus.PROCESSING.value, TaskStatus.WAITING.value, **fields):
+            return None
+        task.update(fields, status=TaskStatus.WAITING.value)
+        return task
+    
+    @metrics.timed('convert_to_gif')
+    def _convert_to_gif(self, download_path: str, task_type: str, task_id: str):
         is_live = 'live' in task_type
         
         for file in os.listdir(download_path):
@@ -181,32 +555,68 @@ class YTDownloader:
                     '-y'
                 ]
                 
+                report = lambda percent: progress_tracker.update(task_id, percent=round(percent, 1))
+                job = FFmpegJob(cmd, timeout=task_config.FFMPEG_TIMEOUT_SECONDS, on_progress=report)
+                self._ffmpeg_jobs[task_id] = job
                 try:
-                    subprocess.run(cmd, check=True, capture_output=True, text=True)
+                    job.run()
                     # Remove original file after successful conversion
                     os.remove(input_file)
-                except subprocess.CalledProcessError as e:
-                    raise Exception(f"Failed to convert to GIF: {e.stderr}")
+                except FFmpegCancelled:
+                    raise
+                except FFmpegError as e:
+                    if os.path.exists(output_file):
+                        os.remove(output_file)
+                    raise Exception(f"Failed to convert to GIF: {e}")
+                finally:
+                    self._ffmpeg_jobs.pop(task_id, None)
                 break
     
-    def _build_ydl_options(self, task: dict, download_path: str) -> dict:
+    def _format_option(self, task: dict) -> Tuple[str, str]:
+        """Returns the yt-dlp format spec and output template of a task."""
         is_video = task['task_type'] in ['get_video', 'get_live_video']
         is_live = 'live' in task['task_type']
-        output_format = task.get('output_format')
         
-        if is_video:
+        if is_video and task.get('stream') and not is_live:
+            # A merged download is only readable once muxing has finished
+            format_option = "best*[vcodec!=none][acodec!=none]/best"
+            output_name = 'video.%(ext)s'
+        elif is_video:
             format_option = f"{task.get('video_format', 'bestvideo')}+{task.get('audio_format', 'bestaudio')}/best"
             output_name = 'live_video.%(ext)s' if is_live else 'video.%(ext)s'
         else:
             format_option = f"{task.get('audio_format', 'bestaudio')}/best"
             output_name = 'live_audio.%(ext)s' if is_live else 'audio.%(ext)s'
+        return format_option, output_name
+    
+    def _time_range(self, task: dict) -> Tuple[Optional[float], Optional[float]]:
+        """Returns the seconds of the video a task covers as (start, end); None is open.
+
+        Live recordings count from when they start, so only their length matters.
+        """
+        if 'live' in task['task_type']:
+            return (0.0, float(task['duration'])) if task.get('duration') else (None, None)
+        if task.get('start_time') or task.get('end_time'):
+            return (self._time_to_seconds(task.get('start_time', '00:00:00')),
+                    self._time_to_seconds(task.get('end_time', '10:00:00')))
+        return None, None
+    
+    def _build_ydl_options(self, task: dict, download_path: str) -> dict:
+        is_live = 'live' in task['task_type']
+        output_format = task.get('output_format')
+        format_option, output_name = self._format_option(task)
         
         opts = {
             'format': format_option,
             'outtmpl': os.path.join(download_path, output_name),
-            'extractor_args': { 'youtube': { 'player_client': ['default', '-tv_simply'], }, },
         }
         
+        # Streamed files are served as written, so skip steps that rewrite them
+        if task.get('stream'):
+            opts['hls_use_mpegts'] = True
+            opts['fixup'] = 'never'
+            output_format = None
+        
         # Handle output format (but not GIF - we'll do that manually)
         if output_format and output_format.lower() != 'gif':
             opts['merge_output_format'] = output_format
@@ -222,8 +632,7 @@ class YTDownloader:
             opts['download_ranges'] = lambda *_: [{'start_time': start_time, 'end_time': end_time}]
         
         elif task.get('start_time') or task.get('end_time'):
-            start = self._time_to_seconds(task.get('start_time', '00:00:00'))
-            end = self._time_to_seconds(task.get('end_time', '10:00:00'))
+            start, end = self._time_range(task)
             opts['download_ranges'] = download_range_func(None, [(start, end)])
             opts['force_keyframes_at_cuts'] = task.get('force_keyframes', False)
         
@@ -263,66 +672,243 @@ class YTDownloader:
             return 0.0
     
     def cleanup_task(self, task_id: str):
-        task_dir = self._get_task_dir(task_id)
-        if os.path.exists(task_dir):
-            shutil.rmtree(task_dir, ignore_errors=True)
+        task = Storage.get_task(task_id)
+        for task_dir in tiering.task_dirs(task_id):
+            if os.path.exists(task_dir):
+                shutil.rmtree(task_dir, ignore_errors=True)
         
-        tasks = Storage.load_tasks()
-        if task_id in tasks:
-            del tasks[task_id]
-            Storage.save_tasks(tasks)
+        Storage.delete_task(task_id)
+        progress_tracker.forget(task_id)
+        disk_usage.remove(task_id)
+        if task and task.get('content_key'):
+            content_store.release(task['content_key'])
     
-    def process_tasks(self):
-        while True:
-            tasks = Storage.load_tasks()
-            current_time = datetime.now()
-            
-            for task_id, task_data in list(tasks.items()):
-                if task_data['status'] == TaskStatus.WAITING.value:
-                    self._submit_task(task_id, task_data)
-                
-                elif task_data['status'] in [TaskStatus.COMPLETED.value, TaskStatus.ERROR.value]:
-                    if 'completed_time' in task_data:
-                        completed = datetime.fromisoformat(task_data['completed_time'])
-                        if current_time - completed > timedelta(minutes=task_config.CLEANUP_TIME_MINUTES):
-                            self.cleanup_task(task_id)
-            
-            # Cleanup orphaned folders every 5 minutes
-            if current_time.minute % 5 == 0 and current_time.second == 0:
-                self._cleanup_orphaned_folders()
-            
-            time.sleep(1)
+    def _pool_for(self, task_type: str) -> WorkerPool:
+        if task_type in [TaskType.GET_INFO.value, TaskType.EXPAND_PLAYLIST.value]:
+            return self.pools['metadata']
+        if task_type in [TaskType.GET_LIVE_VIDEO.value, TaskType.GET_LIVE_AUDIO.value]:
+            return self.pools['live']
+        return self.pools['download']
+    
+    def _admit(self, pool: WorkerPool) -> None:
+        """Bounds the tasks waiting in storage for worker processes like `pool` bounds its queue."""
+        task_types = [task_type.value for task_type in TaskType if self._pool_for(task_type.value) is pool]
+        # The task being submitted is stored already
+        waiting = Storage.count_tasks(status=TaskStatus.WAITING.value, task_types=task_types)
+        if waiting > pool.max_queue_size:
+            metrics.POOL_REJECTED.inc(pool=pool.name)
+            raise QueueFullError(f"{pool.name} queue is full ({pool.max_queue_size} tasks)")
     
-    def _submit_task(self, task_id: str, task_data: dict):
+    def submit_task(self, task_id: str, task_data: dict, force: bool = False) -> bool:
         task_type = task_data['task_type']
+        pool = self._pool_for(task_type)
+        if not self.runs_workers:
+            if not force:
+                self._admit(pool)
+            # Worker processes pick the task up from storage
+            return True
         
+        priority = self.PRIORITIES[task_type]
         if task_type == TaskType.GET_INFO.value:
-            self.executor.submit(self.download_info, task_id)
+            return pool.submit(task_id, self.download_info, priority=priority, force=force)
+        if task_type == TaskType.EXPAND_PLAYLIST.value:
+            return pool.submit(task_id, self.expand_task, priority=priority, force=force)
+        if task_data.get('segmented'):
+            return pool.submit(task_id, self.record_live, priority=priority, force=force)
+        return pool.submit(task_id, self.download_media, priority=priority, force=force)
+    
+    def pool_stats(self) -> dict:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+    
+    def _schedule_cleanup(self, task_id: str, completed_time: datetime):
+        expires = completed_time + timedelta(minutes=task_config.CLEANUP_TIME_MINUTES)
+        self.timers.call_at(expires.timestamp(), self._expire_task, task_id)
+    
+    def _expire_task(self, task_id: str):
+        task_data = Storage.get_task(task_id)
+        if task_data is None:
+            # Cleaned up by another process
+            disk_usage.remove(task_id)
+            return
+        if task_data['status'] not in [TaskStatus.COMPLETED.value, TaskStatus.ERROR.value]:
+            return
+        if task_data['status'] == TaskStatus.COMPLETED.value and tiering_config.EVICTION:
+            # Kept until the tier manager evicts it
+            return
+        
+        completed = datetime.fromisoformat(task_data['completed_time'])
+        if datetime.now() - completed >= timedelta(minutes=task_config.CLEANUP_TIME_MINUTES):
+            self.cleanup_task(task_id)
         else:
-            self.executor.submit(self.download_media, task_id)
+            self._schedule_cleanup(task_id, completed)
+    
+    def _cleanup_orphaned_folders_periodically(self):
+        try:
+            self._cleanup_orphaned_folders()
+        finally:
+            self.timers.call_later(task_config.ORPHAN_CLEANUP_MINUTES * 60,
+                                   self._cleanup_orphaned_folders_periodically)
     
     def _cleanup_orphaned_folders(self):
-        tasks = Storage.load_tasks()
-        task_ids = set(tasks.keys())
+        folders = [
+            folder for folder in os.listdir(storage.DOWNLOAD_DIR)
+            if folder != storage.BLOB_DIR and os.path.isdir(os.path.join(storage.DOWNLOAD_DIR, folder))
+        ]
+        task_ids = set(Storage.get_tasks(folders))
         
-        for folder in os.listdir(storage.DOWNLOAD_DIR):
-            folder_path = os.path.join(storage.DOWNLOAD_DIR, folder)
-            if os.path.isdir(folder_path) and folder not in task_ids:
-                shutil.rmtree(folder_path, ignore_errors=True)
+        for folder in folders:
+            path = os.path.join(storage.DOWNLOAD_DIR, folder)
+            # A recently checkpointed download may still be resumed, e.g. by another node sharing the folder
+            if folder not in task_ids and not checkpoint.is_fresh(path, task_config.RESUME_KEEP_MINUTES * 60):
+                shutil.rmtree(path, ignore_errors=True)
+        
+        cold_dir = tiering.cold_dir()
+        if cold_dir and os.path.isdir(cold_dir):
+            # Folders still being copied end in .tmp
+            folders = [folder for folder in os.listdir(cold_dir) if not folder.endswith('.tmp')]
+            task_ids = set(Storage.get_tasks(folders))
+            for folder in folders:
+                if folder not in task_ids:
+                    shutil.rmtree(os.path.join(cold_dir, folder), ignore_errors=True)
+        
+        content_store.collect()
+    
+    def _evict_periodically(self):
+        try:
+            self.tiers.sweep()
+        finally:
+            self.timers.call_later(tiering_config.EVICTION_CHECK_SECONDS, self._evict_periodically)
+    
+    def _renew_leases(self):
+        expires = time.time() + node_config.LEASE_SECONDS
+        for task_id in list(self._leases):
+            task = Storage.renew_lease(task_id, self.worker_id, expires)
+            if task_id not in self._leases:
+                continue
+            if task is None:
+                # Another worker re-queued the task after our lease ran out
+                print(f"Lost the lease of task {task_id}")
+                self._leases.discard(task_id)
+                self._cancel_local(task_id)
+            elif task.get('cancel_requested'):
+                self._cancel_local(task_id)
+    
+    def _recover_local_leases(self):
+        """Expires the leases of earlier processes on this node right away.
+        
+        Their owner is known to be gone, so the tasks are re-queued (and
+        resumed) at startup instead of after LEASE_SECONDS.
+        """
+        prefix = f'{node_config.NODE_ID}:'
+        for task_id, task in Storage.find_tasks(status=TaskStatus.PROCESSING.value).items():
+            owner = task.get('lease_owner') or ''
+            if owner.startswith(prefix) and (owner == self.worker_id or not _process_alive(owner[len(prefix):])):
+                Storage.update_task(task_id, lease_expires=0)
+    
+    def _expire_leases(self):
+        expired = Storage.expire_leases(time.time(), node_config.MAX_TASK_ATTEMPTS, datetime.now().isoformat())
+        for task_id, task in expired.items():
+            print(f"Lease of task {task_id} expired, task is now {task['status']}")
+            if task['status'] == TaskStatus.ERROR.value:
+                self._schedule_cleanup(task_id, datetime.fromisoformat(task['completed_time']))
+            elif not self._polls_queue:
+                self.submit_task(task_id, task, force=True)
+    
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(node_config.HEARTBEAT_SECONDS)
+            try:
+                self._renew_leases()
+                self._expire_leases()
+            except Exception as e:
+                print(f"Error in lease heartbeat: {e}")
+    
+    def _feed_pools(self):
+        """Pulls waiting tasks from storage into pools that have idle workers."""
+        types_by_pool: Dict[str, List[str]] = {}
+        for task_type in TaskType:
+            types_by_pool.setdefault(self._pool_for(task_type.value).name, []).append(task_type.value)
+        
+        for name, task_types in types_by_pool.items():
+            stats = self.pools[name].stats()
+            idle = stats['workers'] - stats['running'] - stats['queued']
+            if name == 'live':
+                # Recordings hold no worker, only a recorder slot
+                idle = min(idle, self.recorder.room())
+            if idle <= 0:
+                continue
+            for task_id, task_data in Storage.find_waiting(task_types, idle + stats['queued']).items():
+                self.submit_task(task_id, task_data, force=True)
+    
+    def _feed_loop(self):
+        while not self._draining:
+            try:
+                self._feed_pools()
+            except Exception as e:
+                print(f"Error polling the task queue: {e}")
+            time.sleep(node_config.QUEUE_POLL_SECONDS)
     
     def initialize(self):
-        # Fix interrupted tasks
-        tasks = Storage.load_tasks()
-        for task_id, task_data in tasks.items():
-            if task_data['status'] == TaskStatus.PROCESSING.value:
-                task_data['status'] = TaskStatus.ERROR.value
-                task_data['error'] = 'Task was interrupted'
-                task_data['completed_time'] = datetime.now().isoformat()
-        Storage.save_tasks(tasks)
+        self.timers.start()
+        if not self.runs_workers:
+            return
+        
+        # Tasks of workers that stopped are re-queued once their lease runs out
+        self._recover_local_leases()
+        self._expire_leases()
+        if not self._polls_queue:
+            # Left waiting by an earlier process; nothing else feeds them to this one
+            for task_id, task_data in Storage.find_tasks(status=TaskStatus.WAITING.value).items():
+                self.submit_task(task_id, task_data, force=True)
         
-        # Start processing thread
-        thread = threading.Thread(target=self.process_tasks, daemon=True)
-        thread.start()
+        # Schedule cleanup of finished tasks; folders on other nodes go with their orphan sweep
+        finished = Storage.find_tasks(status=[TaskStatus.COMPLETED.value, TaskStatus.ERROR.value])
+        for task_id, task_data in finished.items():
+            disk_usage.reconcile(task_id, self._get_task_dir(task_id), task_data.get('key_name'))
+            self._schedule_cleanup(task_id, datetime.fromisoformat(task_data['completed_time']))
+        
+        self.timers.call_later(task_config.ORPHAN_CLEANUP_MINUTES * 60,
+                               self._cleanup_orphaned_folders_periodically)
+        self.timers.call_later(tiering_config.EVICTION_CHECK_SECONDS, self._evict_periodically)
+        
+        # Start workers
+        for pool in self.pools.values():
+            pool.start()
+        threading.Thread(target=self._heartbeat_loop, name='lease-heartbeat', daemon=True).start()
+        if self._polls_queue:
+            threading.Thread(target=self._feed_loop, name='queue-feeder', daemon=True).start()
+    
+    def shutdown(self, timeout: float):
+        """Stops taking tasks and lets running ones finish for up to `timeout` seconds.
+        
+        Tasks still running at the deadline are put back in the queue for
+        another worker, which resumes them from their checkpoint.
+        """
+        self._draining = True
+        for name in ['metadata', 'download', 'live']:
+            self.pools[name].close()
+        # Recordings never finish by themselves within the drain timeout
+        self.recorder.stop_all()
+        
+        deadline = time.monotonic() + timeout
+        while self._leases and time.monotonic() < deadline:
+            time.sleep(0.5)
+        
+        self.pools['postprocess'].close()
+        for task_id in list(self._leases):
+            if self._release_task(task_id):
+                print(f"Task {task_id} did not finish before shutdown, re-queued")
+            self._cancel_local(task_id)
+
+def _process_alive(pid: str) -> bool:
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, PermissionError):
+        # Not a pid we can check, so assume the owner is still there
+        return True
+    except ProcessLookupError:
+        return False
+    return True
 
 # Initialize downloader
 downloader = YTDownloader()
@@ -0,0 +1,93 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ydl_pool import YDLPool
+from config import acceleration as acceleration_config
+
+SEGMENTS = 8
+SEGMENT = b'\x47' + bytes(188 * 64 - 1)
+
+class _HlsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/index.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:1', '#EXT-X-MEDIA-SEQUENCE:0']
+            for i in range(SEGMENTS):
+                lines += ['#EXTINF:1.0,', f'segment{i}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            body, content_type = ('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl'
+        elif self.path.startswith('/segment'):
+            body, content_type = SEGMENT, 'video/mp2t'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class ConcurrentFragmentsTest(unittest.TestCase):
+    """The default profile downloads fragments in parallel through the pool."""
+
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _HlsHandler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_default_profile_reports_progress_from_fragment_threads(self):
+        fragments = acceleration_config.PROFILES[acceleration_config.DEFAULT_PROFILE]['fragments']
+        self.assertGreater(fragments, 1)
+
+        info = {
+            'id': 'hls',
+            'title': 'hls',
+            'extractor': 'test',
+            'extractor_key': 'Test',
+            'webpage_url': f'http://127.0.0.1:{self.httpd.server_port}/',
+            'formats': [{
+                'format_id': 'hls',
+                'url': f'http://127.0.0.1:{self.httpd.server_port}/index.m3u8',
+                'protocol': 'm3u8_native',
+                'ext': 'mp4',
+                'vcodec': 'h264',
+                'acodec': 'aac'
+            }]
+        }
+        statuses, threads = [], set()
+
+        def hook(status):
+            statuses.append(status)
+            threads.add(threading.get_ident())
+
+        pool = YDLPool({'download': {'quiet': True, 'no_warnings': True, 'noprogress': True, 'fixup': 'never'}})
+        with pool.acquire('download', progress_hooks=[hook], format='best',
+                          outtmpl=os.path.join(self.workdir, 'video.%(ext)s'),
+                          concurrent_fragment_downloads=fragments) as ydl:
+            ydl.process_ie_result(info, download=True)
+
+        self.assertEqual(os.path.getsize(os.path.join(self.workdir, 'video.mp4')), SEGMENTS * len(SEGMENT))
+        self.assertEqual(statuses[-1]['status'], 'finished')
+        self.assertIn(threading.get_ident(), threads)
+        # Fragment threads reported progress as well
+        self.assertGreater(len(threads), 1)
+
+if __name__ == '__main__':
+    unittest.main()
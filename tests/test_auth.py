@@ -0,0 +1,100 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.storage import Storage, SQLiteStorageBackend, JsonStorageBackend
+from src.auth import KeyRegistry
+from src.usage import UsageTracker
+
+def _key(secret: str) -> dict:
+    return {'key': secret, 'name': secret, 'permissions': ['get_video'], 'memory_quota': 0, 'last_access': ''}
+
+class KeyRegistryTest(unittest.TestCase):
+    """Keys saved or deleted through another process apply on the next lookup."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        self.addCleanup(setattr, Storage, '_backend', Storage._backend)
+
+    def _check(self, backend, other):
+        Storage._backend = backend
+        registry = KeyRegistry()
+        other.save_key('old', _key('old-secret'))
+        self.assertEqual(registry.lookup('old-secret')[0], 'old')
+
+        # As the other gunicorn worker would
+        other.save_key('new', _key('new-secret'))
+        other.delete_key('old')
+        self.assertEqual(registry.lookup('new-secret')[0], 'new')
+        self.assertEqual(registry.lookup('old-secret'), (None, None))
+
+    def test_sqlite(self):
+        path = os.path.join(self.workdir, 'db.sqlite')
+        self._check(SQLiteStorageBackend(path), SQLiteStorageBackend(path))
+
+    def test_json(self):
+        paths = [os.path.join(self.workdir, name) for name in ('tasks.json', 'keys.json', 'usage.json')]
+        self._check(JsonStorageBackend(*paths), JsonStorageBackend(*paths))
+
+class UsageTrackerTest(unittest.TestCase):
+    """Every process counts against the same windows."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        self.addCleanup(setattr, Storage, '_backend', Storage._backend)
+
+    def _check(self, backend, other):
+        # One tracker per process, each with its own connection to storage
+        trackers = [UsageTracker(600, 600), UsageTracker(600, 600)]
+
+        def on(i):
+            Storage._backend = (backend, other)[i]
+            return trackers[i]
+
+        on(0).record_requests('k', 2)
+        on(1).record_requests('k')
+        self.assertEqual(on(0).request_count('k'), 3)
+
+        self.assertEqual(on(0).try_reserve_memory('k', 60, 't0', 100), (True, 0))
+        self.assertEqual(on(1).try_reserve_memory('k', 50, 't1', 100), (False, 60))
+        on(0).settle_memory('k', 't0', 30)
+        self.assertEqual(on(1).try_reserve_memory('k', 50, 't1', 100), (True, 30))
+        self.assertEqual(on(0).memory_usage('k'), 80)
+        self.assertEqual([entry['task_id'] for entry in on(1).memory_entries('k')], ['t0', 't1'])
+
+        on(1).forget('k')
+        self.assertEqual((on(0).request_count('k'), on(0).memory_usage('k')), (0, 0))
+
+        # The pruner drops the windows of keys deleted behind the registry's back
+        other.save_key('k', _key('k'))
+        on(0).record_requests('k')
+        on(0).record_requests('gone')
+        on(1).prune()
+        self.assertEqual((on(0).request_count('k'), on(0).request_count('gone')), (1, 0))
+
+    def test_sqlite(self):
+        path = os.path.join(self.workdir, 'db.sqlite')
+        self._check(SQLiteStorageBackend(path), SQLiteStorageBackend(path))
+
+    def test_json(self):
+        paths = [os.path.join(self.workdir, name) for name in ('tasks.json', 'keys.json', 'usage.json')]
+        self._check(JsonStorageBackend(*paths), JsonStorageBackend(*paths))
+
+    def test_sqlite_takes_over_the_usage_file(self):
+        usage_file = os.path.join(self.workdir, 'usage.json')
+        with open(usage_file, 'w') as f:
+            json.dump({'requests': {'k': [[time.time(), 4]]}, 'memory': {'k': [[time.time(), 70, 't0']]}}, f)
+        Storage._backend = SQLiteStorageBackend(os.path.join(self.workdir, 'db.sqlite'), usage_file=usage_file)
+        tracker = UsageTracker(600, 600)
+        self.assertEqual((tracker.request_count('k'), tracker.memory_usage('k')), (4, 70))
+
+if __name__ == '__main__':
+    unittest.main()
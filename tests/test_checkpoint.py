@@ -0,0 +1,54 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import checkpoint
+from src.checkpoint import Checkpoint
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+
+    def test_record_from_fragment_threads(self):
+        progress = Checkpoint(self.workdir, 'best', 1)
+        errors = []
+        start = threading.Barrier(8)
+
+        def fragments(thread: int):
+            try:
+                start.wait()
+                for i in range(300):
+                    # Every update is due, as if CHECKPOINT_SECONDS were 0
+                    progress.record({'status': 'finished', 'filename': f'video.f{thread}-Frag{i}',
+                                     'downloaded_bytes': i})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=fragments, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        saved = checkpoint.load(self.workdir)
+        self.assertEqual(saved['format'], 'best')
+        self.assertEqual(len(progress.state['files']), 8 * 300)
+        # No temporary files are left behind
+        self.assertEqual(os.listdir(self.workdir), [checkpoint.CHECKPOINT_NAME])
+
+    def test_failed_write_does_not_raise(self):
+        progress = Checkpoint(self.workdir, 'best', 1)
+        with mock.patch('os.replace', side_effect=OSError('disk full')), mock.patch('builtins.print'):
+            progress.record({'status': 'finished', 'filename': 'video.mp4', 'downloaded_bytes': 1})
+        self.assertEqual(os.listdir(self.workdir), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.storage import Storage, SQLiteStorageBackend, JsonStorageBackend
+from src.disk_usage import DiskUsageIndex
+
+class DiskUsageIndexTest(unittest.TestCase):
+    """The disk cap holds across processes."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        self.addCleanup(setattr, Storage, '_backend', Storage._backend)
+
+    def _task_dir(self, task_id: str, size: int = 0, link: str = None) -> str:
+        task_dir = os.path.join(self.workdir, task_id)
+        os.makedirs(task_dir)
+        path = os.path.join(task_dir, 'video.mp4')
+        if link:
+            os.link(link, path)
+        else:
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+        return task_dir
+
+    def _check(self, backend, other):
+        # One index per process, each with its own connection to storage
+        indexes = [DiskUsageIndex(), DiskUsageIndex()]
+
+        def on(i):
+            Storage._backend = (backend, other)[i]
+            return indexes[i]
+
+        self.assertEqual(on(0).try_reserve('t0', 'k', 60, 100), (True, 0))
+        self.assertEqual(on(1).try_reserve('t1', 'k', 50, 100), (False, 60))
+
+        # A finished task holds what it left on disk
+        t0 = self._task_dir('t0', 30)
+        self.assertEqual(on(0).reconcile('t0', t0), 30)
+        self.assertEqual(on(1).try_reserve('t1', 'k', 50, 100), (True, 30))
+        self.assertEqual(on(1).total(), 80)
+
+        # Hardlinked duplicates are charged once
+        t2 = self._task_dir('t2', link=os.path.join(t0, 'video.mp4'))
+        self.assertEqual(on(0).reconcile('t2', t2, 'k'), 30)
+        self.assertEqual(on(1).total(), 80)
+
+        # Another node's task has no folder here and keeps its entry
+        on(1).reconcile('t0', os.path.join(self.workdir, 'elsewhere'), 'k')
+        self.assertEqual(on(0).total(), 80)
+
+        # The duplicate takes over the file when the original goes
+        on(0).remove('t0')
+        self.assertEqual(on(1).total(), 80)
+
+        # Removed by a process that did not download it
+        on(1).remove('t2')
+        on(0).remove('t1')
+        self.assertEqual(on(0).total(), 0)
+
+    def test_sqlite(self):
+        path = os.path.join(self.workdir, 'db.sqlite')
+        self._check(SQLiteStorageBackend(path), SQLiteStorageBackend(path))
+
+    def test_json(self):
+        paths = [os.path.join(self.workdir, name) for name in ('tasks.json', 'keys.json', 'usage.json')]
+        self._check(JsonStorageBackend(*paths), JsonStorageBackend(*paths))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.file_server import send_file
+
+CONTENT = bytes(range(100))
+
+class SendFileTest(unittest.TestCase):
+    """Range and conditional requests against a 100 byte file."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        path = os.path.join(self.workdir, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(CONTENT)
+
+        app = Flask(__name__)
+        app.add_url_rule('/file', 'file', lambda: send_file(path, 'video.mp4'))
+        self.client = app.test_client()
+
+    def _get(self, **headers):
+        return self.client.get('/file', headers=headers)
+
+    def test_full(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT)
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+    def test_single_ranges(self):
+        for header, start, end in [('bytes=10-19', 10, 20), ('bytes=90-', 90, 100), ('bytes=95-200', 95, 100)]:
+            response = self._get(Range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response.data, CONTENT[start:end], header)
+            self.assertEqual(response.headers['Content-Range'], f'bytes {start}-{end - 1}/100', header)
+            self.assertEqual(response.headers['Content-Length'], str(end - start), header)
+
+    def test_suffix_ranges(self):
+        response = self._get(Range='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, CONTENT[90:])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 90-99/100')
+
+        # A suffix longer than the file is the whole file
+        response = self._get(Range='bytes=-500')
+        self.assertEqual(response.data, CONTENT)
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-99/100')
+
+    def test_multi_range(self):
+        response = self._get(Range='bytes=0-4,-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response.mimetype.startswith('multipart/byteranges'))
+        self.assertEqual(response.headers['Content-Length'], str(len(response.data)))
+
+        boundary = response.mimetype_params['boundary'].encode()
+        parts = response.data.split(b'--' + boundary)
+        self.assertEqual(parts[0], b'')
+        self.assertEqual(parts[-1], b'--\r\n')
+        bodies = [part.split(b'\r\n\r\n', 1) for part in parts[1:-1]]
+        self.assertIn(b'Content-Range: bytes 0-4/100', bodies[0][0])
+        self.assertIn(b'Content-Range: bytes 95-99/100', bodies[1][0])
+        # Every part ends with the CRLF before the next boundary
+        self.assertEqual([body for _, body in bodies], [CONTENT[:5] + b'\r\n', CONTENT[95:] + b'\r\n'])
+
+    def test_unsatisfiable(self):
+        response = self._get(Range='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */100')
+        self.assertEqual(response.data, b'')
+
+    def test_if_range(self):
+        etag = self._get().headers['ETag']
+        response = self._get(Range='bytes=0-9', **{'If-Range': etag})
+        self.assertEqual((response.status_code, response.data), (206, CONTENT[:10]))
+
+        # A stale validator gets the whole file
+        response = self._get(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual((response.status_code, response.data), (200, CONTENT))
+
+    def test_not_modified(self):
+        full = self._get()
+        response = self._get(**{'If-None-Match': full.headers['ETag']})
+        self.assertEqual((response.status_code, response.data), (304, b''))
+        self.assertEqual(response.headers['ETag'], full.headers['ETag'])
+
+        response = self._get(**{'If-Modified-Since': full.headers['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+        response = self._get(**{'If-None-Match': '"other"'})
+        self.assertEqual(response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
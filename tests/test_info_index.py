@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.info_index import extract_qualities, write_info
+
+# Fields yt-dlp leaves out or sets to null on many extractors
+SPARSE_FORMATS = [
+    {'format_id': 'a1', 'acodec': 'opus', 'vcodec': 'none', 'abr': 129.5, 'audio_channels': None},
+    {'format_id': 'a0', 'acodec': 'mp4a', 'vcodec': 'none', 'abr': 48, 'language': 'en', 'audio_channels': 2},
+    {'format_id': 'v1', 'vcodec': 'avc1', 'acodec': 'none', 'height': 720, 'fps': 30.0, 'filesize': None},
+    {'format_id': 'v0', 'vcodec': 'vp9', 'acodec': 'none', 'height': 360, 'width': 640, 'fps': 25},
+    {'format_id': 'sb', 'format_note': 'storyboard', 'vcodec': 'none', 'acodec': 'none'}
+]
+
+class ExtractQualitiesTest(unittest.TestCase):
+    def test_missing_and_null_fields(self):
+        qualities = extract_qualities({'formats': SPARSE_FORMATS})
+        self.assertEqual(list(qualities['audio']), ['a0', 'a1'])
+        self.assertEqual(qualities['audio']['a1'], {
+            'abr': 129, 'acodec': 'opus', 'audio_channels': 0, 'language': None, 'filesize': 0
+        })
+        self.assertEqual(list(qualities['video']), ['v0', 'v1'])
+        self.assertIsNone(qualities['video']['v1']['width'])
+        self.assertEqual(qualities['video']['v1']['filesize'], 0)
+
+    def test_no_formats(self):
+        self.assertEqual(extract_qualities({'formats': None}), {'audio': {}, 'video': {}})
+
+class WriteInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_sparse_formats_are_indexed(self):
+        info_path = os.path.join(self.workdir, 'info.json')
+        info = {'id': 'x', 'title': 'x', 'formats': SPARSE_FORMATS}
+        index = write_info(info_path, info)
+        with open(info_path) as f:
+            self.assertEqual(json.load(f), info)
+        self.assertEqual(set(index['qualities']['audio']), {'a0', 'a1'})
+        self.assertEqual(index['scalars'], {'id': 'x', 'title': 'x'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.storage import Storage, SQLiteStorageBackend
+from src.progress import ProgressTracker, TaskWatcher
+
+class CountingBackend:
+    def __init__(self, backend):
+        self.backend = backend
+        self.reads = 0
+
+    def __getattr__(self, name):
+        if name in ('get_task', 'get_tasks'):
+            self.reads += 1
+        return getattr(self.backend, name)
+
+class TaskWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        self.addCleanup(setattr, Storage, '_backend', Storage._backend)
+        self.storage = CountingBackend(SQLiteStorageBackend(os.path.join(self.workdir, 'db.sqlite')))
+        Storage._backend = self.storage
+        self.tracker = ProgressTracker()
+        self.watcher = TaskWatcher(self.tracker)
+        # Refreshed by the test instead
+        self.watcher._thread = threading.current_thread()
+
+    def test_subscribers_share_one_read(self):
+        for i in range(3):
+            self.storage.add_task(f't{i}', {'status': 'processing'})
+        for _ in range(10):
+            for i in range(3):
+                self.watcher.watch(f't{i}')
+        reads = self.storage.reads
+        self.watcher.refresh()
+        self.assertEqual(self.storage.reads, reads + 1)
+
+    def test_changes_wake_subscribers(self):
+        self.storage.add_task('t', {'status': 'processing'})
+        self.watcher.watch('t')
+        version = self.tracker.version('t')
+        self.watcher.refresh()
+        self.assertEqual(self.tracker.wait('t', version, 0), (version, False))
+
+        self.storage.update_task('t', status='completed')
+        self.watcher.refresh()
+        self.assertTrue(self.tracker.wait('t', version, 0)[1])
+        self.assertEqual(self.watcher.get('t')['status'], 'completed')
+
+    def test_unwatched_tasks_are_dropped(self):
+        self.storage.add_task('t', {'status': 'processing'})
+        self.watcher.watch('t')
+        self.watcher.watch('t')
+        self.watcher.unwatch('t')
+        self.assertIsNotNone(self.watcher.get('t'))
+        self.watcher.unwatch('t')
+        self.assertIsNone(self.watcher.get('t'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.scheduler import WorkerPool, QueueFullError
+
+class WorkerPoolTest(unittest.TestCase):
+    """The queue is bounded, unique per task and ordered by priority."""
+
+    def setUp(self):
+        self.pool = WorkerPool('test', 1, 2)
+        self.ran = []
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _run(self, task_id: str) -> None:
+        self.ran.append(task_id)
+
+    def _block(self, task_id: str) -> None:
+        self.release.wait(5)
+
+    def _occupy_worker(self) -> None:
+        started = threading.Event()
+        self.pool.submit('busy', lambda task_id: (started.set(), self._block(task_id)))
+        self.pool.start()
+        self.assertTrue(started.wait(5))
+
+    def _drain(self) -> None:
+        self.release.set()
+        done = threading.Event()
+        self.pool.submit('last', lambda task_id: done.set(), priority=99, force=True)
+        self.assertTrue(done.wait(5))
+
+    def test_bounded_queue(self):
+        self._occupy_worker()
+        self.assertTrue(self.pool.submit('a', self._run))
+        self.assertTrue(self.pool.submit('b', self._run))
+        with self.assertRaises(QueueFullError):
+            self.pool.submit('c', self._run)
+        self.assertEqual(self.pool.stats()['rejected'], 1)
+
+        # Re-queued tasks may go past the bound, but never twice
+        self.assertTrue(self.pool.submit('c', self._run, force=True))
+        self.assertFalse(self.pool.submit('c', self._run, force=True))
+        self.assertEqual(self.pool.stats()['queued'], 3)
+
+        self._drain()
+        self.assertEqual(self.ran, ['a', 'b', 'c'])
+        self.assertEqual(self.pool.stats()['started'], 5)
+
+    def test_priority(self):
+        self._occupy_worker()
+        self.pool.submit('later', self._run, priority=1)
+        self.pool.submit('first', self._run, priority=0)
+        self.pool.submit('second', self._run, priority=0, force=True)
+        self._drain()
+        self.assertEqual(self.ran, ['first', 'second', 'later'])
+
+    def test_close(self):
+        self._occupy_worker()
+        self.pool.submit('a', self._run)
+        self.assertEqual(self.pool.close(), ['a'])
+        self.assertFalse(self.pool.submit('b', self._run, force=True))
+        self.assertEqual(self.pool.stats()['queued'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.storage import SQLiteStorageBackend, JsonStorageBackend
+
+def _task(status: str = 'waiting', **fields) -> dict:
+    return {'key_name': 'k', 'status': status, 'task_type': 'get_video', 'url': 'https://example.com', **fields}
+
+class BackendChecks:
+    """Runs `_check` against both backends, each with a second instance as another process."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+
+    def _check(self, backend, other):
+        raise NotImplementedError
+
+    def test_sqlite(self):
+        path = os.path.join(self.workdir, 'db.sqlite')
+        self._check(SQLiteStorageBackend(path), SQLiteStorageBackend(path))
+
+    def test_json(self):
+        paths = [os.path.join(self.workdir, name) for name in ('tasks.json', 'keys.json', 'usage.json')]
+        self._check(JsonStorageBackend(*paths), JsonStorageBackend(*paths))
+
+class TransitionTaskTest(BackendChecks, unittest.TestCase):
+    """Only one worker claims a waiting task."""
+
+    def _check(self, backend, other):
+        backend.add_task('t', _task())
+        results = []
+        start = threading.Barrier(8)
+
+        def claim(storage, worker: int):
+            start.wait()
+            results.append((worker, storage.transition_task('t', 'waiting', 'processing', lease_owner=worker)))
+
+        threads = [threading.Thread(target=claim, args=((backend, other)[i % 2], i)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        winners = [worker for worker, claimed in results if claimed]
+        self.assertEqual(len(winners), 1)
+        task = other.get_task('t')
+        self.assertEqual((task['status'], task['lease_owner']), ('processing', winners[0]))
+
+        # Any of several statuses, and never a missing task
+        self.assertTrue(backend.transition_task('t', ('waiting', 'processing'), 'completed'))
+        self.assertFalse(backend.transition_task('t', ('waiting', 'processing'), 'error'))
+        self.assertFalse(backend.transition_task('missing', 'waiting', 'processing'))
+        self.assertEqual(other.get_task('t')['status'], 'completed')
+
+class LeaseTest(BackendChecks, unittest.TestCase):
+    """Leases are renewed by their owner and re-queue or fail the task once they run out."""
+
+    def _check(self, backend, other):
+        now = time.time()
+        backend.add_tasks({
+            'live': _task('processing', lease_owner='a', lease_expires=now + 60, attempts=1),
+            'retry': _task('processing', lease_owner='b', lease_expires=now - 1, attempts=1),
+            'spent': _task('processing', lease_owner='b', lease_expires=now - 1, attempts=3),
+            'cancelled': _task('processing', lease_owner='b', lease_expires=now - 1, attempts=1,
+                               cancel_requested=True),
+            'waiting': _task(),
+        })
+
+        self.assertEqual(other.renew_lease('live', 'a', now + 120)['lease_expires'], now + 120)
+        self.assertIsNone(other.renew_lease('live', 'b', now + 120))
+        self.assertIsNone(other.renew_lease('waiting', 'a', now + 120))
+
+        expired = other.expire_leases(now, 3, 'done')
+        self.assertEqual(set(expired), {'retry', 'spent', 'cancelled'})
+        tasks = backend.load_tasks()
+        self.assertEqual(tasks['live']['lease_expires'], now + 120)
+        self.assertEqual((tasks['retry']['status'], tasks['retry']['lease_owner']), ('waiting', None))
+        self.assertEqual((tasks['spent']['status'], tasks['spent']['error']), ('error', 'Task was interrupted'))
+        self.assertEqual(tasks['spent']['completed_time'], 'done')
+        self.assertEqual((tasks['cancelled']['status'], tasks['cancelled']['error']),
+                         ('error', 'Task was cancelled'))
+
+        # The owner of an expired lease has lost it, and the re-queued task is claimed afresh
+        self.assertIsNone(backend.renew_lease('retry', 'b', now + 60))
+        self.assertEqual(set(backend.find_waiting(['get_video'], 10)), {'waiting', 'retry'})
+        self.assertEqual(other.expire_leases(now, 3, 'done'), {})
+
+class GrantConnectionsTest(BackendChecks, unittest.TestCase):
+    """Connections are shared between the running downloads of all processes."""
+
+    def _check(self, backend, other):
+        backend.add_tasks({name: _task('processing') for name in ('a', 'b', 'c')})
+        backend.add_task('queued', _task())
+
+        # Even alone a download gets at most half; once all are taken, still one
+        self.assertEqual(backend.grant_connections('a', 16, 8), 4)
+        self.assertEqual(other.grant_connections('b', 16, 8), 4)
+        self.assertEqual(backend.grant_connections('c', 16, 8), 1)
+        self.assertEqual(other.get_task('c')['granted_connections'], 1)
+
+        # Grants of tasks that are not running do not count
+        self.assertEqual(other.grant_connections('queued', 2, 8), 1)
+        backend.transition_task('a', 'processing', 'waiting')
+        backend.update_task('b', granted_connections=None)
+        self.assertEqual(other.grant_connections('c', 16, 8), 4)
+        self.assertEqual(backend.grant_connections('b', 16, 8), 4)
+
+class MigrationTest(unittest.TestCase):
+    """A new SQLite database takes over the JSON files once."""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+
+    def _write(self, name: str, data: dict) -> str:
+        path = os.path.join(self.workdir, name)
+        with open(path, 'w') as f:
+            json.dump(data, f)
+        return path
+
+    def test_migrates_once(self):
+        tasks_file = self._write('tasks.json', {'t0': _task('completed'), 't1': _task()})
+        keys_file = self._write('keys.json', {'admin': {'key': 'secret', 'name': 'admin', 'permissions': []}})
+        database_file = os.path.join(self.workdir, 'db.sqlite')
+
+        backend = SQLiteStorageBackend(database_file, tasks_file, keys_file)
+        self.assertEqual(backend.get_task('t0')['status'], 'completed')
+        self.assertEqual(list(backend.find_waiting(['get_video'], 10)), ['t1'])
+        self.assertEqual(backend.find_key('secret')[0], 'admin')
+
+        # Later changes to the database are not overwritten by the files
+        backend.update_task('t1', status='processing')
+        backend.delete_key('admin')
+        backend = SQLiteStorageBackend(database_file, tasks_file, keys_file)
+        self.assertEqual(backend.get_task('t1')['status'], 'processing')
+        self.assertEqual(backend.find_key('secret'), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ydl_pool import YDLPool
+
+class DispatchTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = YDLPool({'download': {'quiet': True}})
+
+    def _call_from_thread(self, hook, status):
+        errors = []
+
+        def run():
+            try:
+                hook(status)
+            except Exception as e:
+                errors.append(e)
+
+        # Like yt-dlp's fragment download threads, which never touched the pool
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return errors
+
+    def test_progress_hooks_run_from_another_thread(self):
+        seen = []
+        with self.pool.acquire('download', progress_hooks=[seen.append]) as ydl:
+            dispatch = ydl.params['progress_hooks'][0]
+            errors = self._call_from_thread(dispatch, {'status': 'downloading'})
+        self.assertEqual(errors, [])
+        self.assertEqual(seen, [{'status': 'downloading'}])
+
+    def test_postprocessor_hooks_run_from_another_thread(self):
+        seen = []
+        with self.pool.acquire('download', postprocessor_hooks=[seen.append]) as ydl:
+            dispatch = ydl.params['postprocessor_hooks'][0]
+            errors = self._call_from_thread(dispatch, {'status': 'started'})
+        self.assertEqual(errors, [])
+        self.assertEqual(seen, [{'status': 'started'}])
+
+    def test_hooks_are_cleared_after_release(self):
+        seen = []
+        with self.pool.acquire('download', progress_hooks=[seen.append]) as ydl:
+            dispatch = ydl.params['progress_hooks'][0]
+        self._call_from_thread(dispatch, {'status': 'downloading'})
+        self.assertEqual(seen, [])
+
+    def test_threads_keep_their_own_hooks(self):
+        seen = {'main': [], 'other': []}
+        ready, done = threading.Event(), threading.Event()
+
+        def other():
+            with self.pool.acquire('download', progress_hooks=[seen['other'].append]) as ydl:
+                ydl.params['progress_hooks'][0]({'task': 'other'})
+                ready.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        ready.wait(5)
+        with self.pool.acquire('download', progress_hooks=[seen['main'].append]) as ydl:
+            ydl.params['progress_hooks'][0]({'task': 'main'})
+        done.set()
+        thread.join()
+        self.assertEqual(seen, {'main': [{'task': 'main'}], 'other': [{'task': 'other'}]})
+
+if __name__ == '__main__':
+    unittest.main()